@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (microbenchmarks)
+## Measures the building blocks of the IDERInote.py notification script outside
+## of a Checkmk site (using the cmk.notification_plugins stand-in of this
+## folder): parameter parsing, link building, message composition, JSON
+## serialization and end-to-end sends to a local stub IDERI note API.
+##
+## The results can be appended to a results file (--save) and compared with
+## the previous run (--compare) to catch performance regressions before a new
+## .mkp is released.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import argparse
+import contextlib
+import copy
+import importlib.util
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(BENCH_DIR)
+sys.path[:0] = [BENCH_DIR, os.path.join(PLUGIN_DIR, "lib", "python3")]
+
+from contexts import get_context  # noqa: E402
+from stubapi import StubApiServer  # noqa: E402
+
+
+def load_plugin(path=os.path.join(PLUGIN_DIR, "notifications", "IDERInote.py")):
+    """Imports the notification script as module 'IDERInote'."""
+
+    spec = importlib.util.spec_from_file_location("IDERInote", path)
+    plugin = importlib.util.module_from_spec(spec)
+    sys.modules["IDERInote"] = plugin
+    spec.loader.exec_module(plugin)
+    return plugin
+
+
+def get_benchmarks(plugin, api_url):
+    """Returns a dict name -> function without arguments measured by the suite."""
+
+    service = get_context("service_problem")
+    long_output = get_context("service_long_output")
+    host = get_context("host_problem")
+
+    template = plugin.parse_inote_message_params(service, copy.deepcopy(plugin.message))
+    template = plugin.add_link_to_inote_message(service, template)
+    template["TEXT"] = plugin.get_inote_message_text(dict(service))
+    serializable = dict(template, STARTTIMEUTC="2022-10-27T08:15:42", ENDTIMEUTC="2022-10-27T09:15:42")
+    from iderinote import encoder
+    compact = encoder.encode_message(template, plugin.message_defaults)
+    if not encoder.is_equivalent(compact, template, plugin.message_defaults):
+        raise AssertionError("The compact payload differs from the full payload")
+
+    def send(context, http_client):
+        def run():
+            plugin.http_client = http_client
+            message = dict(template, RECIPIENT=list(template["RECIPIENT"]))
+            message["TEXT"] = plugin.get_inote_message_text(context)
+            return plugin.send_inote_message(api_url, "note\\checkmk", "secret", False, message)
+        return run
+
+    return {
+        "parse_params": lambda: plugin.parse_inote_message_params(service, dict(plugin.message)),
+        "add_link_host": lambda: plugin.add_link_to_inote_message(host, dict(template)),
+        "add_link_service": lambda: plugin.add_link_to_inote_message(service, dict(template)),
+        "text_host": lambda: plugin.get_inote_message_text(host),
+        "text_service": lambda: plugin.get_inote_message_text(service),
+        "text_long_output": lambda: plugin.get_inote_message_text(long_output),
+        "priority": lambda: plugin.get_inote_priority_from_state(service),
+        "json_serialize": lambda: json.dumps(serializable).encode("utf-8"),
+        "json_compact": lambda: encoder.encode_message(template, plugin.message_defaults),
+        "send_requests": send(service, "requests"),
+        "send_httpclient": send(service, "httpclient"),
+        "send_httpclient_long_output": send(long_output, "httpclient"),
+    }
+
+
+def measure(func, min_time, repeat):
+    """Returns the median time (seconds) per call over 'repeat' rounds of at least 'min_time' seconds."""
+
+    # find a number of calls per round taking at least min_time
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_time / elapsed * 1.2))
+
+    rounds = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) / number)
+    return statistics.median(rounds)
+
+
+def get_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PLUGIN_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def load_previous(results_file):
+    try:
+        with open(results_file) as f:
+            lines = [line for line in f if line.strip()]
+    except OSError:
+        return None
+    return json.loads(lines[-1]) if lines else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the IDERInote.py notification script.")
+    parser.add_argument("-k", "--filter", default="",
+                        help="Only run benchmarks whose name contains this string.")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="Minimum duration of one round in seconds (default: %(default)s).")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of rounds per benchmark (default: %(default)s).")
+    parser.add_argument("--results", default=os.path.join(BENCH_DIR, "results.jsonl"),
+                        help="File the results are appended to / compared with (default: %(default)s).")
+    parser.add_argument("--save", action="store_true",
+                        help="Append the results to the results file.")
+    parser.add_argument("--compare", action="store_true",
+                        help="Compare with the last saved results, exit with 1 on a regression.")
+    parser.add_argument("--tolerance", type=float, default=20.0,
+                        help="Slowdown in percent reported as regression (default: %(default)s).")
+    args = parser.parse_args(argv)
+
+    plugin = load_plugin()
+    server = StubApiServer().start()
+    previous = load_previous(args.results) if args.compare else None
+
+    results = {}
+    regressions = []
+    print("%-30s %14s %14s" % ("benchmark", "time/call", "previous"))
+    try:
+        for name, func in get_benchmarks(plugin, server.url).items():
+            if args.filter not in name:
+                continue
+            # the script writes its result to stdout, keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                results[name] = measure(func, args.min_time, args.repeat)
+            line = "%-30s %11.2f us" % (name, results[name] * 1e6)
+            if previous and name in previous["results"]:
+                old = previous["results"][name]
+                change = (results[name] - old) / old * 100
+                line += " %11.2f us %+6.1f%%" % (old * 1e6, change)
+                if change > args.tolerance:
+                    regressions.append(name)
+                    line += "  REGRESSION"
+            print(line)
+    finally:
+        server.stop()
+
+    if args.save:
+        with open(args.results, "a") as f:
+            f.write(json.dumps({
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "revision": get_revision(),
+                "python": platform.python_version(),
+                "results": results,
+            }) + "\n")
+
+    if regressions:
+        print("Slower than the previous run by more than %g%%: %s" % (args.tolerance, ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (benchmarks)
+## Stand-in for cmk.notification_plugins.utils to run IDERInote.py outside of a
+## Checkmk site. Provides the functions the notification script uses.
+
+from iderinote.notify_utils import (  # noqa: F401
+    collect_context,
+    read_bulk_contexts,
+    substitute_context,
+)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (benchmarks)
+## Realistic notification contexts as passed by Checkmk (without the NOTIFY_
+## prefix) for the benchmarks.
+
+PARAMETERS = {
+    "PARAMETER_INOTE_API_URL": "https://inote.example.com/IDERInote/api",
+    "PARAMETER_INOTE_API_USERNAME": "note\\checkmk",
+    "PARAMETER_INOTE_API_USERPASS": "secret",
+    "PARAMETER_INOTE_PLUGIN_LOGLEVEL": "1",
+    "PARAMETER_INOTE_MSG_ADDRESSINGMODE": "UserAndComputer",
+    "PARAMETER_INOTE_MSG_DURATION": "60",
+    "PARAMETER_INOTE_MSG_RECIPIENT": "note\\GRP-IT, note\\GRP-NOC, note\\homer.simpson",
+    "PARAMETER_INOTE_MSG_EXCLUDE": "note\\GRP-IT-Trainees",
+    "PARAMETER_INOTE_MSG_POPUP_OR_FS_SELECTION": "showpopup",
+    "PARAMETER_INOTE_MSG_SHOWTICKER": "True",
+    "PARAMETER_INOTE_MSG_NOTIFYRECEIVE": "True",
+    "PARAMETER_INOTE_MSG_NOTIFYACKNOWLEDGE": "True",
+    "PARAMETER_CHECKMKURL": "https://monitoring.example.com",
+}
+
+COMMON = {
+    "OMD_SITE": "mysite",
+    "OMD_ROOT": "/omd/sites/mysite",
+    "CONTACTNAME": "inote",
+    "CONTACTS": "inote",
+    "DATE": "2022-10-27",
+    "LONGDATETIME": "Thu Oct 27 10:15:42 CEST 2022",
+    "SHORTDATETIME": "2022-10-27 10:15:42",
+    "MICROTIME": "1666858542123456",
+    "MONITORING_HOST": "monitoring.example.com",
+    "HOSTNAME": "srv-dc01",
+    "HOSTALIAS": "srv-dc01.corp.example.com",
+    "HOSTADDRESS": "192.0.2.10",
+    "HOST_ADDRESS_4": "192.0.2.10",
+    "HOST_ADDRESS_6": "2001:db8::10",
+    "HOST_ADDRESS_FAMILY": "4",
+    "HOSTGROUPNAMES": "windows-servers domain-controllers",
+    "HOSTTAGS": "/wato/ cmk-agent ip-v4 ip-v4-only prod site:mysite tcp windows",
+    "HOSTURL": "/check_mk/index.py?start_url=view.py%3Fview_name%3Dhoststatus%26host%3Dsrv-dc01%26site%3Dmysite",
+    "HOSTCHECKCOMMAND": "check-mk-host-smart",
+    "HOSTPERFDATA": "rta=0.412ms;200.000;500.000;0; pl=0%;80;100;; rtmax=0.592ms;;;; rtmin=0.311ms;;;;",
+    "LASTHOSTSTATE": "UP",
+    "LASTHOSTSTATECHANGE": "1666771342",
+    "LASTHOSTUP": "1666858482",
+    "NOTIFICATIONAUTHOR": "",
+    "NOTIFICATIONCOMMENT": "",
+}
+
+HOST_PROBLEM = dict(COMMON, **{
+    "WHAT": "HOST",
+    "NOTIFICATIONTYPE": "PROBLEM",
+    "HOSTSTATE": "DOWN",
+    "HOSTSTATEID": "1",
+    "HOSTSHORTSTATE": "DOWN",
+    "PREVIOUSHOSTHARDSTATE": "UP",
+    "PREVIOUSHOSTHARDSHORTSTATE": "UP",
+    "HOSTOUTPUT": "CRIT - 192.0.2.10: rta nan, lost 100%",
+    "HOSTPROBLEMID": "4711",
+    "HOSTNOTIFICATIONNUMBER": "1",
+})
+
+SERVICE_PROBLEM = dict(COMMON, **{
+    "WHAT": "SERVICE",
+    "NOTIFICATIONTYPE": "PROBLEM",
+    "HOSTSTATE": "UP",
+    "HOSTSHORTSTATE": "UP",
+    "SERVICEDESC": "CPU load",
+    "SERVICESTATE": "CRITICAL",
+    "SERVICESTATEID": "2",
+    "SERVICESHORTSTATE": "CRIT",
+    "PREVIOUSSERVICEHARDSTATE": "OK",
+    "PREVIOUSSERVICEHARDSHORTSTATE": "OK",
+    "SERVICEOUTPUT": "15 min load: 42.00 (warn/crit at 8.00/16.00) (CRIT), 15 min load per core: 5.25",
+    "LONGSERVICEOUTPUT": "1 min load: 44.12\\n5 min load: 43.01\\n15 min load: 42.00",
+    "SERVICEPERFDATA": "load1=44.12;;;0;8 load5=43.01;;;0;8 load15=42;8;16;0;8",
+    "SERVICECHECKCOMMAND": "check_mk-cpu_loads",
+    "SERVICEURL": "/check_mk/index.py?start_url=view.py%3Fview_name%3Dservice%26host%3Dsrv-dc01%26service%3DCPU%20load%26site%3Dmysite",
+    "SERVICEPROBLEMID": "4712",
+    "SERVICENOTIFICATIONNUMBER": "1",
+})
+
+# Some checks (logwatch, event console, ...) produce kilobytes of output
+SERVICE_LONG_OUTPUT = dict(SERVICE_PROBLEM, **{
+    "SERVICEDESC": "Log Application",
+    "SERVICEOUTPUT": "\n".join(
+        "CRIT: 2022-10-27 10:%02d:%02d Application error in module crm_sync.%d: "
+        "connection to database srv-sql04\\crm timed out after 30000 ms (retry %d of 5)"
+        % (i // 60, i % 60, i, i % 5 + 1)
+        for i in range(60)
+    ),
+})
+
+SERVICE_RECOVERY = dict(SERVICE_PROBLEM, **{
+    "NOTIFICATIONTYPE": "RECOVERY",
+    "SERVICESTATE": "OK",
+    "SERVICESTATEID": "0",
+    "SERVICESHORTSTATE": "OK",
+    "PREVIOUSSERVICEHARDSTATE": "CRITICAL",
+    "PREVIOUSSERVICEHARDSHORTSTATE": "CRIT",
+    "SERVICEOUTPUT": "15 min load: 1.20, 15 min load per core: 0.15",
+})
+
+CONTEXTS = {
+    "host_problem": HOST_PROBLEM,
+    "service_problem": SERVICE_PROBLEM,
+    "service_long_output": SERVICE_LONG_OUTPUT,
+    "service_recovery": SERVICE_RECOVERY,
+}
+
+
+def get_context(name, **parameters):
+    """Returns a copy of a named context including the rule parameters."""
+    context = dict(CONTEXTS[name], **PARAMETERS)
+    context.update(parameters)
+    return context
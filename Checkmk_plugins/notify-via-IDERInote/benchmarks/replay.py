@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (replay and load generation)
+## Replays captured notification contexts through the real IDERInote.py
+## notification script (one process per notification, like Checkmk does)
+## against a local stand-in for the IDERI note API and reports throughput and
+## latency percentiles.
+##
+## Contexts are captured
+##   - from the notify.log trace output (log level 'Trace'):
+##       replay.py capture --notify-log ~/var/log/notify.log -o contexts.jsonl
+##   - or with the rule option 'Dump notification contexts' which appends
+##     every context to ~/var/inote/contexts.jsonl.
+##
+## Example: 200 notifications at 20/s, at most 16 at a time, slow API:
+##   replay.py run contexts.jsonl --count 200 --rate 20 --concurrency 16 --api-latency 0.3
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(BENCH_DIR)
+
+from stubapi import StubApiServer  # noqa: E402
+
+TRACE_START = "TRACE: Values passed to script (NOTIFY_ env variables):"
+TRACE_END = "TRACE: --- END NOTIFY_ VARIABLES ---"
+
+
+def capture_from_notify_log(lines):
+    """Extracts the notification contexts from the trace output in a notify.log.
+
+    Args:
+        lines (iterable): The lines of the notify.log.
+
+    Yields:
+        dict: One context per notification found.
+    """
+
+    context = None
+    for line in lines:
+        pos = line.find("TRACE: ")
+        if pos < 0:
+            continue
+        line = line[pos:].rstrip("\n")
+        if line == TRACE_START:
+            context = {}
+        elif line == TRACE_END:
+            if context:
+                yield context
+            context = None
+        elif context is not None and "=" in line:
+            key, value = line[len("TRACE: "):].split("=", 1)
+            context[key] = value
+
+
+def load_contexts(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_notification(script, env, context):
+    """Runs the notification script for one context. Returns: exit code"""
+
+    env = dict(env, **{"NOTIFY_" + key: value for key, value in context.items()})
+    return subprocess.run([sys.executable, script], env=env, stdin=subprocess.DEVNULL,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+
+
+def percentile(quantiles, p):
+    return quantiles[p - 1] if quantiles else 0.0
+
+
+def cmd_capture(args):
+    with open(args.notify_log, errors="replace") as f:
+        contexts = list(capture_from_notify_log(f))
+    with open(args.output, "w") as f:
+        for context in contexts:
+            f.write(json.dumps(context) + "\n")
+    print("Captured %d notification contexts to %s." % (len(contexts), args.output))
+    return 0
+
+
+def cmd_run(args):
+    contexts = load_contexts(args.contexts)
+    if not contexts:
+        sys.exit("No notification contexts in %s." % args.contexts)
+
+    server = StubApiServer(latency=args.api_latency, jitter=args.api_jitter,
+                           failure_rate=args.api_failure_rate, failure_status=args.api_failure_status).start()
+    state_dir = tempfile.mkdtemp(prefix="inote-replay-")
+    env = dict(os.environ, **{
+        "PYTHONPATH": os.pathsep.join(args.pythonpath + [os.environ.get("PYTHONPATH", "")]),
+        # keep the state, spool and metrics of the site untouched
+        "INOTE_STATE_DIR": os.path.join(state_dir, "state"),
+        "INOTE_SPOOL_DIR": os.path.join(state_dir, "spool"),
+        "NOTIFY_PARAMETER_INOTE_API_URL": server.url,
+        "NOTIFY_PARAMETER_INOTE_API_USERNAME": "note\\replay",
+        "NOTIFY_PARAMETER_INOTE_API_USERPASS": "replay",
+    })
+    # the rule parameters of the captured contexts must not point to the real API
+    overrides = {key[len("NOTIFY_"):]: env[key] for key in env if key.startswith("NOTIFY_PARAMETER_INOTE_API_")}
+    # nor flood the notify.log or dump the replayed contexts again
+    overrides["PARAMETER_INOTE_PLUGIN_LOGLEVEL"] = "1"
+    overrides["PARAMETER_INOTE_PLUGIN_DUMPCONTEXT"] = "False"
+
+    latencies = []
+    failures = [0]
+    lock = threading.Lock()
+
+    def run(scheduled, context):
+        returncode = run_notification(args.script, env, dict(context, **overrides))
+        # measured from the scheduled start, so queueing in the pool counts, too
+        latency = time.perf_counter() - scheduled
+        with lock:
+            latencies.append(latency)
+            if returncode != 0:
+                failures[0] += 1
+
+    interval = 1.0 / args.rate if args.rate else 0.0
+    print("Replaying %d notifications (%s/s, concurrency %d) against %s..." % (
+        args.count, args.rate or "max", args.concurrency, server.url))
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for i, context in enumerate(itertools.islice(itertools.cycle(contexts), args.count)):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run, max(scheduled, start), context)
+    duration = time.perf_counter() - start
+    server.stop()
+
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    print("Notifications:  %d (%d failed)" % (len(latencies), failures[0]))
+    print("API requests:   %d (%d simulated failures, %d bytes)" % (server.received, server.failed, server.received_bytes))
+    print("Duration:       %.2f s" % duration)
+    print("Throughput:     %.1f notifications/s" % (len(latencies) / duration))
+    print("Latency p50:    %.1f ms" % (percentile(quantiles, 50) * 1000))
+    print("Latency p95:    %.1f ms" % (percentile(quantiles, 95) * 1000))
+    print("Latency p99:    %.1f ms" % (percentile(quantiles, 99) * 1000))
+    print("Latency max:    %.1f ms" % (max(latencies) * 1000))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replays notification contexts through IDERInote.py.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    capture = subparsers.add_parser("capture", help="Extract notification contexts from the notify.log trace output.")
+    capture.add_argument("--notify-log", default=os.path.join(os.environ.get("OMD_ROOT", ""), "var", "log", "notify.log"),
+                         help="The notify.log to read (default: %(default)s).")
+    capture.add_argument("-o", "--output", default="contexts.jsonl",
+                         help="File the contexts are written to (default: %(default)s).")
+    capture.set_defaults(func=cmd_capture)
+
+    run = subparsers.add_parser("run", help="Replay captured notification contexts.")
+    run.add_argument("contexts", help="The captured contexts (one JSON object per line).")
+    run.add_argument("--script", default=os.path.join(PLUGIN_DIR, "notifications", "IDERInote.py"),
+                     help="The notification script (default: %(default)s).")
+    run.add_argument("--pythonpath", action="append",
+                     default=[os.path.join(PLUGIN_DIR, "lib", "python3"), BENCH_DIR],
+                     help="Directories for the PYTHONPATH of the script (default: the library of this "
+                          "repository and the cmk.notification_plugins stand-in).")
+    run.add_argument("-n", "--count", type=int, default=100,
+                     help="Number of notifications, the contexts are repeated as needed (default: %(default)s).")
+    run.add_argument("--rate", type=float, default=0.0,
+                     help="Notifications started per second, 0 for as fast as possible (default: %(default)s).")
+    run.add_argument("-c", "--concurrency", type=int, default=4,
+                     help="Maximum number of notification processes at a time (default: %(default)s).")
+    run.add_argument("--api-latency", type=float, default=0.0,
+                     help="Seconds the stand-in API delays every answer (default: %(default)s).")
+    run.add_argument("--api-jitter", type=float, default=0.0,
+                     help="Additional random delay of up to this many seconds (default: %(default)s).")
+    run.add_argument("--api-failure-rate", type=float, default=0.0,
+                     help="Share (0..1) of messages the stand-in API rejects (default: %(default)s).")
+    run.add_argument("--api-failure-status", type=int, default=503,
+                     help="HTTP status of the rejected messages (default: %(default)s).")
+    run.set_defaults(func=cmd_run)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
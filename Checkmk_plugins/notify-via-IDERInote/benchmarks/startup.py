@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (startup benchmark)
+## Measures the startup cost of the IDERInote.py notification script: the time
+## to import it and the time from starting the process until the first byte of
+## the request reaches the (local stub) IDERI note API, for the default mode,
+## the http.client sender and the fast startup mode.
+##
+## Run it in the site (uses the installed Checkmk libraries, pass
+## --pythonpath "" there) or from the repo, where the cmk.notification_plugins
+## stand-in of this folder is used.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import argparse
+import http.server
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "default": {},
+    "httpclient": {"NOTIFY_PARAMETER_INOTE_API_HTTPCLIENT": "httpclient"},
+    "fast": {"INOTE_FAST_STARTUP": "1"},
+}
+
+CONTEXT = {
+    "NOTIFY_PARAMETER_INOTE_API_USERNAME": "note\\checkmk",
+    "NOTIFY_PARAMETER_INOTE_API_USERPASS": "secret",
+    "NOTIFY_PARAMETER_INOTE_PLUGIN_LOGLEVEL": "1",
+    "NOTIFY_PARAMETER_INOTE_MSG_RECIPIENT": "note\\GRP-IT",
+    "NOTIFY_PARAMETER_INOTE_MSG_DURATION": "60",
+    "NOTIFY_PARAMETER_INOTE_MSG_ADDRESSINGMODE": "UserOnly",
+    "NOTIFY_WHAT": "SERVICE",
+    "NOTIFY_NOTIFICATIONTYPE": "PROBLEM",
+    "NOTIFY_HOSTNAME": "srv01",
+    "NOTIFY_HOSTALIAS": "srv01.example.com",
+    "NOTIFY_HOST_ADDRESS_4": "192.0.2.10",
+    "NOTIFY_HOST_ADDRESS_6": "",
+    "NOTIFY_SERVICEDESC": "CPU load",
+    "NOTIFY_SERVICESTATE": "CRITICAL",
+    "NOTIFY_SERVICESHORTSTATE": "CRIT",
+    "NOTIFY_PREVIOUSSERVICEHARDSHORTSTATE": "OK",
+    "NOTIFY_SERVICEOUTPUT": "15 min load: 42.00 (warn/crit at 8.00/16.00)",
+    "NOTIFY_OMD_SITE": "mysite",
+}
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    arrivals = []
+
+    def do_POST(self):
+        StubHandler.arrivals.append(time.perf_counter())
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def measure_import_baseline():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return time.perf_counter() - start
+
+
+def measure_import(script, env):
+    code = "import importlib.util, sys; spec = importlib.util.spec_from_file_location('IDERInote', sys.argv[1]); spec.loader.exec_module(importlib.util.module_from_spec(spec))"
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code, script], env=env, check=True)
+    return time.perf_counter() - start
+
+
+def measure_send(script, env):
+    start = time.perf_counter()
+    del StubHandler.arrivals[:]
+    subprocess.run([sys.executable, script], env=env, check=True, stdout=subprocess.DEVNULL)
+    end = time.perf_counter()
+    return StubHandler.arrivals[0] - start, end - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Startup benchmark for the IDERInote.py notification script.")
+    parser.add_argument("--script", default=os.path.join(PLUGIN_DIR, "notifications", "IDERInote.py"),
+                        help="The notification script to measure (default: %(default)s).")
+    parser.add_argument("--pythonpath", action="append",
+                        default=[os.path.join(PLUGIN_DIR, "lib", "python3"), os.path.dirname(os.path.abspath(__file__))],
+                        help="Additional directories for the PYTHONPATH of the script (default: the library "
+                             "of this repository and the cmk.notification_plugins stand-in of this folder).")
+    parser.add_argument("-n", "--runs", type=int, default=20,
+                        help="Number of runs per mode (default: %(default)s).")
+    parser.add_argument("--mode", action="append", choices=sorted(MODES),
+                        help="Only measure these modes (default: all).")
+    args = parser.parse_args(argv)
+
+    server = http.server.HTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    baseline = min(measure_import_baseline() for _ in range(args.runs))
+    print("Interpreter startup (python3 -c pass): %.1f ms" % (baseline * 1000))
+    print("%-12s %12s %12s %12s" % ("mode", "import [ms]", "ttfb [ms]", "total [ms]"))
+    for mode in args.mode or sorted(MODES):
+        env = dict(os.environ, **CONTEXT, **MODES[mode])
+        env["NOTIFY_PARAMETER_INOTE_API_URL"] = "http://127.0.0.1:%d/api" % server.server_port
+        env["PYTHONPATH"] = os.pathsep.join(args.pythonpath + [os.environ.get("PYTHONPATH", "")])
+        try:
+            imports = [measure_import(args.script, env) for _ in range(args.runs)]
+            sends = [measure_send(args.script, env) for _ in range(args.runs)]
+        except subprocess.CalledProcessError:
+            print("%-12s skipped (script failed, is cmk.notification_plugins importable?)" % mode)
+            continue
+        print("%-12s %12.1f %12.1f %12.1f" % (
+            mode,
+            statistics.median(imports) * 1000,
+            statistics.median(t for t, _ in sends) * 1000,
+            statistics.median(t for _, t in sends) * 1000,
+        ))
+    server.shutdown()
+    return 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (benchmarks)
+## Local stand-in for the IDERI note API. Accepts every message posted to
+## /v1/messages and answers with 200 and the index of the message, updates
+## and deletions of messages are answered with 200 as well. Can simulate slow
+## and failing responses.
+
+import http.server
+import itertools
+import json
+import random
+import threading
+import time
+
+
+class StubApiHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.received += 1
+        self.server.received_bytes += len(body)
+        if self.server.latency or self.server.jitter:
+            time.sleep(self.server.latency + random.uniform(0, self.server.jitter))
+        if random.random() < self.server.failure_rate:
+            self.server.failed += 1
+            self._answer(self.server.failure_status, {"Message": "Simulated failure"})
+            return
+        self._answer(200, {"INDEX": next(self.server.ids)})
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.updated += 1
+        self._answer(200, {})
+
+    def do_DELETE(self):
+        self.server.updated += 1
+        self._answer(200, {})
+
+    def _answer(self, status, data):
+        response = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubApiServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), handler=StubApiHandler,
+                 latency=0.0, jitter=0.0, failure_rate=0.0, failure_status=503):
+        super().__init__(address, handler)
+        self.ids = itertools.count(1)
+        self.received = 0
+        self.received_bytes = 0
+        self.failed = 0
+        self.updated = 0
+        # seconds every answer is delayed, plus up to 'jitter' seconds
+        self.latency = latency
+        self.jitter = jitter
+        # share (0..1) of the messages answered with failure_status
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+
+    @property
+    def url(self):
+        """The API URL as configured in the notification rule."""
+        return "http://%s:%d/IDERInote/api" % self.server_address
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
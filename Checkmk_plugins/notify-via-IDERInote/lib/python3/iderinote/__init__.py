@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (library)
+## Helper modules shared by the IDERInote.py notification script and the
+## notify-via-IDERInote tools (forwarder, ...).
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (breaker)
+## Circuit breaker for the IDERI note API shared by all concurrently running
+## notification processes. After a number of consecutive failures the
+## circuit opens and messages fail (or are spooled) immediately instead of
+## every process waiting for its own timeout. After the cooldown one process
+## is let through as probe (half open), its result closes or reopens the
+## circuit.
+##
+## The state is kept per API URL in a small state file. While the circuit
+## is closed and the API answers, the file is only read (without lock).
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import time
+
+from iderinote.state import locked_state, read_state
+
+STATE_FILE = "breaker.json"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _is_closed(entry):
+    return entry is None or (entry["state"] == CLOSED and entry["failures"] == 0)
+
+
+def allow_request(url, cooldown):
+    """Checks if a request to the API may be made.
+
+    Args:
+        url (str): The API URL.
+        cooldown (int): Seconds the circuit stays open before a probe is let through.
+
+    Returns:
+        bool: False if the circuit is open (or another process is probing).
+    """
+
+    entry = read_state(STATE_FILE).get(url)
+    if entry is None or entry["state"] == CLOSED:
+        return True
+
+    now = time.time()
+    with locked_state(STATE_FILE) as state:
+        entry = state.get(url)
+        if entry is None or entry["state"] == CLOSED:
+            return True
+        # A probe that did not report back within the cooldown is replaced
+        if now - entry["since"] < cooldown:
+            return False
+        entry["state"] = HALF_OPEN
+        entry["since"] = now
+        return True
+
+
+def record_result(url, success, threshold):
+    """Records the result of a request to the API.
+
+    Args:
+        url (str): The API URL.
+        success (bool): Whether the API answered (failures are connection errors and server errors).
+        threshold (int): Consecutive failures opening the circuit.
+
+    Returns:
+        str: The state of the circuit after the request.
+    """
+
+    if success and _is_closed(read_state(STATE_FILE).get(url)):
+        return CLOSED
+
+    now = time.time()
+    with locked_state(STATE_FILE) as state:
+        entry = state.setdefault(url, {"state": CLOSED, "failures": 0, "since": now})
+        if success:
+            entry.update(state=CLOSED, failures=0, since=now)
+        elif entry["state"] == HALF_OPEN:
+            entry.update(state=OPEN, since=now)
+        else:
+            entry["failures"] += 1
+            if entry["state"] == CLOSED and entry["failures"] >= threshold:
+                entry.update(state=OPEN, since=now)
+        return entry["state"]
+
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (coalesce)
+## Event storm coalescing and flap suppression keyed on host/service. Drops
+## exact duplicates, collapses flapping into the FLAPPINGSTART message and
+## suppresses rapid PROBLEM/RECOVERY sequences within a time window. The next
+## message sent for the host/service reports how many were suppressed.
+## A RECOVERY is always sent if the last PROBLEM of the host/service has been
+## sent, so the clients never keep showing an alert of a suppressed flap.
+## Every key expires with the window of the rule which saw it last.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import hashlib
+import heapq
+import time
+
+from iderinote.state import locked_state
+
+STATE_FILE = "coalesce.json"
+
+# Bounds the state file, the least recently seen keys are evicted first
+MAX_ENTRIES = 5000
+
+# Flapping keys are kept until FLAPPINGSTOP but not longer than this (seconds)
+FLAPPING_TTL = 86400
+
+
+def get_event_digest(context):
+    """Returns a hash identifying an event. Two events with the same digest are duplicates."""
+
+    what = context.get("WHAT", "HOST")
+    fields = (
+        what,
+        context.get("NOTIFICATIONTYPE", ""),
+        context.get(what + "STATE", ""),
+        context.get(what + "OUTPUT", ""),
+    )
+    return hashlib.sha1("\0".join(fields).encode("utf-8")).hexdigest()
+
+
+def _evict(state, now):
+    for key in [k for k, e in state.items() if e.get("expires", 0.0) < now]:
+        del state[key]
+    if len(state) > MAX_ENTRIES:
+        for key in heapq.nsmallest(len(state) - MAX_ENTRIES, state, key=lambda k: state[k]["seen"]):
+            del state[key]
+
+
+def check_event(key, context, window, max_changes):
+    """Decides if the notification for an event should be sent.
+
+    Args:
+        key (str): The key of the host/service (and recipient set) the event belongs to.
+        context (dict): The notification context of the event.
+        window (int): The coalescing time window in seconds.
+        max_changes (int): Maximum PROBLEM/RECOVERY notifications per key within the window.
+
+    Returns:
+        tuple: (send, suppressed, since) - whether to send the notification, the number of
+            notifications suppressed for the key before and the time the first one was suppressed.
+    """
+
+    now = time.time()
+    notification_type = context.get("NOTIFICATIONTYPE", "")
+    digest = get_event_digest(context)
+
+    with locked_state(STATE_FILE) as state:
+        _evict(state, now)
+        entry = state.setdefault(key, {
+            "seen": now, "sent": 0.0, "digest": "", "changes": [],
+            "flapping": False, "suppressed": 0, "since": now, "shown": "",
+        })
+        entry["seen"] = now
+        entry["changes"] = [t for t in entry["changes"] if now - t <= window]
+
+        if entry["digest"] == digest and now - entry["sent"] <= window:
+            send = False
+        elif notification_type.startswith("FLAP"):
+            if "START" in notification_type:
+                send = not entry["flapping"]
+                entry["flapping"] = True
+            else:
+                send = True
+                entry["flapping"] = False
+        elif notification_type in ("PROBLEM", "RECOVERY"):
+            entry["changes"].append(now)
+            send = not entry["flapping"] and len(entry["changes"]) <= max_changes
+            # The RECOVERY ending a suppressed flap replaces the PROBLEM shown last
+            if notification_type == "RECOVERY" and entry.get("shown") == "PROBLEM":
+                send = True
+        else:
+            send = True
+
+        entry["expires"] = now + (FLAPPING_TTL if entry["flapping"] else window)
+
+        if not send:
+            if entry["suppressed"] == 0:
+                entry["since"] = now
+            entry["suppressed"] += 1
+            return False, 0, 0.0
+
+        suppressed, since = entry["suppressed"], entry["since"]
+        entry.update(sent=now, digest=digest, suppressed=0)
+        if notification_type in ("PROBLEM", "RECOVERY"):
+            entry["shown"] = notification_type
+        return True, suppressed, since
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (directory)
+## Cached lookups of the IDERI note server directory: the ids of the network
+## ranges (NETWORKRANGEIDS) by name and whether the recipients of a message
+## exist. The notification script only reads the cached table, it never
+## waits for the API. Missing or outdated entries are fetched by a
+## background process forked by the notification script, by a thread of the
+## multi-threaded gateway (which must not fork) or by
+## 'inote-directory-refresh' from cron, outdated entries are used until
+## then.
+##
+## Table per API URL in the state directory (directory-<hash>.json):
+##   {"networkranges": {"fetched": <time>, "ids": {<lower case name>: <id>}},
+##    "recipients": {<lower case name>: [<valid>, <checked>]},
+##    "pending": [<recipients to check>], "refreshing": <time>}
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import quote
+
+from iderinote.state import locked_state, read_state
+
+NETWORKRANGES_PATH = "/v1/networkranges"
+RECIPIENTS_PATH = "/v1/recipients/"
+
+# Entries older than this (seconds) are refreshed in the background
+NETWORKRANGE_TTL = 3600
+RECIPIENT_TTL = 86400
+
+# A failed (or hanging) refresh is retried after this time (seconds)
+REFRESH_TIMEOUT = 120
+
+# Unknown network ranges refresh a table at most this often (seconds)
+MIN_REFRESH_INTERVAL = 60
+
+# Bounds the recipients checked (and kept) per table
+MAX_RECIPIENTS = 5000
+
+
+def get_table_name(api_url):
+    """Returns the name of the state file holding the table of an API URL."""
+    return "directory-" + hashlib.sha1(api_url.encode("utf-8")).hexdigest()[:16] + ".json"
+
+
+def resolve_network_ranges(api_url, names, now=None):
+    """Looks up the ids of network ranges in the cached table.
+
+    Args:
+        api_url (str): The IDERI note API URL.
+        names (list): Names (or numeric ids) of the network ranges.
+
+    Returns:
+        tuple: (ids, unknown, refresh) - the ids of the resolved ranges, the
+            names not found and whether the table should be refreshed. Unknown
+            names are only unknown for sure if no refresh is due.
+    """
+
+    now = now or time.time()
+    table = read_state(get_table_name(api_url)).get("networkranges")
+    ranges = table["ids"] if table else {}
+    ids = []
+    unknown = []
+    for name in names:
+        if name.isdigit():
+            ids.append(int(name))
+        elif name.lower() in ranges:
+            ids.append(ranges[name.lower()])
+        else:
+            unknown.append(name)
+    if not table:
+        return ids, unknown, True
+    age = now - table["fetched"]
+    refresh = age > NETWORKRANGE_TTL or (bool(unknown) and age > MIN_REFRESH_INTERVAL)
+    return ids, unknown, refresh
+
+
+def check_recipients(api_url, recipients, now=None):
+    """Looks up the recipients in the cached table.
+
+    Args:
+        api_url (str): The IDERI note API URL.
+        recipients (list): The recipients of a message.
+
+    Returns:
+        tuple: (invalid, pending) - the recipients known not to exist and the
+            recipients not (or no longer recently) checked.
+    """
+
+    now = now or time.time()
+    known = read_state(get_table_name(api_url)).get("recipients", {})
+    invalid = []
+    pending = []
+    for recipient in recipients:
+        entry = known.get(recipient.lower())
+        if entry is None or now - entry[1] > RECIPIENT_TTL:
+            pending.append(recipient)
+        if entry is not None and not entry[0]:
+            invalid.append(recipient)
+    return invalid, pending
+
+
+def request_refresh(api_url, recipients=(), now=None):
+    """Queues recipients to check and claims the refresh of the table.
+
+    Returns:
+        bool: True if the caller should run the refresh, False if another
+            process is refreshing the table already.
+    """
+
+    now = now or time.time()
+    with locked_state(get_table_name(api_url)) as table:
+        pending = table.setdefault("pending", [])
+        for recipient in recipients:
+            if recipient.lower() not in pending:
+                pending.append(recipient.lower())
+        del pending[:-MAX_RECIPIENTS]
+        if now - table.get("refreshing", 0) < REFRESH_TIMEOUT:
+            return False
+        table["refreshing"] = now
+        return True
+
+
+def refresh(api_url, user, password, verify, timeout=(5, 30)):
+    """Fetches the network ranges and checks the queued recipients.
+
+    Raises:
+        OSError: The connection to the API failed.
+        ValueError: The API answered with an unexpected response.
+    """
+
+    from iderinote import httpclient
+
+    status, text = httpclient.request("GET", api_url + NETWORKRANGES_PATH, user, password, verify, timeout=timeout)
+    if status != 200:
+        raise ValueError("Fetching the network ranges failed. Status: {}, Response: {}".format(status, text[:200]))
+    ids = {}
+    for networkRange in json.loads(text):
+        name = networkRange.get("NAME", networkRange.get("Name"))
+        index = networkRange.get("ID", networkRange.get("INDEX"))
+        if name is not None and index is not None:
+            ids[str(name).lower()] = index
+
+    pending = read_state(get_table_name(api_url)).get("pending", [])
+    checked = {}
+    for recipient in pending:
+        status, text = httpclient.request("GET", api_url + RECIPIENTS_PATH + quote(recipient, safe=""),
+                                          user, password, verify, timeout=timeout)
+        if status in (200, 404):
+            checked[recipient] = [status == 200, time.time()]
+
+    # A failed refresh keeps the claim, so it is only retried after REFRESH_TIMEOUT
+    with locked_state(get_table_name(api_url)) as table:
+        table["networkranges"] = {"fetched": time.time(), "ids": ids}
+        recipients = table.setdefault("recipients", {})
+        recipients.update(checked)
+        if len(recipients) > MAX_RECIPIENTS:
+            for name in sorted(recipients, key=lambda name: recipients[name][1])[:len(recipients) - MAX_RECIPIENTS]:
+                del recipients[name]
+        table["pending"] = [recipient for recipient in table.get("pending", []) if recipient not in checked]
+        table.pop("refreshing", None)
+
+
+def refresh_in_background(api_url, user, password, verify, timeout=(5, 30)):
+    """Runs refresh() in a forked process, so the caller does not wait for the
+    API. The process is detached from the standard streams, Checkmk waits for
+    them to be closed."""
+
+    if os.fork() != 0:
+        return
+    try:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        refresh(api_url, user, password, verify, timeout)
+    finally:
+        os._exit(0)
+
+
+def refresh_in_thread(api_url, user, password, verify, timeout=(5, 30)):
+    """Runs refresh() in a daemon thread. Used by multi-threaded callers (the
+    gateway), a child forked from them could deadlock on inherited locks."""
+
+    def run():
+        try:
+            refresh(api_url, user, password, verify, timeout)
+        except (OSError, ValueError) as ex:
+            logging.getLogger("inote-directory").warning("Refreshing the directory of %s failed: %s", api_url, ex)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Refreshes the cached network ranges and recipients of an IDERI note server."
+    )
+    parser.add_argument("--url", required=True,
+                        help="The URL of the IDERI note API.")
+    parser.add_argument("--user", required=True,
+                        help="The IDERI note API user.")
+    parser.add_argument("--password-file", required=True,
+                        help="File holding the password of the API user.")
+    parser.add_argument("--insecure", action="store_true",
+                        help="Do not verify the server certificate.")
+    args = parser.parse_args(argv)
+
+    with open(args.password_file) as f:
+        password = f.read().strip()
+    url = args.url.rstrip("/")
+    refresh(url, args.user, password, not args.insecure)
+    table = read_state(get_table_name(url))
+    print("{} network range(s), {} recipient(s) checked".format(
+        len(table["networkranges"]["ids"]), len(table.get("recipients", {}))))
+    return 0
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (encoder)
+## Compact JSON encoding of IDERI note messages. Only the fields differing
+## from the defaults of the IDERI note server are sent (most messages set a
+## handful of the 26 fields), the fields fixed by the rule are encoded once:
+##   - the constant part of a message (recipients, display and delivery
+##     options, addressing mode, ...) is encoded into a JSON prefix which is
+##     cached per distinct set of values, i.e. per rule skeleton and route
+##   - only the fields set per event (text, times, priority, link) are
+##     encoded for every message
+##   - the times are formatted without strftime
+## expand_message() restores the full message from a compact body,
+## is_equivalent() checks a compact body against the full payload.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import json
+import operator
+from json.encoder import encode_basestring_ascii
+
+# Fields set per event, encoded after the cached prefix
+EVENT_FIELDS = ("TEXT", "STARTTIMEUTC", "ENDTIMEUTC", "PRIORITY", "LINKTARGET", "LINKTEXT")
+
+# Fields always sent, even with their default value
+REQUIRED_FIELDS = ("TEXT", "STARTTIMEUTC", "ENDTIMEUTC", "RECIPIENT")
+
+# Bounds the prefix cache of long running processes (gateway)
+MAX_PREFIXES = 256
+
+# In-process cache: id of the defaults -> _Plan
+_plans = {}
+
+
+def format_timestamp(value):
+    """Formats a datetime like strftime("%Y-%m-%dT%H:%M:%S"), strings are returned unchanged."""
+
+    if isinstance(value, str):
+        return value
+    return "%04d-%02d-%02dT%02d:%02d:%02d" % (value.year, value.month, value.day, value.hour, value.minute, value.second)
+
+
+def get_constant_fields(message, defaults):
+    """Returns the fields of a message which are not set per event and have to
+    be sent (they differ from the default or are required).
+
+    Returns:
+        list: (field, value) tuples in message order.
+    """
+
+    return [(key, value) for key, value in message.items()
+            if key not in EVENT_FIELDS and (key in REQUIRED_FIELDS or key not in defaults or value != defaults[key])]
+
+
+def get_prefix(constant):
+    """Returns the encoded constant fields: '{"KEY":value,' or '{' if there are none."""
+    return "{" + "".join('"%s":%s,' % (key, json.dumps(value)) for key, value in constant)
+
+
+class _Plan:
+    """The constant fields of the messages built from the same defaults. The
+    prefix cache is keyed by the values of these fields, picked in one C call."""
+
+    def __init__(self, defaults):
+        self.defaults = defaults
+        constant = [key for key in defaults if key not in EVENT_FIELDS]
+        self.lists = tuple(key for key in constant if isinstance(defaults[key], list))
+        self.getScalars = operator.itemgetter(*(key for key in constant if key not in self.lists))
+        self.prefixes = {}
+
+    def get_prefix(self, message):
+        key = (self.getScalars(message),) + tuple(tuple(message[field]) for field in self.lists)
+        prefix = self.prefixes.get(key)
+        if prefix is None:
+            if len(self.prefixes) >= MAX_PREFIXES:
+                self.prefixes.clear()
+            prefix = self.prefixes[key] = get_prefix(get_constant_fields(message, self.defaults))
+        return prefix
+
+
+def _get_plan(defaults):
+    plan = _plans.get(id(defaults))
+    if plan is None or plan.defaults is not defaults:
+        plan = _plans[id(defaults)] = _Plan(defaults)
+    return plan
+
+
+def encode_message(message, defaults):
+    """Encodes a message with only the fields differing from the server defaults.
+
+    Args:
+        message (dict): The IDERI note message, the times may be datetimes or already formatted.
+        defaults (dict): The default IDERI note message (the values the server uses for missing fields).
+
+    Returns:
+        bytes: The UTF-8 encoded JSON body.
+    """
+
+    if message.keys() == defaults.keys():
+        prefix = _get_plan(defaults).get_prefix(message)
+    else:
+        prefix = get_prefix(get_constant_fields(message, defaults))
+    parts = [
+        '"TEXT":' + encode_basestring_ascii(message["TEXT"]),
+        '"STARTTIMEUTC":"' + format_timestamp(message["STARTTIMEUTC"]) + '"',
+        '"ENDTIMEUTC":"' + format_timestamp(message["ENDTIMEUTC"]) + '"',
+    ]
+    if message["PRIORITY"] != defaults.get("PRIORITY"):
+        parts.append('"PRIORITY":%s' % json.dumps(message["PRIORITY"]))
+    if message["LINKTARGET"] or message["LINKTEXT"]:
+        parts.append('"LINKTARGET":' + encode_basestring_ascii(message["LINKTARGET"]))
+        parts.append('"LINKTEXT":' + encode_basestring_ascii(message["LINKTEXT"]))
+    return (prefix + ",".join(parts) + "}").encode("utf-8")
+
+
+def expand_message(body, defaults):
+    """Restores the full message (with formatted times) from a compact body.
+    The times are required fields, the body always holds them."""
+
+    message = dict(defaults)
+    message.update(json.loads(body))
+    return message
+
+
+def is_equivalent(body, message, defaults):
+    """Checks that a compact body holds the same message as the full payload
+    of the message (json.dumps() of all its fields)."""
+
+    full = json.loads(json.dumps(message, default=format_timestamp))
+    return expand_message(body, defaults) == full
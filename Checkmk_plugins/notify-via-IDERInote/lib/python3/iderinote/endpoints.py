@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (endpoints)
+## Health based selection of redundant IDERI note API endpoints. The latency
+## and the error rate of every endpoint are tracked as exponentially
+## weighted moving averages (EWMA) in a state file shared by all
+## notification processes. Endpoints are tried in the order of their score,
+## the next one is used if an endpoint fails.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import time
+
+from iderinote.state import locked_state, read_state
+
+STATE_FILE = "endpoints.json"
+
+# Weight of the latest measurement in the moving averages
+ALPHA = 0.3
+
+# An error rate of 1.0 multiplies the latency score by 1 + ERROR_PENALTY
+ERROR_PENALTY = 20
+
+# Endpoints with a higher error rate are only used after all others
+UNHEALTHY_ERROR_RATE = 0.5
+
+# Measurements older than this (seconds) are forgotten, the endpoint counts as unknown again
+MAX_AGE = 600
+
+# Key of the round-robin counter in the state file
+_COUNTER = "#counter"
+
+
+def get_score(entry, now):
+    """Returns the score of an endpoint (lower is better), 0 for unknown endpoints
+    so they get measured."""
+
+    if entry is None or now - entry["seen"] > MAX_AGE:
+        return 0.0
+    return entry["latency"] * (1 + ERROR_PENALTY * entry["errors"])
+
+
+def _is_healthy(entry, now):
+    return entry is None or now - entry["seen"] > MAX_AGE or entry["errors"] < UNHEALTHY_ERROR_RATE
+
+
+def order_endpoints(urls, mode="health"):
+    """Returns the endpoints in the order they should be tried.
+
+    Args:
+        urls (list): The API URLs in configured order.
+        mode (str): "health" orders by score, "roundrobin" rotates the healthy
+            endpoints for every message. Unhealthy endpoints come last in both modes.
+
+    Returns:
+        list: The API URLs.
+    """
+
+    if len(urls) < 2:
+        return list(urls)
+
+    now = time.time()
+    if mode == "roundrobin":
+        with locked_state(STATE_FILE) as state:
+            counter = state.get(_COUNTER, 0)
+            state[_COUNTER] = (counter + 1) % len(urls)
+        offset = counter % len(urls)
+        rotated = urls[offset:] + urls[:offset]
+        return sorted(rotated, key=lambda url: not _is_healthy(state.get(url), now))
+
+    state = read_state(STATE_FILE)
+    # sorted() is stable, unknown endpoints keep the configured order
+    return sorted(urls, key=lambda url: (not _is_healthy(state.get(url), now), get_score(state.get(url), now)))
+
+
+def record_endpoint(url, latency, success):
+    """Updates the moving averages of an endpoint.
+
+    Args:
+        url (str): The API URL.
+        latency (float): Seconds the request took.
+        success (bool): Whether the endpoint answered (connection errors and server errors are failures).
+    """
+
+    now = time.time()
+    with locked_state(STATE_FILE) as state:
+        entry = state.get(url)
+        if entry is None or now - entry["seen"] > MAX_AGE:
+            state[url] = {"latency": latency, "errors": 0.0 if success else 1.0, "seen": now}
+            return
+        entry["latency"] += ALPHA * (latency - entry["latency"])
+        entry["errors"] += ALPHA * ((0.0 if success else 1.0) - entry["errors"])
+        entry["seen"] = now
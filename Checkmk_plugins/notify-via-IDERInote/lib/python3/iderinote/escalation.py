@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (escalation)
+## Escalation of unacknowledged ALERT messages. The notification script
+## schedules the escalation steps of the rule for every tracked ALERT
+## message (see iderinote.tracking). The escalator (inote-escalator)
+## updates the message on the IDERI note server when a step is due: it is
+## shown in full screen (and locked) and/or sent to more recipients.
+##
+## A message counts as unacknowledged as long as it is the tracked message
+## of its host/service: the acknowledgement (also one made in IDERI note,
+## see inote-receipt-poller), the RECOVERY and the next PROBLEM end it.
+## Escalations of ended messages are dropped when they are due, so ending a
+## message costs nothing here.
+##
+## The schedule is a table of the message store ordered by an index on the
+## due time. It is shared by all notification processes, survives restarts
+## and finds the due escalations by a range scan, no matter how many are
+## pending.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import argparse
+import json
+import logging
+import time
+
+from iderinote import tracking
+
+logger = logging.getLogger("inote-escalator")
+
+# Due escalations handled per batch
+BATCH_SIZE = 500
+
+# Delay (seconds) before an escalation the API did not accept is tried again
+RETRY_DELAY = 60
+
+# API answers which will never succeed, the escalation is dropped
+PERMANENT_ERRORS = (400, 401, 403, 404, 405, 413, 422)
+
+ESCALATED_PREFIX = "[ESCALATED] "
+
+
+def _get_schedule():
+    connection = tracking.get_connection()
+    connection.execute("""CREATE TABLE IF NOT EXISTS escalations (
+        key TEXT PRIMARY KEY,
+        msg_index TEXT NOT NULL,
+        url TEXT NOT NULL,
+        user TEXT NOT NULL,
+        password TEXT NOT NULL,
+        verify INTEGER NOT NULL,
+        steps TEXT NOT NULL,
+        step INTEGER NOT NULL,
+        created REAL NOT NULL,
+        due REAL NOT NULL)""")
+    connection.execute("CREATE INDEX IF NOT EXISTS escalations_due ON escalations (due)")
+    return connection
+
+
+def schedule(key, index, url, user, password, verify, steps, now=None):
+    """Schedules the escalation of a message, replacing the escalation of an
+    older message of the key.
+
+    Args:
+        key (str): The tracking key (host/service and recipient set) of the message.
+        index (str): The index of the message on the IDERI note server.
+        url (str): The message URL of the API endpoint the message was created on.
+        user (str): The IDERI note API user.
+        password (str): The password of the API user.
+        verify (bool): Whether the server certificate should be verified.
+        steps (list): Escalation steps sorted by delay, dicts of "delay"
+            (minutes after the message was created), "display" ("",
+            "showfullscreen" or "showfullscreenandlock") and "recipients" (list).
+    """
+
+    now = now or time.time()
+    connection = _get_schedule()
+    with connection:
+        connection.execute("INSERT OR REPLACE INTO escalations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           (key, index, url, user, password, int(verify), json.dumps(steps), 0, now,
+                            now + 60 * steps[0]["delay"]))
+
+
+def get_escalated_message(message, step):
+    """Applies an escalation step to a message.
+
+    Returns:
+        dict: The escalated message.
+    """
+
+    message = dict(message)
+    if step.get("display"):
+        # SHOWPOPUP must always be set for full screen messages
+        message["SHOWPOPUP"] = True
+        message["SHOWFULLSCREEN"] = True
+        message["SHOWFULLSCREENANDLOCK"] = step["display"] == "showfullscreenandlock"
+    recipients = list(message.get("RECIPIENT", []))
+    for recipient in step.get("recipients", []):
+        if recipient not in recipients:
+            recipients.append(recipient)
+    message["RECIPIENT"] = recipients
+    if not message.get("TEXT", "").startswith(ESCALATED_PREFIX):
+        message["TEXT"] = ESCALATED_PREFIX + message.get("TEXT", "")
+    return message
+
+
+class Escalator:
+    """Updates the messages whose escalation is due."""
+
+    def __init__(self, put, metrics=None):
+        """
+        Args:
+            put (callable): put(url, user, password, verify, message) -> (status_code, response_text)
+        """
+        self.put = put
+        self.metrics = metrics
+
+    def _count(self, name):
+        if self.metrics is not None:
+            self.metrics.count(name)
+
+    def escalate(self, now=None):
+        """Handles the due escalations.
+
+        Returns:
+            float: Seconds until the next escalation is due, None if none is scheduled.
+        """
+
+        now = now or time.time()
+        connection = _get_schedule()
+        while True:
+            due = connection.execute(
+                "SELECT key, msg_index, url, user, password, verify, steps, step, created FROM escalations "
+                "WHERE due <= ? ORDER BY due LIMIT ?", (now, BATCH_SIZE)).fetchall()
+            for row in due:
+                self._escalate(connection, now, *row)
+            if len(due) < BATCH_SIZE:
+                break
+        nextDue = connection.execute("SELECT MIN(due) FROM escalations").fetchone()[0]
+        return None if nextDue is None else max(0.0, nextDue - now)
+
+    def _escalate(self, connection, now, key, index, url, user, password, verify, steps, step, created):
+        tracked = connection.execute("SELECT msg_index, body FROM messages WHERE key = ?", (key,)).fetchone()
+        if tracked is None or tracked[0] != index:
+            # Acknowledged, recovered or replaced by the next problem
+            logger.debug("Message %s of %s has ended, dropping its escalation", index, key)
+            with connection:
+                connection.execute("DELETE FROM escalations WHERE key = ? AND msg_index = ?", (key, index))
+            return
+
+        steps = json.loads(steps)
+        message = get_escalated_message(json.loads(tracked[1]), steps[step])
+        try:
+            status, text = self.put(url + "/" + index, user, password, bool(verify), message)
+        except Exception as ex:
+            status, text = None, str(ex)
+
+        with connection:
+            if status is not None and 200 <= status < 300:
+                logger.info("Escalated message %s of %s (step %d of %d)", index, key, step + 1, len(steps))
+                self._count("escalated")
+                connection.execute("UPDATE messages SET body = ? WHERE key = ? AND msg_index = ?",
+                                   (json.dumps(message), key, index))
+                if step + 1 < len(steps):
+                    connection.execute("UPDATE escalations SET step = ?, due = ? WHERE key = ? AND msg_index = ?",
+                                       (step + 1, created + 60 * steps[step + 1]["delay"], key, index))
+                else:
+                    connection.execute("DELETE FROM escalations WHERE key = ? AND msg_index = ?", (key, index))
+            elif status in PERMANENT_ERRORS:
+                logger.warning("Dropping the escalation of message %s of %s. Status: %s, Response: %s", index, key, status, text)
+                self._count("escalation_failed")
+                connection.execute("DELETE FROM escalations WHERE key = ? AND msg_index = ?", (key, index))
+            else:
+                logger.warning("Failed to escalate message %s of %s, retrying. Status: %s, Response: %s", index, key, status, text)
+                connection.execute("UPDATE escalations SET due = ? WHERE key = ? AND msg_index = ?",
+                                   (now + RETRY_DELAY, key, index))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Escalates the unacknowledged IDERI note ALERT messages of the IDERInote.py notification script."
+    )
+    parser.add_argument("--once", action="store_true",
+                        help="Handle the due escalations once and exit (e.g. when started by cron).")
+    parser.add_argument("--interval", type=float, default=10.0,
+                        help="Maximum seconds between two looks at the schedule, new escalations are "
+                             "scheduled by other processes (default: %(default)s).")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="Timeout in seconds for a request to the IDERI note API (default: %(default)s).")
+    parser.add_argument("--logfile", default=None,
+                        help="Write the log to this file instead of stderr.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        filename=args.logfile,
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+
+    from iderinote.forwarder import SessionPool
+    from iderinote.metrics import Metrics
+    sessions = SessionPool(pool_size=1, timeout=args.timeout)
+
+    def put(url, user, password, verify, message):
+        r = sessions.get(url, user, password, verify).put(url=url, json=message, timeout=args.timeout)
+        return r.status_code, r.text
+
+    metrics = Metrics()
+    escalator = Escalator(put, metrics)
+    try:
+        while True:
+            nextDue = escalator.escalate()
+            metrics.flush()
+            if args.once:
+                break
+            time.sleep(min(args.interval, nextDue) if nextDue is not None else args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sessions.close()
+    return 0
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (forwarder)
+## Long running local forwarder holding pooled keep-alive HTTP sessions to the
+## IDERI note API. The IDERInote.py notification script hands composed
+## messages to it over a Unix socket instead of opening a new TLS connection
+## for every notification.
+##
+## The messages are delivered by a fixed number of workers from a lane per
+## priority (see iderinote.lanes), so a new ALERT does not wait behind a
+## flood of recoveries. 'inote-forwarder --status' shows the queue depth and
+## the wait times per lane. A message is only delivered until the deadline
+## of the script waiting for it, a message still queued then is dropped.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+
+# Requests are sent as one JSON document per line, so a line is limited
+MAX_REQUEST_SIZE = 4 * 1024 * 1024
+
+# Seconds the script waits for the answer of the forwarder beyond the timeout
+# of the request, the forwarder answers within the timeout of the request
+ANSWER_MARGIN = 5.0
+
+logger = logging.getLogger("inote-forwarder")
+
+
+class ForwarderRejected(Exception):
+    """The forwarder did not deliver the message: its lane was full or the
+    message waited in the lane until its deadline."""
+
+
+def get_default_socket_path():
+    """Returns the default path of the forwarder socket.
+
+    Returns:
+        str: $INOTE_FORWARDER_SOCKET if set, otherwise tmp/run/inote-forwarder.sock in the OMD site (or /tmp).
+    """
+
+    if "INOTE_FORWARDER_SOCKET" in os.environ:
+        return os.environ["INOTE_FORWARDER_SOCKET"]
+    base = os.path.join(os.environ["OMD_ROOT"], "tmp", "run") if "OMD_ROOT" in os.environ else "/tmp"
+    return os.path.join(base, "inote-forwarder.sock")
+
+
+def forward_inote_message(socket_path, url, user, password, verify, inote_message, timeout=30.0):
+    """Hands an IDERI note message to the local forwarder and waits for the API response.
+
+    Args:
+        socket_path (str): Path of the forwarder Unix socket.
+        url (str): The full URL the message is posted to.
+        user (str): The user name of the IDERI note API user.
+        password (str): The password of the IDERI note API user.
+        verify (bool): Whether the server certificate should be verified.
+        inote_message (dict): A JSON serializable dict representing the IDERI note message.
+        timeout (float): Seconds the delivery may take.
+
+    Returns:
+        tuple: (status_code, response_text) as returned by the IDERI note API.
+
+    Raises:
+        ForwarderRejected: The forwarder did not deliver the message, it can be sent again.
+        socket.timeout: The forwarder did not answer in time, the message may still be delivered.
+        OSError: The forwarder is not running or did not answer.
+    """
+
+    request = json.dumps({
+        "url": url,
+        "user": user,
+        "password": password,
+        "verify": verify,
+        "message": inote_message,
+        "timeout": timeout,
+    }).encode("utf-8") + b"\n"
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout + ANSWER_MARGIN)
+        sock.connect(socket_path)
+        sock.sendall(request)
+        with sock.makefile("rb") as reader:
+            line = reader.readline(MAX_REQUEST_SIZE)
+    if not line:
+        raise ConnectionError("Forwarder closed the connection without an answer.")
+    response = json.loads(line)
+    if response.get("rejected"):
+        raise ForwarderRejected(response["text"])
+    return response["status"], response["text"]
+
+
+def get_forwarder_status(socket_path, timeout=10.0):
+    """Returns the lanes of the forwarder (queue depth, active deliveries and wait times per lane).
+
+    Raises:
+        OSError: The forwarder is not running or did not answer.
+    """
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(b'{"status": true}\n')
+        with sock.makefile("rb") as reader:
+            line = reader.readline(MAX_REQUEST_SIZE)
+    if not line:
+        raise ConnectionError("Forwarder closed the connection without an answer.")
+    return json.loads(line)["lanes"]
+
+
+class SessionPool:
+    """Holds one keep-alive requests.Session per API user and server."""
+
+    def __init__(self, pool_size, timeout):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, user, password, verify):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from requests.auth import HTTPBasicAuth
+        from urllib.parse import urlsplit
+
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc, user, password, verify)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                logger.info("Opening new session to %s://%s for %s", parts.scheme, parts.netloc, user)
+                session = requests.Session()
+                session.auth = HTTPBasicAuth(user, password)
+                session.verify = verify
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount(parts.scheme + "://", adapter)
+                self._sessions[key] = session
+        return session
+
+    def post(self, url, user, password, verify, inote_message, timeout=None, body=None):
+        """Posts a message, timeout (seconds) overrides the timeout of the pool,
+        body is the already encoded message if given."""
+        session = self.get(url, user, password, verify)
+        if body is not None:
+            r = session.post(url=url, data=body, headers={"Content-Type": "application/json"}, timeout=timeout or self.timeout)
+        else:
+            r = session.post(url=url, json=inote_message, timeout=timeout or self.timeout)
+        return r.status_code, r.text
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+class _Delivery:
+    """A queued message. The script stops waiting at the deadline of the
+    delivery, a delivery still queued then is dropped."""
+
+    __slots__ = ("request", "deadline", "state", "result", "finished", "_lock")
+
+    def __init__(self, request, timeout):
+        self.request = request
+        # time.monotonic() the answer is due at
+        self.deadline = time.monotonic() + timeout
+        # "queued", "sending" or "dropped"
+        self.state = "queued"
+        self.result = None
+        self.finished = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Claims the delivery for a worker.
+
+        Returns:
+            float: The seconds left until the deadline, None if the delivery expired.
+        """
+
+        with self._lock:
+            remaining = self.deadline - time.monotonic()
+            if self.state != "queued" or remaining <= 0:
+                self.state = "dropped"
+                return None
+            self.state = "sending"
+            return remaining
+
+    def drop(self):
+        """Drops the delivery unless a worker is sending it already.
+
+        Returns:
+            bool: True if the message is not (and will not be) sent.
+        """
+
+        with self._lock:
+            if self.state == "sending":
+                return False
+            self.state = "dropped"
+            return True
+
+
+class ForwarderRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline(MAX_REQUEST_SIZE)
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+            if request.get("status"):
+                response = {"lanes": self.server.lanes.get_status()}
+            else:
+                response = self.server.forward(request)
+        except Exception as ex:
+            logger.warning("Invalid request: %s", ex)
+            response = {"status": 400, "text": "Forwarder error: " + str(ex)}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class ForwarderServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # Notification storms connect many scripts at once
+    request_queue_size = 128
+
+    def __init__(self, socket_path, sessions, lanes, workers):
+        self.sessions = sessions
+        self.lanes = lanes
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        # remove a stale socket of a previous run
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        old_umask = os.umask(0o077)
+        try:
+            super().__init__(socket_path, ForwarderRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+        return self
+
+    def forward(self, request):
+        """Queues a request in the lane of its priority and waits for the API
+        response until the deadline of the request. Messages the forwarder does
+        not deliver are answered with 503 and "rejected", so the script does not
+        hold them against the API endpoint."""
+
+        delivery = _Delivery(request, request.get("timeout") or self.sessions.timeout)
+        # A compact message (see iderinote.encoder) omits the default priority INFORMATION
+        if not self.lanes.put([(request["message"].get("PRIORITY", 0), delivery)]):
+            logger.warning("Lane full, rejecting message to %s", request["url"])
+            return {"status": 503, "text": "Forwarder error: lane full", "rejected": True}
+        if delivery.finished.wait(max(0.0, delivery.deadline - time.monotonic())):
+            return delivery.result
+        if delivery.drop():
+            logger.warning("Dropping message to %s, not delivered before its deadline", request["url"])
+            return {"status": 503, "text": "Forwarder error: dropped, not delivered in time", "rejected": True}
+        # Being posted with the time left, the script waits ANSWER_MARGIN longer
+        delivery.finished.wait()
+        return delivery.result
+
+    def _work(self):
+        while True:
+            lane, delivery = self.lanes.get()
+            request = delivery.request
+            remaining = delivery.start()
+            if remaining is None:
+                # Nobody waits for the answer anymore
+                self.lanes.done(lane)
+                logger.debug("Skipping expired %s message to %s", lane.name, request["url"])
+                continue
+            try:
+                status, text = self.sessions.post(
+                    request["url"], request["user"], request["password"],
+                    request["verify"], request["message"], remaining,
+                )
+            except Exception as ex:
+                # 502: the forwarder itself could not reach the IDERI note API
+                logger.warning("Failed to forward message: %s", ex)
+                status, text = 502, "Forwarder error: " + str(ex)
+            else:
+                logger.debug("Forwarded %s message to %s: %s", lane.name, request["url"], status)
+            finally:
+                self.lanes.done(lane)
+            delivery.result = {"status": status, "text": text}
+            delivery.finished.set()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        self.sessions.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Local forwarder for IDERI note messages created by the IDERInote.py notification script."
+    )
+    parser.add_argument("--socket", default=get_default_socket_path(),
+                        help="Path of the Unix socket to listen on (default: %(default)s).")
+    parser.add_argument("--pool-size", type=int, default=10,
+                        help="Maximum number of keep-alive connections per IDERI note server (default: %(default)s).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of concurrent deliveries (default: --pool-size).")
+    parser.add_argument("--queue-size", type=int, default=1000,
+                        help="Maximum number of queued messages per priority lane (default: %(default)s).")
+    parser.add_argument("--lane-weights", default="",
+                        help='Weights of the WARNING and INFORMATION lanes, e.g. "warning:3,information:1" '
+                             "(default: warning:3,information:1).")
+    parser.add_argument("--lane-limits", default="",
+                        help='Maximum concurrent deliveries per lane, e.g. "information:2" '
+                             "(default: all workers for alert, 3/4 for warning, 1/2 for information).")
+    parser.add_argument("--status", action="store_true",
+                        help="Print the queue depth and wait times per lane of the running forwarder and exit.")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="Timeout in seconds for a request to the IDERI note API (default: %(default)s).")
+    parser.add_argument("--logfile", default=None,
+                        help="Write the log to this file instead of stderr.")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Log every forwarded message.")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        print(json.dumps(get_forwarder_status(args.socket), indent=2))
+        return 0
+
+    from iderinote.lanes import LaneScheduler, parse_lane_option
+    workers = args.workers or args.pool_size
+    lanes = LaneScheduler(workers, args.queue_size, parse_lane_option(args.lane_weights), parse_lane_option(args.lane_limits))
+
+    logging.basicConfig(
+        filename=args.logfile,
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+
+    server = ForwarderServer(args.socket, SessionPool(args.pool_size, args.timeout), lanes, workers)
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    server.start()
+    logger.info("Listening on %s with %d workers", args.socket, workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info("Stopped.")
+    return 0
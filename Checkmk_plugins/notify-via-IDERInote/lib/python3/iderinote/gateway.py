@@ -0,0 +1,550 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (gateway)
+## HTTP gateway accepting events of PRTG, Checkmk and other monitoring
+## systems as webhooks. Every event is normalized into a Checkmk
+## notification context and turned into IDERI note messages with the
+## functions of the IDERInote.py notification script (rule parameters,
+## routing table, coalescing, templates, priority). The messages are
+## delivered by a fixed number of workers sharing keep-alive connections.
+##
+## The events are queued in a lane per priority (see iderinote.lanes), so
+## queued ALERT events are delivered ahead of a flood of recoveries. If the
+## lane of an event is full, the gateway answers with 503 and Retry-After,
+## so the monitoring system retries the webhook later instead of the gateway
+## buffering without bounds.
+##
+## Endpoints (POST, JSON or form encoded):
+##   /events/checkmk   Checkmk notification context (with or without NOTIFY_ prefix)
+##   /events/prtg      PRTG placeholders: sensorid, device, name, laststatus, down, message, home, sitename, host
+##   /events/generic   host, service, state, output, type, url, address (service, type, url and address are optional)
+## GET /status returns the counters, the queue length and the queue depth and
+## wait times per lane.
+##
+## The rule parameters are read from an INI file (default:
+## etc/inote/gateway.ini in the OMD site), the section [rule] applies to all
+## sources, [rule:<source>] overrides it per source. The keys are the
+## Checkmk parameter names without the PARAMETER_ prefix:
+##
+##   [gateway]
+##   Listen=127.0.0.1:8089
+##   Token=secret
+##   LaneWeights=warning:3,information:1
+##   LaneLimits=information:4
+##
+##   [rule]
+##   INOTE_API_URL=https://inote.example.com/IDERInote/api
+##   INOTE_API_USERNAME=note\checkmk
+##   INOTE_API_USERPASS=...
+##   INOTE_MSG_RECIPIENT=note\GRP-IT
+##   INOTE_MSG_DURATION=60
+##
+##   [rule:prtg]
+##   INOTE_MSG_RECIPIENT=note\GRP-Network
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import argparse
+import copy
+import hmac
+import http.server
+import json
+import logging
+import os
+import signal
+import threading
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger("inote-gateway")
+
+# Maximum size of a webhook request body (bytes)
+MAX_REQUEST_SIZE = 1024 * 1024
+
+# PRTG status (first word of %laststatus) -> Checkmk service state
+PRTG_STATES = {
+    "Up": "OK",
+    "Paused": "OK",
+    "Warning": "WARNING",
+    "Unusual": "WARNING",
+    "Down": "CRITICAL",
+    "Unknown": "UNKNOWN",
+}
+
+SHORT_STATES = {
+    "OK": "OK",
+    "WARNING": "WARN",
+    "CRITICAL": "CRIT",
+    "UNKNOWN": "UNKN",
+    "UP": "UP",
+    "DOWN": "DOWN",
+    "UNREACHABLE": "UNREACH",
+}
+
+SOURCES = ("checkmk", "prtg", "generic")
+
+
+class EventError(ValueError):
+    pass
+
+
+class RequestTooLarge(EventError):
+    pass
+
+
+def get_default_config_path():
+    """Returns the path of the gateway configuration.
+
+    Returns:
+        str: $INOTE_GATEWAY_CONFIG if set, otherwise etc/inote/gateway.ini in the OMD site.
+    """
+
+    if "INOTE_GATEWAY_CONFIG" in os.environ:
+        return os.environ["INOTE_GATEWAY_CONFIG"]
+    return os.path.join(os.environ.get("OMD_ROOT", "/"), "etc", "inote", "gateway.ini")
+
+
+def get_default_plugin_path():
+    """Returns the path of the IDERInote.py notification script of the OMD site."""
+    return os.path.join(os.environ.get("OMD_ROOT", "/"), "local", "share", "check_mk", "notifications", "IDERInote.py")
+
+
+def read_config(path):
+    """Reads the gateway configuration.
+
+    Returns:
+        tuple: (settings, rules) - the [gateway] section and the rule parameters
+            (PARAMETER_* dict) per source.
+    """
+
+    import configparser
+
+    parser = configparser.ConfigParser(interpolation=None, comment_prefixes=(";", "#"), strict=False)
+    parser.optionxform = str
+    with open(path, encoding="utf-8-sig") as f:
+        parser.read_file(f)
+
+    settings = dict(parser.items("gateway")) if parser.has_section("gateway") else {}
+    common = dict(parser.items("rule")) if parser.has_section("rule") else {}
+    rules = {}
+    for source in SOURCES:
+        params = dict(common)
+        if parser.has_section("rule:" + source):
+            params.update(parser.items("rule:" + source))
+        rules[source] = {"PARAMETER_" + k: v for k, v in params.items()}
+    return settings, rules
+
+
+def load_plugin(path):
+    """Loads the IDERInote.py notification script as module."""
+
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location("IDERInote", path)
+    plugin = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(plugin)
+    plugin.setLogLevel(plugin.LogLevel.Standard)
+    # Forking the multi-threaded gateway could deadlock the child on inherited locks
+    plugin.directory_refresh = "thread"
+    return plugin
+
+
+def _get_state_context(what, state, previous_state=None):
+    context = {
+        what + "STATE": state,
+        what + "SHORTSTATE": SHORT_STATES.get(state, state),
+    }
+    if previous_state is not None:
+        context["PREVIOUS" + what + "HARDSHORTSTATE"] = SHORT_STATES.get(previous_state, previous_state)
+    return context
+
+
+def normalize_checkmk(event):
+    """Normalizes a Checkmk notification context (e.g. posted by a Checkmk
+    webhook or taken from the context dump)."""
+
+    context = {}
+    for key, value in event.items():
+        if key.startswith("NOTIFY_"):
+            key = key[7:]
+        if not key.startswith("PARAMETER_"):
+            context[key] = str(value)
+    if not context.get("HOSTNAME"):
+        raise EventError("HOSTNAME is missing")
+    context.setdefault("WHAT", "SERVICE" if context.get("SERVICEDESC") else "HOST")
+    context.setdefault("NOTIFICATIONTYPE", "PROBLEM")
+    return context
+
+
+def normalize_prtg(event):
+    """Normalizes the placeholders of a PRTG notification (%sensorid, %device,
+    %name, %laststatus, %down, %message, %home, %sitename and optionally %host)."""
+
+    for field in ("sensorid", "device", "name", "laststatus"):
+        if not event.get(field):
+            raise EventError(field + " is missing")
+    status = str(event["laststatus"]).split(" ")[0]
+    state = PRTG_STATES.get(status, "WARNING")
+    output = str(event.get("message") or "")
+    if event.get("down"):
+        output = (output + " " if output else "") + "(down: {})".format(event["down"])
+
+    context = {
+        "WHAT": "SERVICE",
+        "NOTIFICATIONTYPE": "RECOVERY" if state == "OK" else "PROBLEM",
+        "HOSTNAME": str(event["device"]),
+        "HOSTALIAS": str(event.get("sitename") or event["device"]),
+        "SERVICEDESC": str(event["name"]),
+        "SERVICEOUTPUT": output,
+        "HOST_ADDRESS_4": str(event.get("host") or ""),
+        "PRTG_SENSORID": str(event["sensorid"]),
+        "PRTG_LASTSTATUS": str(event["laststatus"]),
+    }
+    context.update(_get_state_context("SERVICE", state, "CRITICAL" if state == "OK" else "OK"))
+    if event.get("home"):
+        context["LINKTARGET"] = str(event["home"]).rstrip("/") + "/sensor.htm?id=" + str(event["sensorid"])
+        context["LINKTEXT"] = "Go to sensor..."
+    return context
+
+
+def normalize_generic(event):
+    """Normalizes a generic event: host, service (optional), state (a Checkmk
+    host or service state), output, type (optional notification type) and
+    url (optional link) and address (optional IP address)."""
+
+    if not event.get("host"):
+        raise EventError("host is missing")
+    state = str(event.get("state", "")).upper()
+    what = "SERVICE" if event.get("service") else "HOST"
+    if state not in SHORT_STATES:
+        raise EventError('unknown state "{}"'.format(event.get("state", "")))
+    if (what == "HOST") != (state in ("UP", "DOWN", "UNREACHABLE")):
+        raise EventError('state "{}" does not match a {} event'.format(state, what.lower()))
+
+    ok = state in ("OK", "UP")
+    context = {
+        "WHAT": what,
+        "NOTIFICATIONTYPE": str(event.get("type") or ("RECOVERY" if ok else "PROBLEM")).upper(),
+        "HOSTNAME": str(event["host"]),
+        "HOSTALIAS": str(event["host"]),
+        "HOST_ADDRESS_4": str(event.get("address") or ""),
+        what + "OUTPUT": str(event.get("output", "")),
+    }
+    if what == "SERVICE":
+        context["SERVICEDESC"] = str(event["service"])
+    context.update(_get_state_context(what, state, None))
+    context["PREVIOUS" + what + "HARDSHORTSTATE"] = "?"
+    if event.get("url"):
+        context["LINKTARGET"] = str(event["url"])
+        context["LINKTEXT"] = "Show details"
+    return context
+
+
+NORMALIZERS = {
+    "checkmk": normalize_checkmk,
+    "prtg": normalize_prtg,
+    "generic": normalize_generic,
+}
+
+
+class Gateway:
+    """Turns events into IDERI note messages and delivers them with a fixed
+    number of worker threads from bounded lanes per priority."""
+
+    def __init__(self, plugin, rules, sessions, workers=8, queue_size=1000, spool_dir=None, lane_weights=None, lane_limits=None):
+        from iderinote.lanes import LaneScheduler
+
+        self.plugin = plugin
+        self.rules = rules
+        self.sessions = sessions
+        self.spool_dir = spool_dir
+        self.lanes = LaneScheduler(workers, queue_size, lane_weights, lane_limits)
+        self.counters = {"received": 0, "rejected": 0, "messages": 0, "sent": 0, "failed": 0, "spooled": 0, "suppressed": 0}
+        self._counters_lock = threading.Lock()
+        # The plugin keeps the routing table and the delivery targets in
+        # module globals, they are only set and read while holding this lock
+        self._routing_lock = threading.Lock()
+        self._routes = {}
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+        return self
+
+    def count(self, name, value=1):
+        with self._counters_lock:
+            self.counters[name] += value
+
+    def submit(self, source, events):
+        """Normalizes the events of a webhook and queues them for delivery. The
+        events are queued all or none, so a rejected webhook can be retried
+        without duplicating messages.
+
+        Returns:
+            bool: False if the queue has no room for the events.
+
+        Raises:
+            EventError: An event is invalid.
+        """
+
+        contexts = []
+        for event in events:
+            if not isinstance(event, dict):
+                raise EventError("an event must be an object")
+            context = NORMALIZERS[source](event)
+            for key in ("HOSTALIAS", "HOST_ADDRESS_4", "HOST_ADDRESS_6"):
+                context.setdefault(key, context["HOSTNAME"] if key == "HOSTALIAS" else "")
+            context.update(self.rules[source])
+            try:
+                priority = self.plugin.get_inote_priority_from_state(context)
+            except KeyError as ex:
+                raise EventError("{} is missing".format(ex.args[0]))
+            contexts.append((priority, (source, context)))
+
+        if not self.lanes.put(contexts):
+            self.count("rejected", len(contexts))
+            return False
+        self.count("received", len(contexts))
+        return True
+
+    def _set_routes(self, source, context):
+        """Sets the routing table and the delivery targets of the rule of a source in the plugin."""
+
+        if source not in self._routes:
+            self.plugin.set_routing_table(context)
+            self.plugin.set_delivery_targets(context)
+            self._routes[source] = (self.plugin.routing_table, self.plugin.delivery_targets)
+        self.plugin.routing_table, self.plugin.delivery_targets = self._routes[source]
+
+    def compose(self, source, context):
+        """Returns the IDERI note messages for an event (one per route).
+
+        Returns:
+            list: (message, order key) tuples.
+        """
+
+        from iderinote.encoder import format_timestamp
+
+        plugin = self.plugin
+        messages = []
+        texts = {}
+        message = plugin.parse_inote_message_params(context, copy.deepcopy(plugin.message_defaults))
+        if plugin.resolve_inote_network_ranges(context, message):
+            logger.warning("Dropping %s event of %s, its network ranges cannot be resolved", source, plugin.get_order_key(context))
+            return messages
+        with self._routing_lock:
+            self._set_routes(source, context)
+            routeMessages = plugin.get_inote_route_messages(context, message)
+        for routeMessage in routeMessages:
+            context.pop("SUPPRESSED_TXT", None)
+            if not plugin.coalesce_inote_event(context, routeMessage):
+                self.count("suppressed")
+                continue
+            if not plugin.check_inote_recipients(context, routeMessage):
+                continue
+            if "LINKTARGET" in context:
+                if not (routeMessage["SHOWFULLSCREEN"] or routeMessage["SHOWFULLSCREENANDLOCK"]):
+                    routeMessage["LINKTARGET"] = context["LINKTARGET"]
+                    routeMessage["LINKTEXT"] = context["LINKTEXT"]
+            elif context.get("OMD_SITE") and context.get(context["WHAT"] + "URL"):
+                routeMessage = plugin.add_link_to_inote_message(context, routeMessage)
+            routeMessage = plugin.add_text_to_inote_message(context, routeMessage, texts)
+            routeMessage["PRIORITY"] = plugin.get_inote_priority_from_state(context)
+            routeMessage["STARTTIMEUTC"] = format_timestamp(routeMessage["STARTTIMEUTC"])
+            routeMessage["ENDTIMEUTC"] = format_timestamp(routeMessage["ENDTIMEUTC"])
+            messages.append((routeMessage, plugin.get_order_key(context)))
+        return messages
+
+    def deliver(self, context, message, order_key):
+        """Posts a message to the IDERI note API, spools it if that fails and a spool is configured."""
+
+        url = context["PARAMETER_INOTE_API_URL"] + "/v1/messages"
+        user = context["PARAMETER_INOTE_API_USERNAME"]
+        password = context["PARAMETER_INOTE_API_USERPASS"]
+        verify = context.get("PARAMETER_INOTE_API_INSECURECONNECTION", "False") != "True"
+        body = None
+        if context.get("PARAMETER_INOTE_API_COMPACTPAYLOAD", "False") == "True":
+            from iderinote.encoder import encode_message
+            body = encode_message(message, self.plugin.message_defaults)
+        try:
+            status, text = self.sessions.post(url, user, password, verify, message, body=body)
+        except Exception as ex:
+            status, text = None, str(ex)
+        if status == 200:
+            self.count("sent")
+            logger.debug("Sent message for %s", order_key)
+            return
+        self.count("failed")
+        logger.warning("Failed to send message for %s. Status: %s, Response: %s", order_key, status, text)
+        if self.spool_dir:
+            from iderinote import spool
+            try:
+                spool.spool_inote_message(self.spool_dir, url, user, password, verify, message, order_key)
+                self.count("spooled")
+            except OSError as ex:
+                logger.error("Failed to spool message for %s: %s", order_key, ex)
+
+    def _work(self):
+        while True:
+            lane, (source, context) = self.lanes.get()
+            try:
+                for message, order_key in self.compose(source, context):
+                    self.count("messages")
+                    self.deliver(context, message, order_key)
+            except Exception:
+                logger.exception("Failed to process %s event", source)
+            finally:
+                self.lanes.done(lane)
+
+    def get_status(self):
+        with self._counters_lock:
+            counters = dict(self.counters)
+        return dict(counters, queued=self.lanes.qsize(), lanes=self.lanes.get_status())
+
+
+class GatewayRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _answer(self, status, data, headers=None):
+        response = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if status >= 400:
+            # The body of a rejected request may not have been read
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(response)
+
+    def _check_token(self):
+        token = self.server.token
+        return not token or hmac.compare_digest(self.headers.get("X-Inote-Token", ""), token)
+
+    def _read_events(self):
+        value = self.headers.get("Content-Length", "").strip()
+        if not (value.isascii() and value.isdigit()):
+            raise EventError("missing or invalid Content-Length")
+        length = int(value)
+        if length > MAX_REQUEST_SIZE:
+            raise RequestTooLarge("request too large")
+        body = self.rfile.read(length).decode("utf-8")
+        if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+            return [dict(parse_qsl(body))]
+        events = json.loads(body)
+        return events if isinstance(events, list) else [events]
+
+    def do_GET(self):
+        if urlsplit(self.path).path != "/status":
+            self._answer(404, {"error": "not found"})
+        elif not self._check_token():
+            self._answer(401, {"error": "invalid token"})
+        else:
+            self._answer(200, self.server.gateway.get_status())
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        source = path[len("/events/"):] if path.startswith("/events/") else None
+        if source not in NORMALIZERS:
+            self._answer(404, {"error": "unknown source"})
+            return
+        if not self._check_token():
+            self._answer(401, {"error": "invalid token"})
+            return
+        try:
+            events = self._read_events()
+            if not self.server.gateway.submit(source, events):
+                self._answer(503, {"error": "queue full"}, {"Retry-After": str(self.server.retry_after)})
+                return
+        except RequestTooLarge as ex:
+            self._answer(413, {"error": str(ex)})
+            return
+        except (ValueError, UnicodeDecodeError) as ex:
+            self._answer(400, {"error": str(ex)})
+            return
+        self._answer(202, {"accepted": len(events)})
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+class GatewayServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, gateway, token=None, retry_after=5):
+        super().__init__(address, GatewayRequestHandler)
+        self.gateway = gateway
+        self.token = token
+        self.retry_after = retry_after
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Webhook gateway creating IDERI note messages for PRTG, Checkmk and other monitoring systems."
+    )
+    parser.add_argument("--config", default=get_default_config_path(),
+                        help="The gateway configuration (default: %(default)s).")
+    parser.add_argument("--plugin", default=get_default_plugin_path(),
+                        help="The IDERInote.py notification script composing the messages (default: %(default)s).")
+    parser.add_argument("--listen", default=None,
+                        help="Address and port to listen on (default: Listen of the configuration or 127.0.0.1:8089).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of concurrent deliveries (default: Workers of the configuration or 8).")
+    parser.add_argument("--queue-size", type=int, default=None,
+                        help="Maximum number of queued events per priority lane before webhooks are rejected "
+                             "with 503 (default: QueueSize of the configuration or 1000).")
+    parser.add_argument("--lane-weights", default=None,
+                        help='Weights of the WARNING and INFORMATION lanes, e.g. "warning:3,information:1" '
+                             "(default: LaneWeights of the configuration or warning:3,information:1).")
+    parser.add_argument("--lane-limits", default=None,
+                        help='Maximum concurrent deliveries per lane, e.g. "information:2" (default: LaneLimits '
+                             "of the configuration or all workers for alert, 3/4 for warning, 1/2 for information).")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="Timeout in seconds for a request to the IDERI note API (default: %(default)s).")
+    parser.add_argument("--spool", action="store_true",
+                        help="Write messages that cannot be delivered to the delivery spool (see inote-spool-drain).")
+    parser.add_argument("--logfile", default=None,
+                        help="Write the log to this file instead of stderr.")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Log every delivered message.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        filename=args.logfile,
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+
+    settings, rules = read_config(args.config)
+    host, _, port = (args.listen or settings.get("Listen", "127.0.0.1:8089")).rpartition(":")
+    workers = args.workers or int(settings.get("Workers", 8))
+    queue_size = args.queue_size or int(settings.get("QueueSize", 1000))
+    from iderinote.lanes import parse_lane_option
+    lane_weights = parse_lane_option(args.lane_weights or settings.get("LaneWeights", ""))
+    lane_limits = parse_lane_option(args.lane_limits or settings.get("LaneLimits", ""))
+
+    from iderinote.forwarder import SessionPool
+    spool_dir = None
+    if args.spool:
+        from iderinote.spool import get_default_spool_dir
+        spool_dir = get_default_spool_dir()
+
+    gateway = Gateway(load_plugin(args.plugin), rules, SessionPool(workers, args.timeout), workers, queue_size, spool_dir,
+                      lane_weights, lane_limits)
+    server = GatewayServer((host, int(port)), gateway, settings.get("Token"))
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    gateway.start()
+    logger.info("Listening on %s:%s with %d workers", host, port, workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        gateway.sessions.close()
+        logger.info("Stopped.")
+    return 0
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (httpclient)
+## Minimal IDERI note API client based on http.client. Starts much faster than
+## requests, which matters for the short lived notification processes.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import base64
+import http.client
+from urllib.parse import urlsplit
+
+
+def get_connection(url, verify, timeout=None):
+    """Returns a new http.client connection to the server of the URL."""
+
+    parts = urlsplit(url)
+    if parts.scheme == "https":
+        import ssl
+        ssl_context = ssl.create_default_context()
+        if not verify:
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+        return http.client.HTTPSConnection(parts.hostname, parts.port, timeout=timeout, context=ssl_context)
+    return http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+
+
+def get_auth_header(user, password):
+    """Returns the value of the Authorization header for HTTP basic auth."""
+    credentials = (user + ":" + password).encode("latin-1", "replace")
+    return "Basic " + base64.b64encode(credentials).decode("ascii")
+
+
+def request(method, url, user, password, verify, body=None, timeout=None):
+    """Sends a request to the IDERI note API.
+
+    Args:
+        method (str): The HTTP method.
+        url (str): The full URL of the request.
+        user (str): The user name of the IDERI note API user.
+        password (str): The password of the IDERI note API user.
+        verify (bool): Whether the server certificate should be verified.
+        body (bytes): The JSON serialized request body, None for requests without body.
+        timeout (float or tuple): Socket timeout in seconds or a (connect, read) tuple, None waits forever.
+
+    Returns:
+        tuple: (status_code, response_text) as returned by the IDERI note API.
+
+    Raises:
+        OSError: The connection to the API failed.
+        http.client.HTTPException: The API answered with an invalid response.
+    """
+
+    parts = urlsplit(url)
+    path = parts.path + ("?" + parts.query if parts.query else "")
+    headers = {
+        "Authorization": get_auth_header(user, password),
+        "Connection": "close",
+    }
+    if body is not None:
+        headers["Content-Type"] = "application/json"
+
+    connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    connection = get_connection(url, verify, connect_timeout)
+    try:
+        connection.connect()
+        connection.sock.settimeout(read_timeout)
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        return response.status, response.read().decode("utf-8", "replace")
+    finally:
+        connection.close()
+
+
+def post_inote_message(url, user, password, verify, body, timeout=None):
+    """Posts an IDERI note message to the API.
+
+    Args:
+        url (str): The full URL the message is posted to.
+        user (str): The user name of the IDERI note API user.
+        password (str): The password of the IDERI note API user.
+        verify (bool): Whether the server certificate should be verified.
+        body (bytes): The JSON serialized IDERI note message.
+        timeout (float or tuple): Socket timeout in seconds or a (connect, read) tuple, None waits forever.
+
+    Returns:
+        tuple: (status_code, response_text) as returned by the IDERI note API.
+
+    Raises:
+        OSError: The connection to the API failed.
+        http.client.HTTPException: The API answered with an invalid response.
+    """
+
+    return request("POST", url, user, password, verify, body, timeout)
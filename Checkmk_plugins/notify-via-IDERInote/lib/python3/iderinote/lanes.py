@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (lanes)
+## Delivery lanes per IDERI note priority for the forwarder and the gateway.
+## Every priority is queued in its own lane with its own bound, so a flood of
+## UP/OK recoveries neither delays nor rejects a new ALERT:
+##   - queued ALERT messages are always handed to the next free worker,
+##     ahead of all queued WARNING and INFORMATION messages
+##   - WARNING and INFORMATION share the remaining capacity by weight
+##     (smooth weighted round robin, default 3:1)
+##   - every lane has a concurrency limit, by default INFORMATION may only
+##     occupy half and WARNING three quarters of the workers, so workers are
+##     left for an ALERT even while a storm of lower priority messages is
+##     being delivered
+## Messages already being delivered are never interrupted.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import collections
+import threading
+import time
+
+# Lane name -> IDERI note priority (see Priority in IDERInote.py)
+PRIORITIES = {"alert": 2, "warning": 1, "information": 0}
+
+# Weights of the lanes sharing the workers, the ALERT lane is always served first
+DEFAULT_WEIGHTS = {"warning": 3, "information": 1}
+
+# Share of the workers a lane may occupy at the same time
+DEFAULT_SHARES = {"alert": 1.0, "warning": 0.75, "information": 0.5}
+
+
+def parse_lane_option(value, type=int):
+    """Parses a lane option like "warning:3,information:1".
+
+    Returns:
+        dict: Lane name -> value.
+
+    Raises:
+        ValueError: The option names an unknown lane or holds an invalid value.
+    """
+
+    result = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        name, _, number = item.partition(":")
+        name = name.strip().lower()
+        if name not in PRIORITIES:
+            raise ValueError('unknown lane "{}"'.format(name))
+        result[name] = type(number)
+        if result[name] < 0:
+            raise ValueError('negative value for lane "{}"'.format(name))
+    return result
+
+
+class Lane:
+    __slots__ = ("name", "weight", "limit", "size", "items", "active", "credit",
+                 "accepted", "rejected", "processed", "wait_sum", "wait_max")
+
+    def __init__(self, name, weight, limit, size):
+        self.name = name
+        self.weight = weight
+        self.limit = limit
+        self.size = size
+        self.items = collections.deque()
+        self.active = 0
+        self.credit = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+
+    def is_ready(self):
+        return bool(self.items) and self.active < self.limit
+
+
+class LaneScheduler:
+    """Queues work per priority and hands it to the workers in lane order.
+
+    Workers call get() for the next item and done() when it is finished.
+    """
+
+    def __init__(self, workers, size=1000, weights=None, limits=None):
+        """
+        Args:
+            workers (int): Number of workers taking from the lanes.
+            size (int): Maximum number of queued items per lane.
+            weights (dict): Lane name -> weight, overrides DEFAULT_WEIGHTS (the ALERT lane has none).
+            limits (dict): Lane name -> maximum number of concurrent items, overrides DEFAULT_SHARES.
+        """
+
+        weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        limits = limits or {}
+        self._cond = threading.Condition()
+        self._alert = None
+        self._weighted = []
+        self._byPriority = {}
+        for name, priority in sorted(PRIORITIES.items(), key=lambda item: -item[1]):
+            limit = limits.get(name, max(1, int(workers * DEFAULT_SHARES[name])))
+            lane = Lane(name, weights.get(name, 0), max(1, limit), size)
+            self._byPriority[priority] = lane
+            if name == "alert":
+                self._alert = lane
+            else:
+                self._weighted.append(lane)
+
+    def get_lane(self, priority):
+        """Returns the lane of an IDERI note priority, unknown priorities are queued as WARNING."""
+        return self._byPriority.get(priority, self._byPriority[PRIORITIES["warning"]])
+
+    def put(self, items):
+        """Queues items, all or none.
+
+        Args:
+            items (list): (priority, item) tuples.
+
+        Returns:
+            bool: False if a lane has no room for its items, nothing is queued then.
+        """
+
+        now = time.monotonic()
+        with self._cond:
+            needed = collections.Counter(self.get_lane(priority).name for priority, _ in items)
+            lanes = [self.get_lane(priority) for priority, _ in items]
+            if any(len(lane.items) + needed[lane.name] > lane.size for lane in lanes):
+                for lane in lanes:
+                    lane.rejected += 1
+                return False
+            for lane, (_, item) in zip(lanes, items):
+                lane.items.append((now, item))
+                lane.accepted += 1
+            self._cond.notify(len(items))
+        return True
+
+    def _next_lane(self):
+        if self._alert.is_ready():
+            return self._alert
+        ready = [lane for lane in self._weighted if lane.is_ready() and lane.weight > 0]
+        if not ready:
+            # Lanes with weight 0 only get the workers no other lane needs
+            ready = [lane for lane in self._weighted if lane.is_ready()]
+            return ready[0] if ready else None
+        # Smooth weighted round robin
+        total = 0
+        for lane in ready:
+            lane.credit += lane.weight
+            total += lane.weight
+        lane = max(ready, key=lambda lane: lane.credit)
+        lane.credit -= total
+        return lane
+
+    def get(self):
+        """Waits for the next item.
+
+        Returns:
+            tuple: (lane, item) - pass the lane to done() when the item is finished.
+        """
+
+        with self._cond:
+            while True:
+                lane = self._next_lane()
+                if lane is not None:
+                    break
+                self._cond.wait()
+            queued, item = lane.items.popleft()
+            wait = time.monotonic() - queued
+            lane.active += 1
+            lane.processed += 1
+            lane.wait_sum += wait
+            lane.wait_max = max(lane.wait_max, wait)
+        return lane, item
+
+    def done(self, lane):
+        with self._cond:
+            lane.active -= 1
+            # A worker waiting for a lane that was at its limit may continue
+            self._cond.notify()
+
+    def qsize(self):
+        with self._cond:
+            return sum(len(lane.items) for lane in self._byPriority.values())
+
+    def get_status(self):
+        """Returns the queue depth, the active items and the wait times (seconds) per lane."""
+
+        now = time.monotonic()
+        status = {}
+        with self._cond:
+            for lane in self._byPriority.values():
+                status[lane.name] = {
+                    "queued": len(lane.items),
+                    "active": lane.active,
+                    "limit": lane.limit,
+                    "weight": lane.weight if lane is not self._alert else None,
+                    "accepted": lane.accepted,
+                    "rejected": lane.rejected,
+                    "processed": lane.processed,
+                    "wait_avg": round(lane.wait_sum / lane.processed, 6) if lane.processed else 0.0,
+                    "wait_max": round(lane.wait_max, 6),
+                    "oldest": round(now - lane.items[0][0], 6) if lane.items else 0.0,
+                }
+        return status
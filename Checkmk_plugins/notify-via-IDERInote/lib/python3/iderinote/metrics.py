@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (metrics)
+## Per-phase latency and throughput metrics of the notification script. Every
+## process records its timings and counters in memory and merges them into a
+## shared state file when it ends. inote-metrics exports the aggregated values
+## as Checkmk local check or as Prometheus textfile.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import argparse
+import os
+import sys
+import time
+
+STATE_FILE = "metrics.json"
+CHECK_STATE_FILE = "metrics_check.json"
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The phases of a notification in the order they happen
+PHASES = ("parse", "link", "text", "serialize", "http")
+
+
+class NullMetrics:
+    """Does nothing. Used while metrics are disabled."""
+
+    def span(self, name):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def count(self, name, value=1):
+        pass
+
+    def flush(self):
+        pass
+
+
+class _Span:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """Collects the timings and counters of one process."""
+
+    def __init__(self):
+        self.spans = {}
+        self.counters = {}
+
+    def span(self, name):
+        """Returns a context manager measuring the duration of the phase 'name'."""
+        return _Span(self, name)
+
+    def observe(self, name, seconds):
+        self.spans.setdefault(name, []).append(seconds)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def flush(self):
+        """Merges the recorded values into the shared state file."""
+
+        if not self.spans and not self.counters:
+            return
+        from iderinote.state import locked_state
+        try:
+            with locked_state(STATE_FILE) as state:
+                merge_into_state(state, self.spans, self.counters)
+        except OSError as ex:
+            sys.stderr.write("Failed to write metrics: {}\n".format(ex))
+        self.spans = {}
+        self.counters = {}
+
+
+def merge_into_state(state, spans, counters):
+    state.setdefault("since", time.time())
+    all_spans = state.setdefault("spans", {})
+    for name, values in spans.items():
+        span = all_spans.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(BUCKETS)})
+        for value in values:
+            span["count"] += 1
+            span["sum"] += value
+            span["max"] = max(span["max"], value)
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    span["buckets"][i] += 1
+    all_counters = state.setdefault("counters", {})
+    for name, value in counters.items():
+        all_counters[name] = all_counters.get(name, 0) + value
+
+
+def read_state():
+    from iderinote.state import locked_state
+    with locked_state(STATE_FILE) as state:
+        return dict(state)
+
+
+def get_local_check_output(state, previous, warn, crit):
+    """Returns the Checkmk local check line for the values since the previous check."""
+
+    spans = state.get("spans", {})
+    counters = state.get("counters", {})
+    prev_spans = previous.get("spans", {})
+    prev_counters = previous.get("counters", {})
+
+    def delta(name):
+        return counters.get(name, 0) - prev_counters.get(name, 0)
+
+    perfdata = []
+    for phase in PHASES:
+        span = spans.get(phase, {"count": 0, "sum": 0.0})
+        prev = prev_spans.get(phase, {"count": 0, "sum": 0.0})
+        count = span["count"] - prev["count"]
+        avg = (span["sum"] - prev["sum"]) / count if count > 0 else 0.0
+        levels = ";%g;%g" % (warn, crit) if phase == "http" else ""
+        perfdata.append("%s_seconds=%.6f%s" % (phase, avg, levels))
+
+    failed = sum(v - prev_counters.get(k, 0) for k, v in counters.items() if k.startswith("failed"))
+    for name in ("sent", "spooled", "suppressed", "retries", "deadletter", "payload_bytes"):
+        perfdata.append("%s=%d" % (name, delta(name)))
+    perfdata.append("failed=%d" % failed)
+
+    text = "%d sent, %d failed since last check" % (delta("sent"), failed)
+    failures = ["%s: %d" % (k[7:], v - prev_counters.get(k, 0))
+                for k, v in sorted(counters.items())
+                if k.startswith("failed_") and v - prev_counters.get(k, 0) > 0]
+    if failures:
+        text += " (" + ", ".join(failures) + ")"
+    return 'P "IDERI note notifications" %s %s' % ("|".join(perfdata), text)
+
+
+def get_prometheus_text(state):
+    """Returns the aggregated values in the Prometheus text exposition format."""
+
+    lines = [
+        "# HELP inote_phase_duration_seconds Duration of the phases of the IDERI note notification script.",
+        "# TYPE inote_phase_duration_seconds histogram",
+    ]
+    for phase, span in sorted(state.get("spans", {}).items()):
+        for bound, count in zip(BUCKETS, span["buckets"]):
+            lines.append('inote_phase_duration_seconds_bucket{phase="%s",le="%g"} %d' % (phase, bound, count))
+        lines.append('inote_phase_duration_seconds_bucket{phase="%s",le="+Inf"} %d' % (phase, span["count"]))
+        lines.append('inote_phase_duration_seconds_sum{phase="%s"} %f' % (phase, span["sum"]))
+        lines.append('inote_phase_duration_seconds_count{phase="%s"} %d' % (phase, span["count"]))
+
+    lines.append("# HELP inote_notifications_total Counters of the IDERI note notification script.")
+    lines.append("# TYPE inote_notifications_total counter")
+    for name, value in sorted(state.get("counters", {}).items()):
+        if name.startswith("failed_"):
+            lines.append('inote_notifications_total{result="failed",status="%s"} %d' % (name[7:], value))
+        elif name != "payload_bytes":
+            lines.append('inote_notifications_total{result="%s"} %d' % (name, value))
+    lines.append("# HELP inote_payload_bytes_total Bytes of all message payloads sent.")
+    lines.append("# TYPE inote_payload_bytes_total counter")
+    lines.append("inote_payload_bytes_total %d" % state.get("counters", {}).get("payload_bytes", 0))
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Exports the metrics of the IDERInote.py notification script."
+    )
+    parser.add_argument("--local-check", action="store_true",
+                        help="Print a Checkmk local check line (the default output).")
+    parser.add_argument("--section", action="store_true",
+                        help="Print the <<<local:sep(0)>>> agent section header before the local check line.")
+    parser.add_argument("--warn", type=float, default=1.0,
+                        help="Warning level for the average API round trip in seconds (default: %(default)s).")
+    parser.add_argument("--crit", type=float, default=5.0,
+                        help="Critical level for the average API round trip in seconds (default: %(default)s).")
+    parser.add_argument("--prometheus", metavar="FILE",
+                        help="Write the metrics to this Prometheus textfile (e.g. for the node_exporter "
+                             "textfile collector) instead.")
+    args = parser.parse_args(argv)
+
+    state = read_state()
+
+    if args.prometheus:
+        tmp_path = "%s.%d" % (args.prometheus, os.getpid())
+        with open(tmp_path, "w") as f:
+            f.write(get_prometheus_text(state))
+        os.rename(tmp_path, args.prometheus)
+        return 0
+
+    # The local check reports the values since its previous run
+    from iderinote.state import locked_state
+    with locked_state(CHECK_STATE_FILE) as previous:
+        output = get_local_check_output(state, previous, args.warn, args.crit)
+        previous.clear()
+        previous.update(state)
+    if args.section:
+        print("<<<local:sep(0)>>>")
+    print(output)
+    return 0
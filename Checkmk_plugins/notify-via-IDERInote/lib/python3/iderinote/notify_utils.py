@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (notify_utils)
+## Standard library implementations of the functions IDERInote.py uses from
+## cmk.notification_plugins.utils. Used in the fast startup mode, which
+## avoids importing the Checkmk libraries (and requests) for every
+## notification. They behave like the Checkmk 2.0/2.1 originals.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import os
+import re
+import sys
+
+_unknown_macro = re.compile(r"\$[A-Z]+\$")
+
+
+def collect_context():
+    """Returns the NOTIFY_ environment variables (without the prefix) as dict."""
+    return {var[7:]: value for var, value in os.environ.items() if var.startswith("NOTIFY_")}
+
+
+def substitute_context(template, context):
+    """Replaces the $VARNAME$ macros in the template with the values from the
+    context and removes all macros not found in the context."""
+
+    for varname, value in context.items():
+        template = template.replace("$" + varname + "$", value)
+    return _unknown_macro.sub("", template)
+
+
+def read_bulk_contexts():
+    """Reads a bulk notification from stdin.
+
+    Returns:
+        tuple: (parameters, contexts) - the rule parameters and a list of one context dict per event.
+    """
+
+    parameters = {}
+    contexts = []
+    in_params = True
+    context = parameters
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            in_params = False
+            context = {}
+            contexts.append(context)
+            continue
+        try:
+            key, value = line.split("=", 1)
+        except ValueError:
+            sys.stderr.write("Invalid line '%s' in bulked notification context\n" % line)
+            continue
+        (parameters if in_params else context)[key] = value.replace("\1", "\n")
+    return parameters, contexts
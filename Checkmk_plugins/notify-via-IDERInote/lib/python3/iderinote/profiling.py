@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (profiling)
+## Opt-in profiling of the notification script. With profiling enabled every
+## notification writes a cProfile profile to a rotating directory (the
+## oldest profiles are removed beyond MAX_PROFILES). inote-profile-report
+## merges the profiles into one hot-spot report, grouped into the phases a
+## notification spends its time in (imports, templates, JSON, TLS, HTTP).
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import argparse
+import os
+import sys
+import time
+
+# Profiles kept in the profile directory
+MAX_PROFILES = 200
+
+# Categories of the report, the first matching rule wins. Rules match the
+# file name (suffix) and the function name (substring) of the profile entries.
+CATEGORIES = (
+    ("HTTP wait", (("~", "recv"), ("~", "'read' of '_ssl._SSLSocket'"), ("~", "select"), ("~", "poll"))),
+    ("TLS", (("~", "do_handshake"), ("~", "_ssl."), ("~", "SSLContext"), ("ssl.py", ""))),
+    ("Connect (DNS, TCP)", (("~", "getaddrinfo"), ("~", "connect"))),
+    ("JSON", (("~", "_json."), ("~", "encode_basestring"), ("json/encoder.py", ""), ("json/decoder.py", ""),
+              ("json/__init__.py", ""))),
+    ("Templates (substitute_context)", (("templates.py", ""), ("", "substitute_context"))),
+    ("Regex compilation", (("re/_parser.py", ""), ("re/_compiler.py", ""), ("re/__init__.py", ""),
+                           ("sre_parse.py", ""), ("sre_compile.py", ""))),
+    ("Imports", (("<frozen importlib._bootstrap>", ""), ("<frozen importlib._bootstrap_external>", ""),
+                 ("", "<module>"), ("~", "marshal.loads"), ("~", "_imp."))),
+)
+
+
+def get_profile_dir():
+    """Returns the directory the profiles are written to.
+
+    Returns:
+        str: $INOTE_PROFILE_DIR if set, otherwise var/inote/profiles in the OMD site (or /tmp/inote-profiles).
+    """
+
+    if "INOTE_PROFILE_DIR" in os.environ:
+        return os.environ["INOTE_PROFILE_DIR"]
+    if "OMD_ROOT" in os.environ:
+        return os.path.join(os.environ["OMD_ROOT"], "var", "inote", "profiles")
+    return "/tmp/inote-profiles"
+
+
+def save_profile(profiler, profile_dir=None, max_profiles=MAX_PROFILES):
+    """Writes the profile of this process and removes the oldest profiles.
+
+    Args:
+        profiler (cProfile.Profile): The profiler, it is disabled.
+        profile_dir (str): The profile directory, default: get_profile_dir().
+        max_profiles (int): Number of profiles kept.
+
+    Returns:
+        str: The path of the profile.
+    """
+
+    profiler.disable()
+    profile_dir = profile_dir or get_profile_dir()
+    os.makedirs(profile_dir, mode=0o700, exist_ok=True)
+    name = "%d-%d.prof" % (time.time_ns(), os.getpid())
+    path = os.path.join(profile_dir, name)
+    # Written under a temporary name, the report only reads complete profiles
+    profiler.dump_stats(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+    profiles = sorted(f for f in os.listdir(profile_dir) if f.endswith(".prof"))
+    for old in profiles[:max(0, len(profiles) - max_profiles)]:
+        try:
+            os.unlink(os.path.join(profile_dir, old))
+        except FileNotFoundError:
+            pass  # removed by a concurrent notification
+    return path
+
+
+def get_category(func):
+    """Returns the report category of a profile entry ((file, line, name) tuple), None if it has none."""
+
+    filename, _, name = func
+    for category, rules in CATEGORIES:
+        for fileRule, nameRule in rules:
+            if (not fileRule or filename.endswith(fileRule)) and nameRule in name:
+                return category
+    return None
+
+
+def get_category_times(stats):
+    """Sums the own time of the profile entries per category.
+
+    Built-in functions without a category (e.g. os.stat) count for the
+    category of their caller, so the file system calls of the import system
+    count as imports.
+
+    Args:
+        stats (dict): The stats of a pstats.Stats object.
+
+    Returns:
+        dict: Category -> seconds, entries without category are summed as "Other".
+    """
+
+    times = {}
+    for func, (_, _, tt, _, callers) in stats.items():
+        category = get_category(func)
+        if category is None and func[0] == "~":
+            for caller, callerStats in callers.items():
+                callerCategory = get_category(caller) or "Other"
+                times[callerCategory] = times.get(callerCategory, 0.0) + callerStats[2]
+            continue
+        category = category or "Other"
+        times[category] = times.get(category, 0.0) + tt
+    return times
+
+
+def get_report(paths, top=25):
+    """Merges the profiles and returns the hot-spot report.
+
+    Args:
+        paths (list): The profile files.
+        top (int): Number of functions listed by own and by cumulative time.
+
+    Returns:
+        str: The report.
+    """
+
+    import io
+    import pstats
+
+    out = io.StringIO()
+    stats = pstats.Stats(paths[0], stream=out)
+    for path in paths[1:]:
+        stats.add(path)
+
+    total = stats.total_tt
+    out.write("%d profile(s), %.3f s in total, %.2f ms per notification\n\n" % (len(paths), total, 1000 * total / len(paths)))
+    out.write("%-34s %10s %8s %6s\n" % ("Category", "Total [s]", "[ms]/nfy", "Share"))
+    times = get_category_times(stats.stats)
+    for category, seconds in sorted(times.items(), key=lambda item: -item[1]):
+        out.write("%-34s %10.3f %8.2f %5.1f%%\n" % (
+            category, seconds, 1000 * seconds / len(paths), 100 * seconds / total if total else 0.0))
+
+    stats.strip_dirs()
+    out.write("\nTop %d functions by own time:\n" % top)
+    stats.sort_stats("tottime").print_stats(top)
+    out.write("Top %d functions by cumulative time:\n" % top)
+    stats.sort_stats("cumulative").print_stats(top)
+    return out.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Merges the profiles of the IDERInote.py notification script into one hot-spot report."
+    )
+    parser.add_argument("profiles", nargs="*",
+                        help="Profile files (default: all profiles in --profile-dir).")
+    parser.add_argument("--profile-dir", default=get_profile_dir(),
+                        help="The profile directory (default: %(default)s).")
+    parser.add_argument("--last", type=int, default=None,
+                        help="Only merge the newest N profiles.")
+    parser.add_argument("--top", type=int, default=25,
+                        help="Number of functions listed (default: %(default)s).")
+    args = parser.parse_args(argv)
+
+    paths = args.profiles
+    if not paths:
+        try:
+            names = sorted(f for f in os.listdir(args.profile_dir) if f.endswith(".prof"))
+        except OSError:
+            names = []
+        paths = [os.path.join(args.profile_dir, f) for f in names]
+    if args.last:
+        paths = paths[-args.last:]
+    if not paths:
+        sys.stderr.write("No profiles found.\n")
+        return 1
+
+    sys.stdout.write(get_report(paths, args.top))
+    return 0
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (ratelimit)
+## Token bucket rate limits per recipient set and priority, shared by all
+## concurrently running notification processes. Messages exceeding the
+## limit are not sent on their own but combined into a rolling storm summary
+## per recipient set, which is updated in place on the IDERI note server.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import contextlib
+import hashlib
+import time
+
+from iderinote.state import locked_state
+
+STATE_FILE = "ratelimit.json"
+
+# Bounds the state file, the least recently used buckets are evicted first
+MAX_ENTRIES = 5000
+
+# A storm summary is continued if it has been updated within this time (seconds)
+SUMMARY_TTL = 900
+
+# Number of events listed in a storm summary
+SUMMARY_EVENTS = 5
+
+
+def take_token(key, rate, burst):
+    """Takes a token from the bucket of a key.
+
+    Args:
+        key (str): The recipient set and priority the bucket belongs to.
+        rate (float): Tokens added per minute.
+        burst (int): Size of the bucket, the number of messages allowed at once.
+
+    Returns:
+        bool: True if the message may be sent, False if the limit is exceeded.
+    """
+
+    now = time.time()
+    with locked_state(STATE_FILE) as state:
+        tokens, updated = state.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate / 60.0)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        state[key] = (tokens, now)
+        if len(state) > MAX_ENTRIES:
+            for k in sorted(state, key=lambda k: state[k][1])[:len(state) - MAX_ENTRIES]:
+                del state[k]
+    return allowed
+
+
+@contextlib.contextmanager
+def storm_summary(key):
+    """Loads the storm summary of a recipient set while holding its lock, so
+    only one process at a time creates or updates the summary message.
+
+    Args:
+        key (str): The recipient set.
+
+    Yields:
+        dict: The summary (since, updated, count, alerts, priority, events, index, url),
+            modifications are written back when the block is left without an exception.
+    """
+
+    name = "storm-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + ".json"
+    with locked_state(name) as summary:
+        now = time.time()
+        if not summary or now - summary["updated"] > SUMMARY_TTL:
+            summary.clear()
+            summary.update(since=now, updated=now, count=0, alerts=0, priority=0, events=[], index=None, url=None)
+        yield summary
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (receipts)
+## Poller reading the receipts and acknowledgements of IDERI note messages
+## (NOTIFYRECEIVE / NOTIFYACKNOWLEDGE) back into Checkmk. The poller only
+## asks the IDERI note API for the receipts since its last poll (cursor on
+## the receipt time plus the ETag of that query, so an unchanged list costs a
+## 304; pages at the same receipt time are read by offset), maps them
+## to hosts and services with the message store of the notification script
+## (see iderinote.tracking) and sends all resulting Checkmk commands of a
+## poll in one Livestatus connection.
+##
+## A user acknowledging a message in IDERI note acknowledges the problem in
+## Checkmk, receipts can be added as comments. The acknowledgement
+## notification of Checkmk then ends the message (see "Ending messages on
+## recovery" in the README).
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import argparse
+import logging
+import os
+import socket
+import time
+from datetime import datetime
+
+from iderinote import tracking
+
+logger = logging.getLogger("inote-receipt-poller")
+
+# Path of the receipts below the API URL
+DEFAULT_PATH = "/v1/messages/receipts"
+
+# Receipts requested per page
+PAGE_SIZE = 500
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def get_default_config_path():
+    """Returns the path of the poller configuration.
+
+    Returns:
+        str: $INOTE_RECEIPTS_CONFIG if set, otherwise etc/inote/receipts.ini in the OMD site.
+    """
+
+    if "INOTE_RECEIPTS_CONFIG" in os.environ:
+        return os.environ["INOTE_RECEIPTS_CONFIG"]
+    return os.path.join(os.environ.get("OMD_ROOT", "/"), "etc", "inote", "receipts.ini")
+
+
+def get_default_livestatus_path():
+    """Returns the path of the Livestatus socket of the OMD site."""
+    return os.path.join(os.environ.get("OMD_ROOT", "/"), "tmp", "run", "live")
+
+
+def read_config(path):
+    """Reads the [receipts] section of the poller configuration (ApiUrl,
+    Username, Password, InsecureConnection, Path, Author, Receipts)."""
+
+    import configparser
+
+    parser = configparser.ConfigParser(interpolation=None, comment_prefixes=(";", "#"), strict=False)
+    parser.optionxform = str
+    with open(path, encoding="utf-8-sig") as f:
+        parser.read_file(f)
+    if not parser.has_section("receipts"):
+        raise ValueError("{}: section [receipts] is missing".format(path))
+    config = dict(parser.items("receipts"))
+    for key in ("ApiUrl", "Username", "Password"):
+        if not config.get(key):
+            raise ValueError("{}: {} is missing".format(path, key))
+    return config
+
+
+def _get_cursor_table():
+    connection = tracking.get_connection()
+    connection.execute("""CREATE TABLE IF NOT EXISTS receipt_cursors (
+        url TEXT PRIMARY KEY,
+        cursor TEXT NOT NULL,
+        seen TEXT NOT NULL,
+        etag TEXT)""")
+    return connection
+
+
+def get_cursor(url):
+    """Returns the cursor of an API URL.
+
+    Returns:
+        tuple: (cursor, seen, etag) - the time of the latest receipt processed,
+            the ids of the receipts processed at exactly that time and the
+            ETag of the last answer. Without a cursor the poll starts at the
+            oldest tracked message, earlier receipts cannot belong to it.
+    """
+
+    connection = _get_cursor_table()
+    row = connection.execute("SELECT cursor, seen, etag FROM receipt_cursors WHERE url = ?", (url,)).fetchone()
+    if row is not None:
+        return row[0], set(row[1].split("\n")) - {""}, row[2]
+    oldest = connection.execute("SELECT MIN(created) FROM messages").fetchone()[0]
+    return datetime.utcfromtimestamp(oldest or time.time()).strftime(TIME_FORMAT), set(), None
+
+
+def set_cursor(url, cursor, seen, etag):
+    connection = _get_cursor_table()
+    with connection:
+        connection.execute("INSERT OR REPLACE INTO receipt_cursors VALUES (?, ?, ?, ?)",
+                           (url, cursor, "\n".join(sorted(seen)), etag))
+
+
+def get_tracked_messages(url, indexes):
+    """Returns the keys (host/service and recipient set) of the tracked
+    messages among the given message indexes.
+
+    Returns:
+        dict: Message index -> key.
+    """
+
+    connection = tracking.get_connection()
+    result = {}
+    indexes = list(indexes)
+    # SQLite limits the number of variables of a statement
+    for i in range(0, len(indexes), 500):
+        chunk = indexes[i:i + 500]
+        result.update(connection.execute(
+            "SELECT msg_index, key FROM messages WHERE url = ? AND msg_index IN ({})".format(",".join("?" * len(chunk))),
+            [url] + chunk))
+    return result
+
+
+def _get_receipt_id(receipt):
+    return "{}|{}|{}|{}".format(receipt.get("INDEX"), receipt.get("TYPE"), receipt.get("USER"), receipt.get("COMPUTER"))
+
+
+def fetch_receipts(session, url, cursor, seen, etag, timeout=30.0):
+    """Fetches the receipts since the cursor, page by page.
+
+    Args:
+        session: A requests.Session authenticated for the API.
+        url (str): The receipts URL.
+        cursor (str): Time (UTC) of the latest receipt processed.
+        seen (set): Ids of the receipts processed at exactly this time.
+        etag (str): ETag of the answer to the first page since the cursor, None if unknown.
+
+    Returns:
+        tuple: (receipts, cursor, seen, etag) - the new receipts, the updated
+            cursor and the ETag of the first page since the updated cursor
+            (None if that page has not been requested).
+    """
+
+    receipts = []
+    offset = 0
+    pageIds = None
+    while True:
+        query = (cursor, offset)
+        # The ETag belongs to the first page since the cursor
+        headers = {"If-None-Match": etag} if etag and offset == 0 else {}
+        r = session.get(url, params={"since": cursor, "offset": offset, "limit": PAGE_SIZE}, headers=headers, timeout=timeout)
+        if r.status_code == 304:
+            return receipts, cursor, seen, etag
+        r.raise_for_status()
+        page = r.json()
+        if not isinstance(page, list):
+            raise ValueError("Unexpected answer of the receipts API: {}".format(r.text[:200]))
+        etag = r.headers.get("ETag") if offset == 0 else None
+        # The receipts at the cursor time are returned again (since is inclusive)
+        for receipt in sorted(page, key=lambda receipt: receipt.get("TIMEUTC", "")):
+            receiptTime = str(receipt.get("TIMEUTC", ""))[:19]
+            receiptId = _get_receipt_id(receipt)
+            if receiptTime < cursor or (receiptTime == cursor and receiptId in seen):
+                continue
+            if receiptTime > cursor:
+                cursor, seen = receiptTime, set()
+            seen.add(receiptId)
+            receipts.append(receipt)
+        if len(page) < PAGE_SIZE:
+            break
+
+        if cursor == query[0]:
+            # A full page at the same receipt time, the next page is read by offset
+            ids = {_get_receipt_id(receipt) for receipt in page}
+            if ids == pageIds:
+                logger.warning("The receipts API ignores the offset, %d receipt(s) at %s may be missed", PAGE_SIZE, cursor)
+                break
+            pageIds = ids
+            offset += len(page)
+        else:
+            offset, pageIds = 0, None
+        etag = None
+
+    # Keep the ETag only if it answers the query of the next poll
+    return receipts, cursor, seen, etag if query == (cursor, 0) else None
+
+
+def get_checkmk_commands(receipts, messages, author, comment_receipts=False, now=None):
+    """Maps the receipts to Checkmk commands.
+
+    Args:
+        receipts (list): Receipts returned by fetch_receipts().
+        messages (dict): Message index -> key, returned by get_tracked_messages().
+        author (str): Author of the acknowledgements and comments.
+        comment_receipts (bool): Add a comment for every receipt which is not an acknowledgement.
+
+    Returns:
+        list: Livestatus command lines, at most one acknowledgement per host/service.
+    """
+
+    now = int(now or time.time())
+    commands = []
+    acknowledged = set()
+    for receipt in receipts:
+        key = messages.get(str(receipt.get("INDEX")))
+        if key is None:
+            continue
+        # The key starts with the host or host/service, see get_inote_message_key()
+        host, _, service = key.split("|", 1)[0].partition("/")
+        who = "{} ({})".format(receipt.get("USER", "?"), receipt.get("COMPUTER", "?"))
+        if str(receipt.get("TYPE", "")).upper().startswith("ACK"):
+            if (host, service) in acknowledged:
+                continue
+            acknowledged.add((host, service))
+            comment = "Acknowledged in IDERI note by " + who
+            if service:
+                command = "ACKNOWLEDGE_SVC_PROBLEM;{};{};1;1;0;{};{}".format(host, service, author, comment)
+            else:
+                command = "ACKNOWLEDGE_HOST_PROBLEM;{};1;1;0;{};{}".format(host, author, comment)
+        elif comment_receipts:
+            comment = "IDERI note message received by " + who
+            if service:
+                command = "ADD_SVC_COMMENT;{};{};0;{};{}".format(host, service, author, comment)
+            else:
+                command = "ADD_HOST_COMMENT;{};0;{};{}".format(host, author, comment)
+        else:
+            continue
+        commands.append("COMMAND [{}] {}".format(now, command.replace("\n", " ")))
+    return commands
+
+
+def send_livestatus_commands(path, commands):
+    """Sends the commands to the Checkmk core in one Livestatus connection."""
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        s.sendall("".join(command + "\n\n" for command in commands).encode("utf-8"))
+    finally:
+        s.close()
+
+
+def poll(config, sessions, livestatus_path, timeout=30.0):
+    """Polls the receipts once and pushes the resulting commands into Checkmk.
+
+    Returns:
+        int: Number of commands sent.
+    """
+
+    apiUrl = config["ApiUrl"].rstrip("/")
+    messagesUrl = apiUrl + "/v1/messages"
+    url = apiUrl + config.get("Path", DEFAULT_PATH)
+    verify = config.get("InsecureConnection", "False") != "True"
+    session = sessions.get(url, config["Username"], config["Password"], verify)
+
+    cursor, seen, etag = get_cursor(url)
+    receipts, newCursor, seen, etag = fetch_receipts(session, url, cursor, seen, etag, timeout)
+    if receipts:
+        messages = get_tracked_messages(messagesUrl, {str(receipt.get("INDEX")) for receipt in receipts})
+        commands = get_checkmk_commands(receipts, messages, config.get("Author", "IDERI note"),
+                                        config.get("Receipts", "ignore") == "comment")
+        if commands:
+            send_livestatus_commands(livestatus_path, commands)
+        logger.info("%d new receipt(s) since %s, %d for tracked messages, %d command(s) sent",
+                    len(receipts), cursor, len(messages), len(commands))
+    else:
+        commands = []
+    # The cursor only moves on once the commands are sent
+    set_cursor(url, newCursor, seen, etag)
+    return len(commands)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Reads the receipts and acknowledgements of IDERI note messages back into Checkmk."
+    )
+    parser.add_argument("--config", default=get_default_config_path(),
+                        help="The poller configuration (default: %(default)s).")
+    parser.add_argument("--livestatus", default=get_default_livestatus_path(),
+                        help="The Livestatus socket of the site (default: %(default)s).")
+    parser.add_argument("--once", action="store_true",
+                        help="Poll once and exit (e.g. when started by cron).")
+    parser.add_argument("--interval", type=float, default=60.0,
+                        help="Seconds between two polls (default: %(default)s).")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="Timeout in seconds for a request to the IDERI note API (default: %(default)s).")
+    parser.add_argument("--logfile", default=None,
+                        help="Write the log to this file instead of stderr.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        filename=args.logfile,
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+
+    config = read_config(args.config)
+
+    from iderinote.forwarder import SessionPool
+    sessions = SessionPool(pool_size=1, timeout=args.timeout)
+    try:
+        while True:
+            try:
+                poll(config, sessions, args.livestatus, args.timeout)
+            except Exception as ex:
+                if args.once:
+                    raise
+                logger.error("Polling the receipts failed: %s", ex)
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sessions.close()
+    return 0
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (routing)
+## Recipient routing tables. A routing table maps host names, host groups,
+## host tags, services and states to recipients, excludes and display modes,
+## so one notification rule can serve all teams instead of one rule per
+## recipient set.
+##
+## Routing tables are INI files in the routing directory, one section per
+## entry. Every key is optional, an entry matches an event if the event
+## matches at least one value of every key given:
+##
+##   [Database team]
+##   HostGroups=db-servers, db-clusters
+##   HostTags=prod
+##   ServicePatterns=Oracle.*, MSSQL.*
+##   States=CRIT, DOWN
+##   Recipients=note\GRP-DBA, note\dba-console$
+##   Exclude=note\intern
+##   Display=showfullscreen
+##   AddressingMode=UserAndComputer
+##   Final=yes
+##
+## Hosts and Services are exact names, ServicePatterns are regular
+## expressions matched against the beginning of the service description (like
+## Checkmk service conditions). Entries with a service condition never match
+## host events. All matching entries are used in file order, up to and
+## including the first one with Final=yes.
+##
+## A table is compiled into an index: for every key a dict from value to a
+## bitmask of the entries listing it, plus a bitmask of the entries which do
+## not use the key. The candidates of an event are the AND of the masks of
+## its values, the service patterns are only tested for the remaining
+## candidates. The compiled index is cached on disk and recompiled when the
+## modification time of the table changes.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import os
+import re
+
+# Bump when the compiled format changes to invalidate the disk cache
+CACHE_VERSION = 1
+
+# Key in the routing table -> index dimension
+DIMENSIONS = {
+    "Hosts": "host",
+    "HostGroups": "hostgroup",
+    "HostTags": "hosttag",
+    "States": "state",
+}
+
+STATES = {
+    "UP": "UP",
+    "DOWN": "DOWN",
+    "UNREACH": "UNREACHABLE",
+    "UNREACHABLE": "UNREACHABLE",
+    "OK": "OK",
+    "WARN": "WARNING",
+    "WARNING": "WARNING",
+    "CRIT": "CRITICAL",
+    "CRITICAL": "CRITICAL",
+    "UNKN": "UNKNOWN",
+    "UNKNOWN": "UNKNOWN",
+}
+
+DISPLAY_MODES = ("showpopup", "showticker", "showfullscreen", "showfullscreenandlock")
+
+ADDRESSING_MODES = ("UserOnly", "UserAndComputer", "ComputerOnly")
+
+_separator = re.compile(r"[,\s]+")
+
+# In-process cache: pattern -> compiled regular expression
+_patterns = {}
+
+
+class RoutingError(Exception):
+    pass
+
+
+def get_routing_dir():
+    """Returns the directory holding the routing tables.
+
+    Returns:
+        str: $INOTE_ROUTING_DIR if set, otherwise etc/inote/routing in the OMD site.
+    """
+
+    if "INOTE_ROUTING_DIR" in os.environ:
+        return os.environ["INOTE_ROUTING_DIR"]
+    return os.path.join(os.environ.get("OMD_ROOT", "/"), "etc", "inote", "routing")
+
+
+def get_routing_names():
+    """Returns the names of all routing tables in the routing directory (sorted)."""
+
+    try:
+        return sorted(f[:-4] for f in os.listdir(get_routing_dir()) if f.endswith(".ini"))
+    except OSError:
+        return []
+
+
+def _split(value, separator=","):
+    if separator == ",":
+        return [s.strip() for s in value.split(",") if s.strip()]
+    return [s for s in _separator.split(value) if s]
+
+
+def parse_routing_file(path):
+    """Reads the entries of a routing table.
+
+    Returns:
+        list: One dict per section (in file order) with the parsed values.
+
+    Raises:
+        RoutingError: An entry holds an invalid value.
+    """
+
+    import configparser
+
+    parser = configparser.ConfigParser(interpolation=None, comment_prefixes=(";", "#"), strict=False)
+    parser.optionxform = str
+    with open(path, encoding="utf-8-sig") as f:
+        parser.read_file(f)
+
+    entries = []
+    for section in parser.sections():
+        get = lambda key: parser.get(section, key, fallback="").strip()
+        entry = {
+            "name": section,
+            "Hosts": _split(get("Hosts")),
+            "HostGroups": _split(get("HostGroups"), None),
+            "HostTags": _split(get("HostTags"), None),
+            "Services": _split(get("Services")),
+            "ServicePatterns": _split(get("ServicePatterns")),
+            "States": [],
+            "recipients": _split(get("Recipients")),
+            "exclude": _split(get("Exclude")),
+            "display": [d.lower() for d in _split(get("Display"))],
+            "addressingmode": get("AddressingMode") or None,
+            "final": parser.getboolean(section, "Final", fallback=False),
+        }
+        for state in _split(get("States")):
+            if state.upper() not in STATES:
+                raise RoutingError('[%s]: unknown state "%s"' % (section, state))
+            entry["States"].append(STATES[state.upper()])
+        for mode in entry["display"]:
+            if mode not in DISPLAY_MODES:
+                raise RoutingError('[%s]: unknown display mode "%s"' % (section, mode))
+        if entry["addressingmode"] and entry["addressingmode"] not in ADDRESSING_MODES:
+            raise RoutingError('[%s]: unknown addressing mode "%s"' % (section, entry["addressingmode"]))
+        for pattern in entry["ServicePatterns"]:
+            try:
+                re.compile(pattern)
+            except re.error as ex:
+                raise RoutingError('[%s]: invalid service pattern "%s" (%s)' % (section, pattern, ex))
+        entries.append(entry)
+    return entries
+
+
+def compile_routing_table(path):
+    """Compiles a routing table into its index.
+
+    Returns:
+        dict: The index, built from plain types only so it can be cached with marshal.
+    """
+
+    entries = parse_routing_file(path)
+
+    dimensions = {}
+    for key, dimension in DIMENSIONS.items():
+        index = {}
+        unconstrained = 0
+        for i, entry in enumerate(entries):
+            if not entry[key]:
+                unconstrained |= 1 << i
+            for value in entry[key]:
+                index[value] = index.get(value, 0) | 1 << i
+        dimensions[dimension] = (index, unconstrained)
+
+    services = {}
+    unconstrained = 0
+    patterns = {}
+    for i, entry in enumerate(entries):
+        if not entry["Services"] and not entry["ServicePatterns"]:
+            unconstrained |= 1 << i
+        for service in entry["Services"]:
+            services[service] = services.get(service, 0) | 1 << i
+        if entry["ServicePatterns"]:
+            patterns[i] = "|".join("(?:%s)" % p for p in entry["ServicePatterns"])
+
+    return {
+        "entries": [{
+            "name": entry["name"],
+            "recipients": entry["recipients"],
+            "exclude": entry["exclude"],
+            "display": entry["display"],
+            "addressingmode": entry["addressingmode"],
+            "final": entry["final"],
+        } for entry in entries],
+        "all": (1 << len(entries)) - 1,
+        "dimensions": dimensions,
+        "services": (services, unconstrained),
+        "patterns": patterns,
+        "patternmask": sum(1 << i for i in patterns),
+    }
+
+
+def load_routing_table(name):
+    """Returns the compiled index of a named routing table.
+
+    Args:
+        name (str): The table name (file name without .ini in the routing directory).
+
+    Returns:
+        dict: The index returned by compile_routing_table().
+
+    Raises:
+        OSError: The routing table cannot be read.
+        RoutingError: The routing table holds an invalid entry.
+    """
+
+    from iderinote.state import load_compiled
+
+    name = os.path.basename(name)
+    path = os.path.join(get_routing_dir(), name + ".ini")
+    return load_compiled(path, os.path.join("routing", name + ".cache"), compile_routing_table, CACHE_VERSION)
+
+
+def _get_event_values(context):
+    if context.get("WHAT") == "SERVICE":
+        state = context.get("SERVICESTATE", "")
+    else:
+        state = context.get("HOSTSTATE", "")
+    return {
+        "host": (context.get("HOSTNAME", ""),),
+        "hostgroup": _split(context.get("HOSTGROUPNAMES", "")),
+        "hosttag": _split(context.get("HOSTTAGS", ""), None),
+        "state": (state,),
+    }
+
+
+def get_routes(table, context):
+    """Returns the routing entries matching an event.
+
+    Args:
+        table (dict): The index returned by load_routing_table().
+        context (dict): The context of the event.
+
+    Returns:
+        list: The matching entries (dicts with name, recipients, exclude, display, addressingmode and final) in table order.
+    """
+
+    candidates = table["all"]
+    for dimension, values in _get_event_values(context).items():
+        index, mask = table["dimensions"][dimension]
+        for value in values:
+            mask |= index.get(value, 0)
+        candidates &= mask
+        if not candidates:
+            return []
+
+    services, mask = table["services"]
+    if context.get("WHAT") == "SERVICE":
+        service = context.get("SERVICEDESC", "")
+        mask |= services.get(service, 0)
+        # Only test the patterns of the candidates not matched otherwise
+        pending = candidates & table["patternmask"] & ~mask
+        while pending:
+            bit = pending & -pending
+            pending ^= bit
+            pattern = table["patterns"][bit.bit_length() - 1]
+            regex = _patterns.get(pattern)
+            if regex is None:
+                regex = _patterns[pattern] = re.compile(pattern)
+            if regex.match(service):
+                mask |= bit
+    candidates &= mask
+
+    routes = []
+    entries = table["entries"]
+    while candidates:
+        bit = candidates & -candidates
+        candidates ^= bit
+        entry = entries[bit.bit_length() - 1]
+        routes.append(entry)
+        if entry["final"]:
+            break
+    return routes
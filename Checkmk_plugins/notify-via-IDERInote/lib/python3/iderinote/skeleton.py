@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (skeleton)
+## Compiles the message parameters of a notification rule (the
+## PARAMETER_INOTE_MSG_* variables) once into a validated, typed payload
+## skeleton. The fields of the skeleton are typed by the default value of the
+## field in the message, so "False" becomes False and not bool("False").
+## Every event only fills in the text, priority, times and link. The names
+## of the network ranges are kept in the skeleton, their ids are looked up
+## per server (see iderinote.directory).
+##
+## Skeletons are cached in memory, keyed by the rule parameters, so the
+## events of a bulk notification compile them only once. There is no disk
+## cache: compiling the few parameters of a rule is faster than opening and
+## reading a cache file.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+PREFIX = "PARAMETER_INOTE_MSG_"
+
+DISPLAY_MODES = ("showpopup", "showfullscreen", "showfullscreenandlock")
+
+# The CascadingDropdown selecting home office users or network ranges:
+# PARAMETER_INOTE_MSG_HOMEOFFICE_OR_NETWORKRANGE=<mode> or
+# ..._1=<mode> and ..._2_<n>=<network range> for the network range modes
+TARGET_PARAMETER = PREFIX + "HOMEOFFICE_OR_NETWORKRANGE"
+TARGET_MODES = ("homeofficeonly", "homeofficeexclude", "networkrange", "networkrangeexclude")
+
+# In-process cache: rule parameters -> skeleton
+_skeletons = {}
+
+
+class ParameterError(ValueError):
+    pass
+
+
+def get_message_params(context):
+    """Returns the message parameters of the rule (sorted (key, value) tuples)."""
+    return tuple(sorted((k, v) for k, v in context.items() if k.startswith(PREFIX)))
+
+
+def _to_bool(key, value):
+    if value == "True":
+        return True
+    if value == "False":
+        return False
+    raise ParameterError('%s: "%s" is not a boolean' % (key, value))
+
+
+def _to_int(key, value):
+    try:
+        return int(value)
+    except ValueError:
+        raise ParameterError('%s: "%s" is not an integer' % (key, value))
+
+
+def compile_skeleton(params, defaults, addressing_modes):
+    """Compiles the message parameters of a rule.
+
+    Args:
+        params (tuple): The (key, value) tuples returned by get_message_params().
+        defaults (dict): The default IDERI note message, the type of a default value is the type of the field.
+        addressing_modes (dict): Name -> value of the addressing modes.
+
+    Returns:
+        dict: {"fields": the message fields set by the rule, "duration": the message duration in minutes or None,
+            "networkranges": the names of the network ranges to resolve}
+
+    Raises:
+        ParameterError: A parameter has an invalid value.
+    """
+
+    fields = {}
+    duration = None
+    targetMode = None
+    networkRanges = []
+    for key, value in params:
+        # The field name is the last part of the parameter name
+        name = key.split("_")[-1]
+        if key.startswith(TARGET_PARAMETER):
+            suffix = key[len(TARGET_PARAMETER):]
+            if suffix in ("", "_1"):
+                if value not in TARGET_MODES:
+                    raise ParameterError('%s: unknown mode "%s"' % (key, value))
+                targetMode = value
+            elif suffix.startswith("_2_"):
+                networkRanges.append((_to_int(key, suffix[3:]), value.strip()))
+        elif name == "DURATION":
+            duration = _to_int(key, value)
+            if duration < 0:
+                raise ParameterError('%s: the duration must not be negative' % key)
+        elif key == PREFIX + "POPUP_OR_FS_SELECTION":
+            if value.lower() not in DISPLAY_MODES:
+                raise ParameterError('%s: unknown display mode "%s"' % (key, value))
+            # No matter what is specified, SHOWPOPUP must always be set
+            fields["SHOWPOPUP"] = True
+            fields[value.upper()] = True
+        elif name == "ADDRESSINGMODE":
+            if value not in addressing_modes:
+                raise ParameterError('%s: unknown addressing mode "%s"' % (key, value))
+            fields[name] = addressing_modes[value]
+        elif name in defaults:
+            default = defaults[name]
+            if isinstance(default, bool):
+                fields[name] = _to_bool(key, value)
+            elif isinstance(default, int):
+                fields[name] = _to_int(key, value)
+            elif isinstance(default, list):
+                fields[name] = [s.strip() for s in value.split(",") if s.strip()]
+            elif isinstance(default, str):
+                fields[name] = value
+            else:
+                raise ParameterError('%s: the field cannot be set by a parameter' % key)
+
+    if targetMode == "homeofficeonly":
+        fields["HOMEOFFICEUSERSONLY"] = True
+    elif targetMode == "homeofficeexclude":
+        fields["HOMEOFFICEUSERSEXCLUDE"] = True
+    elif targetMode is not None:
+        if not networkRanges:
+            raise ParameterError('%s: no network range given' % TARGET_PARAMETER)
+        fields["NETWORKRANGEEXCLUDE"] = targetMode == "networkrangeexclude"
+    # The parameters are sorted as strings, _2_10 before _2_2
+    return {"fields": fields, "duration": duration, "networkranges": [name for _, name in sorted(networkRanges)]}
+
+
+def load_skeleton(params, defaults, addressing_modes):
+    """Returns the compiled skeleton of the message parameters, from the cache
+    if the parameters have been compiled before.
+
+    Args:
+        params (tuple): The (key, value) tuples returned by get_message_params().
+        defaults (dict): The default IDERI note message.
+        addressing_modes (dict): Name -> value of the addressing modes.
+
+    Returns:
+        dict: The skeleton returned by compile_skeleton().
+
+    Raises:
+        ParameterError: A parameter has an invalid value.
+    """
+
+    skeleton = _skeletons.get(params)
+    if skeleton is None:
+        skeleton = _skeletons[params] = compile_skeleton(params, defaults, addressing_modes)
+    return skeleton
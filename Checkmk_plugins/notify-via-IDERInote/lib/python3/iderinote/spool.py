@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (spool)
+## Durable on-disk delivery spool for IDERI note messages. The IDERInote.py
+## notification script only writes the composed message to the spool, the
+## drain worker (inote-spool-drain) delivers the spooled messages with
+## exponential backoff and keeps the order per host or service.
+##
+## Spool layout (below the spool directory):
+##   tmp/         files being written, moved to new/ when complete
+##   new/         messages waiting for delivery, named <time_ns>-<pid>-<n>-<key>.json
+##                where <key> is a hash of the order key, so the queues and the
+##                pending keys are known from the file names alone
+##   deadletter/  messages which could not be delivered within the max. age
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import argparse
+import fcntl
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import time
+
+logger = logging.getLogger("inote-spool-drain")
+
+_sequence = itertools.count()
+
+# API answers which will never succeed, no matter how often we retry
+PERMANENT_ERRORS = (400, 401, 403, 404, 405, 413, 422)
+
+
+def get_default_spool_dir():
+    """Returns the default spool directory.
+
+    Returns:
+        str: $INOTE_SPOOL_DIR if set, otherwise var/inote/spool in the OMD site (or /tmp/inote-spool).
+    """
+
+    if "INOTE_SPOOL_DIR" in os.environ:
+        return os.environ["INOTE_SPOOL_DIR"]
+    if "OMD_ROOT" in os.environ:
+        return os.path.join(os.environ["OMD_ROOT"], "var", "inote", "spool")
+    return "/tmp/inote-spool"
+
+
+def get_key_hash(order_key):
+    """Returns the hash of an order key used in the names of the spool files."""
+    return hashlib.sha1(order_key.encode("utf-8")).hexdigest()[:16]
+
+
+def parse_name(name):
+    """Splits the name of a spool file.
+
+    Returns:
+        tuple: ((time_ns, pid, n), key hash) - the key hash is None for files
+        spooled by an older version, which hold the order key only in the file.
+    """
+
+    parts = name[:-len(".json")].split("-")
+    return tuple(int(i) for i in parts[:3]), (parts[3] if len(parts) > 3 else None)
+
+
+def has_pending(spool_dir, order_key):
+    """Returns whether messages with the given order key wait in the spool."""
+
+    suffix = "-%s.json" % get_key_hash(order_key)
+    try:
+        return any(name.endswith(suffix) for name in os.listdir(os.path.join(spool_dir, "new")))
+    except FileNotFoundError:
+        return False
+
+
+def spool_inote_message(spool_dir, url, user, password, verify, inote_message, order_key=""):
+    """Writes an IDERI note message to the spool.
+
+    Args:
+        spool_dir (str): The spool directory.
+        url (str): The full URL the message is posted to.
+        user (str): The user name of the IDERI note API user.
+        password (str): The password of the IDERI note API user.
+        verify (bool): Whether the server certificate should be verified.
+        inote_message (dict): A JSON serializable dict representing the IDERI note message.
+        order_key (str): Messages with the same key are delivered in the order they were spooled.
+
+    Returns:
+        str: The path of the spooled message.
+    """
+
+    name = "%d-%d-%d-%s.json" % (time.time_ns(), os.getpid(), next(_sequence), get_key_hash(order_key))
+    tmp_path = os.path.join(spool_dir, "tmp", name)
+    new_path = os.path.join(spool_dir, "new", name)
+    data = json.dumps({
+        "url": url,
+        "user": user,
+        "password": password,
+        "verify": verify,
+        "order_key": order_key,
+        "message": inote_message,
+    }).encode("utf-8")
+
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileNotFoundError:
+        for subdir in ("tmp", "new", "deadletter"):
+            os.makedirs(os.path.join(spool_dir, subdir), mode=0o700, exist_ok=True)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        # no fsync, an enqueue must stay cheap: the rename only publishes complete files
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+    os.rename(tmp_path, new_path)
+    return new_path
+
+
+def get_spooled_time(name):
+    """Returns the time (seconds since the epoch) a message was spooled at."""
+    return int(name.split("-", 1)[0]) / 1e9
+
+
+class SpoolDrainer:
+    """Delivers the spooled messages. Every order key is a queue of its own,
+    a failing message only delays the messages with the same order key."""
+
+    def __init__(self, spool_dir, post, backoff_base=5.0, backoff_max=600.0, max_age=4 * 3600.0, metrics=None):
+        from iderinote.metrics import NullMetrics
+        self.spool_dir = spool_dir
+        self.post = post
+        self.metrics = metrics or NullMetrics()
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_age = max_age
+        # name -> (number of failed attempts, time of the next attempt)
+        self._retries = {}
+
+    def _get_delay(self, attempts):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _move_to_deadletter(self, name, reason):
+        logger.error("Moving %s to the dead-letter folder: %s", name, reason)
+        os.rename(os.path.join(self.spool_dir, "new", name), os.path.join(self.spool_dir, "deadletter", name))
+        self._retries.pop(name, None)
+        self.metrics.count("deadletter")
+
+    def get_queues(self):
+        """Returns the spooled messages as dict key hash -> [name, ...] (oldest first)."""
+
+        new_dir = os.path.join(self.spool_dir, "new")
+        try:
+            listing = os.listdir(new_dir)
+        except FileNotFoundError:
+            return {}
+
+        names = []
+        for name in listing:
+            try:
+                names.append((parse_name(name), name))
+            except ValueError:
+                logger.warning("Ignoring unexpected file %s", name)
+        names.sort()
+
+        queues = {}
+        for (_order, key_hash), name in names:
+            if key_hash is None:
+                # spooled by an older version, only the file knows the order key
+                try:
+                    with open(os.path.join(new_dir, name), "rb") as f:
+                        key_hash = get_key_hash(json.load(f)["order_key"])
+                except (OSError, ValueError, KeyError) as ex:
+                    logger.warning("Cannot read %s: %s", name, ex)
+                    continue
+            queues.setdefault(key_hash, []).append(name)
+        return queues
+
+    def drain(self):
+        """Tries to deliver the head of every queue which is due.
+
+        Returns:
+            float: Seconds until the next retry is due, None if the spool is empty.
+        """
+
+        next_due = None
+        for names in self.get_queues().values():
+            for name in names:
+                now = time.time()
+                attempts, due = self._retries.get(name, (0, 0.0))
+                if due > now:
+                    next_due = due - now if next_due is None else min(next_due, due - now)
+                    break
+
+                if now - get_spooled_time(name) > self.max_age:
+                    self._move_to_deadletter(name, "older than %d seconds" % self.max_age)
+                    continue
+
+                path = os.path.join(self.spool_dir, "new", name)
+                with open(path, "rb") as f:
+                    spooled = json.load(f)
+                try:
+                    with self.metrics.span("http"):
+                        status_code, text = self.post(
+                            spooled["url"], spooled["user"], spooled["password"],
+                            spooled["verify"], spooled["message"],
+                        )
+                except Exception as ex:
+                    status_code, text = None, str(ex)
+                self.metrics.count("sent" if status_code == 200 else "failed_" + str(status_code or "error"))
+
+                if status_code == 200:
+                    logger.info("Delivered %s (%s)", name, spooled["order_key"])
+                    os.unlink(path)
+                    self._retries.pop(name, None)
+                    continue
+                if status_code in PERMANENT_ERRORS:
+                    self._move_to_deadletter(name, "status %s, response %s" % (status_code, text))
+                    continue
+
+                attempts += 1
+                self.metrics.count("retries")
+                delay = self._get_delay(attempts)
+                self._retries[name] = (attempts, now + delay)
+                logger.warning("Failed to deliver %s (attempt %d, status %s, response %s), retrying in %.1fs",
+                               name, attempts, status_code, text, delay)
+                next_due = delay if next_due is None else min(next_due, delay)
+                # keep the order: later messages of this key wait for this one
+                break
+        return next_due
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Delivers the IDERI note messages spooled by the IDERInote.py notification script."
+    )
+    parser.add_argument("--spool-dir", default=get_default_spool_dir(),
+                        help="The spool directory (default: %(default)s).")
+    parser.add_argument("--once", action="store_true",
+                        help="Try every due message once and exit (e.g. when started by cron).")
+    parser.add_argument("--interval", type=float, default=2.0,
+                        help="Seconds between two scans of an idle spool (default: %(default)s).")
+    parser.add_argument("--backoff-base", type=float, default=5.0,
+                        help="Delay in seconds after the first failed attempt (default: %(default)s).")
+    parser.add_argument("--backoff-max", type=float, default=600.0,
+                        help="Maximum delay in seconds between two attempts (default: %(default)s).")
+    parser.add_argument("--max-age", type=float, default=4 * 3600.0,
+                        help="Messages older than this (seconds) are moved to the dead-letter "
+                             "folder (default: %(default)s).")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="Timeout in seconds for a request to the IDERI note API (default: %(default)s).")
+    parser.add_argument("--logfile", default=None,
+                        help="Write the log to this file instead of stderr.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        filename=args.logfile,
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+
+    for subdir in ("tmp", "new", "deadletter"):
+        os.makedirs(os.path.join(args.spool_dir, subdir), mode=0o700, exist_ok=True)
+
+    # Only one drain worker per spool directory
+    lock = open(os.path.join(args.spool_dir, "drain.lock"), "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        logger.info("Another drain worker is running for %s.", args.spool_dir)
+        return 0
+
+    from iderinote.forwarder import SessionPool
+    from iderinote.metrics import Metrics
+    sessions = SessionPool(pool_size=4, timeout=args.timeout)
+    metrics = Metrics()
+    drainer = SpoolDrainer(args.spool_dir, sessions.post, args.backoff_base, args.backoff_max, args.max_age, metrics)
+    try:
+        while True:
+            next_due = drainer.drain()
+            metrics.flush()
+            if args.once:
+                break
+            time.sleep(min(args.interval, next_due) if next_due is not None else args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sessions.close()
+    return 0
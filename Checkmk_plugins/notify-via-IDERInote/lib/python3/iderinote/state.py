@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (state)
+## Small JSON state files shared by concurrently running notification
+## processes. Every read-modify-write cycle holds an exclusive lock.
+## Compiled configuration files (templates, routing tables) are cached in
+## the same directory.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import contextlib
+import fcntl
+import json
+import marshal
+import os
+
+
+def get_state_dir():
+    """Returns the directory for the shared state files.
+
+    Returns:
+        str: $INOTE_STATE_DIR if set, otherwise tmp/inote in the OMD site (or /tmp/inote).
+    """
+
+    if "INOTE_STATE_DIR" in os.environ:
+        return os.environ["INOTE_STATE_DIR"]
+    if "OMD_ROOT" in os.environ:
+        return os.path.join(os.environ["OMD_ROOT"], "tmp", "inote")
+    return "/tmp/inote"
+
+
+def read_state(name):
+    """Loads a state file without taking its lock. The state files are replaced
+    atomically, so the result is consistent but may be outdated by the time
+    it is used.
+
+    Args:
+        name (str): The file name of the state file within the state directory.
+
+    Returns:
+        dict: The state, empty if the file does not exist.
+    """
+
+    try:
+        with open(os.path.join(get_state_dir(), name), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+@contextlib.contextmanager
+def locked_state(name):
+    """Loads a state file while holding its lock and writes it back afterwards.
+
+    Args:
+        name (str): The file name of the state file within the state directory.
+
+    Yields:
+        dict: The state, modifications are written back when the block is left without an exception.
+    """
+
+    state_dir = get_state_dir()
+    path = os.path.join(state_dir, name)
+    os.makedirs(state_dir, mode=0o700, exist_ok=True)
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        yield state
+        tmp_path = "%s.%d" % (path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.rename(tmp_path, path)
+
+
+def load_compiled(path, cache_name, compile_file, version):
+    """Returns the compiled form of a configuration file, cached on disk until
+    the modification time of the file changes.
+
+    Args:
+        path (str): The configuration file.
+        cache_name (str): The name of the cache file (relative to the state directory).
+        compile_file (callable): Called with the path, returns the compiled form (must be marshallable).
+        version (int): The version of the compiled format, a different version invalidates the cache.
+
+    Returns:
+        The compiled form.
+
+    Raises:
+        OSError: The configuration file cannot be read.
+    """
+
+    mtime = os.stat(path).st_mtime_ns
+
+    cache_path = os.path.join(get_state_dir(), cache_name)
+    try:
+        # marshal.load() on a file object reads value by value, loads() of the whole file is much faster
+        with open(cache_path, "rb") as f:
+            cached_version, cached_mtime, compiled = marshal.loads(f.read())
+        if cached_version == version and cached_mtime == mtime:
+            return compiled
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    compiled = compile_file(path)
+    try:
+        os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+        tmp_path = "%s.%d" % (cache_path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(marshal.dumps((version, mtime, compiled)))
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        pass
+    return compiled
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (templates)
+## Compiled message templates. A template is compiled once into a list of
+## (literal, macro) parts which are rendered in a single pass, CRLF line
+## endings are already part of the compiled literals.
+##
+## Named templates are INI files in the template directory (like the
+## intqdadm.exe templates), one section per notification type:
+##
+##   [Host]
+##   Lines=2
+##   Line1=Host $HOSTNAME$ is $HOSTSTATE$.
+##   Line2=Output: $HOSTOUTPUT$
+##
+##   [Service]
+##   Lines=...
+##
+## The compiled templates are cached on disk and recompiled when the
+## modification time of the template file changes.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import os
+import re
+
+# Same macro syntax as cmk.notification_plugins.utils.substitute_context
+_macro = re.compile(r"\$([A-Z0-9_]+)\$")
+# Unknown macros matching this are removed, all others are kept as they are
+_removable_macro = re.compile(r"[A-Z]+")
+
+# In-process cache: (template text, crlf) -> compiled template
+_compiled = {}
+
+# Bump when the compiled format changes to invalidate the disk cache
+CACHE_VERSION = 1
+
+SECTIONS = ("Host", "Service")
+
+
+def get_template_dir():
+    """Returns the directory holding the named templates.
+
+    Returns:
+        str: $INOTE_TEMPLATE_DIR if set, otherwise etc/inote/templates in the OMD site.
+    """
+
+    if "INOTE_TEMPLATE_DIR" in os.environ:
+        return os.environ["INOTE_TEMPLATE_DIR"]
+    return os.path.join(os.environ.get("OMD_ROOT", "/"), "etc", "inote", "templates")
+
+
+def get_template_names():
+    """Returns the names of all templates in the template directory (sorted)."""
+
+    try:
+        return sorted(f[:-4] for f in os.listdir(get_template_dir()) if f.endswith(".ini"))
+    except OSError:
+        return []
+
+
+def compile_template(text, crlf=True):
+    """Compiles a template text.
+
+    Args:
+        text (str): The template with $MACRO$ placeholders.
+        crlf (bool): Whether line breaks should be rendered as CRLF.
+
+    Returns:
+        tuple: The compiled template, a tuple of (literal, macro, fallback) tuples.
+    """
+
+    key = (text, crlf)
+    compiled = _compiled.get(key)
+    if compiled is not None:
+        return compiled
+
+    parts = []
+    pos = 0
+    for match in _macro.finditer(text):
+        literal = text[pos:match.start()]
+        macro = match.group(1)
+        fallback = "" if _removable_macro.fullmatch(macro) else match.group(0)
+        parts.append((literal.replace("\n", "\r\n") if crlf else literal, macro, fallback))
+        pos = match.end()
+    literal = text[pos:]
+    parts.append((literal.replace("\n", "\r\n") if crlf else literal, None, ""))
+
+    compiled = tuple(parts)
+    _compiled[key] = compiled
+    return compiled
+
+
+def render_template(compiled, context, crlf=True):
+    """Renders a compiled template with the values of the context.
+
+    Args:
+        compiled (tuple): A template returned by compile_template().
+        context (dict): The values for the macros.
+        crlf (bool): Whether line breaks within the values should be rendered as CRLF.
+
+    Returns:
+        str: The rendered text.
+    """
+
+    out = []
+    for literal, macro, fallback in compiled:
+        out.append(literal)
+        if macro is not None:
+            value = context.get(macro)
+            if value is None:
+                out.append(fallback)
+            elif crlf and "\n" in value:
+                out.append(value.replace("\n", "\r\n"))
+            else:
+                out.append(value)
+    return "".join(out)
+
+
+def parse_template_file(path):
+    """Reads the sections of a template file.
+
+    Returns:
+        dict: section name -> template text
+    """
+
+    import configparser
+
+    parser = configparser.ConfigParser(interpolation=None, comment_prefixes=(";", "#"), strict=False)
+    parser.optionxform = str
+    with open(path, encoding="utf-8-sig") as f:
+        parser.read_file(f)
+
+    sections = {}
+    for section in SECTIONS:
+        if not parser.has_section(section):
+            continue
+        lines = [parser.get(section, "Line%d" % i, fallback="")
+                 for i in range(1, parser.getint(section, "Lines", fallback=0) + 1)]
+        sections[section] = "\n".join(lines) + "\n"
+    return sections
+
+
+def load_template(name):
+    """Returns the compiled sections of a named template.
+
+    Args:
+        name (str): The template name (file name without .ini in the template directory).
+
+    Returns:
+        dict: section name -> compiled template
+
+    Raises:
+        OSError: The template file cannot be read.
+    """
+
+    from iderinote.state import load_compiled
+
+    def compile_file(path):
+        return {section: compile_template(text) for section, text in parse_template_file(path).items()}
+
+    name = os.path.basename(name)
+    path = os.path.join(get_template_dir(), name + ".ini")
+    return load_compiled(path, os.path.join("templates", name + ".cache"), compile_file, CACHE_VERSION)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (tracking)
+## Store of the active IDERI note message per host/service and recipient set
+## (like the sensorIdToMessageID.db.csv of the PRTG script). A RECOVERY or
+## acknowledgement can then end the message of the PROBLEM instead of only
+## creating a second one.
+##
+## The store is a SQLite database in WAL mode, so concurrently running
+## notification processes only block each other for the short writes. It
+## holds the API credentials of the escalations (see iderinote.escalation),
+## so the database and its WAL files are only readable by the site user.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import os
+import sqlite3
+import time
+
+# Entries older than this (seconds) are removed, their messages have long ended
+MAX_AGE = 7 * 86400
+
+_connection = None
+
+
+def get_default_db_path():
+    """Returns the path of the message store.
+
+    Returns:
+        str: $INOTE_TRACKING_DB if set, otherwise var/inote/messages.sqlite in the OMD site (or /tmp/inote-messages.sqlite).
+    """
+
+    if "INOTE_TRACKING_DB" in os.environ:
+        return os.environ["INOTE_TRACKING_DB"]
+    if "OMD_ROOT" in os.environ:
+        return os.path.join(os.environ["OMD_ROOT"], "var", "inote", "messages.sqlite")
+    return "/tmp/inote-messages.sqlite"
+
+
+def get_connection():
+    """Returns the connection to the message store, creating the database if needed."""
+
+    global _connection
+    if _connection is None:
+        path = get_default_db_path()
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # SQLite creates the -wal and -shm files with the mode of the database,
+        # files of older versions are restricted as well
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            os.fchmod(fd, 0o600)
+        finally:
+            os.close(fd)
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.chmod(path + suffix, 0o600)
+        connection = sqlite3.connect(path, timeout=10, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("""CREATE TABLE IF NOT EXISTS messages (
+            key TEXT PRIMARY KEY,
+            msg_index TEXT NOT NULL,
+            url TEXT NOT NULL,
+            body TEXT NOT NULL,
+            created REAL NOT NULL)""")
+        connection.execute("CREATE INDEX IF NOT EXISTS messages_created ON messages (created)")
+        connection.execute("CREATE INDEX IF NOT EXISTS messages_index ON messages (msg_index)")
+        _connection = connection
+    return _connection
+
+
+def get_message_index(response_text):
+    """Returns the index of the created message from the API response, None
+    if the response does not contain one."""
+
+    import json
+    try:
+        response = json.loads(response_text)
+    except ValueError:
+        return None
+    if not isinstance(response, dict):
+        return None
+    for field in ("INDEX", "Index", "ID"):
+        if response.get(field) is not None:
+            return str(response[field])
+    return None
+
+
+def add_message(key, index, url, body):
+    """Stores the active message of a key, replacing an older one.
+
+    Args:
+        key (str): The host/service and recipient set the message belongs to.
+        index (str): The index of the message on the IDERI note server.
+        url (str): The message URL of the API endpoint the message was created on.
+        body (str): The JSON serialized message.
+    """
+
+    now = time.time()
+    connection = get_connection()
+    with connection:
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute("DELETE FROM messages WHERE created < ?", (now - MAX_AGE,))
+        connection.execute("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)", (key, index, url, body, now))
+
+
+def pop_message(key):
+    """Removes the active message of a key from the store.
+
+    Returns:
+        tuple: (index, url, body) of the message, None if no message is active for the key.
+    """
+
+    connection = get_connection()
+    with connection:
+        connection.execute("BEGIN IMMEDIATE")
+        row = connection.execute("SELECT msg_index, url, body FROM messages WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            connection.execute("DELETE FROM messages WHERE key = ?", (key,))
+    return row
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (truncate)
+## Byte budgets for the message text. Long plugin output is cut in a single
+## pass over its UTF-8 encoding: the first lines (two thirds of the budget)
+## and the last lines (one third) are kept, the cut is marked with the
+## number of bytes removed.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+MARKER = "[... {} bytes cut ...]"
+
+
+def truncate_text(text, budget, newline="\n"):
+    """Cuts a text to a byte budget, keeping its first and last lines.
+
+    Args:
+        text (str): The text.
+        budget (int): Maximum size of the UTF-8 encoded result in bytes.
+        newline (str): The line ending of the text.
+
+    Returns:
+        tuple: (text, number of bytes cut) - the text is returned unchanged if it fits the budget.
+    """
+
+    data = text.encode("utf-8")
+    if len(data) <= budget:
+        return text, 0
+
+    sep = newline.encode("utf-8")
+    # The marker holds at most as many digits as the size of the text
+    room = max(0, budget - len(MARKER.format(len(data))) - 2 * len(sep))
+    head = data[:room * 2 // 3]
+    tail = data[len(data) - (room - len(head)):] if room > len(head) else b""
+
+    # Cut at line boundaries, unless that drops more than half of a kept part
+    end = head.rfind(sep)
+    if end >= len(head) // 2:
+        head = head[:end]
+    start = tail.find(sep)
+    if 0 <= start < len(tail) // 2:
+        tail = tail[start + len(sep):]
+
+    cut = len(data) - len(head) - len(tail)
+    # A multibyte character cut in half is dropped
+    parts = [head.decode("utf-8", "ignore"), MARKER.format(cut), tail.decode("utf-8", "ignore")]
+    return newline.join(part for part in parts if part), cut
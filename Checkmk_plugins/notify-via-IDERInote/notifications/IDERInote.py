@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 # IDERI note
-# Bulk: no
+# Bulk: yes
 
 ## notify-via-IDERInote (notification script)
 ## Checkmk notification plugin script for IDERI note.
@@ -13,52 +13,136 @@
 ## History:
 ## (2022-10-27) 0.8: initial release
 ##              Tested with checkmk 2.0.0p25 + 2.1.0p14
+## (unreleased) 0.9: bulk notification support (one digest message per
+##              recipient set), optional local forwarder with pooled
+##              keep-alive connections, durable delivery spool, event
+##              coalescing and flap suppression, fast startup mode with
+##              lazy imports and http.client based sender, compiled and
+##              user selectable message templates, lazy structured logging,
+##              per-phase metrics, context dump for the replay tool,
+##              recipient routing tables, API timeouts and circuit breaker,
+##              multiple API endpoints with health based selection, tracking
+##              of the active message to end it on RECOVERY/acknowledgement,
+##              cached and typed compilation of the message parameters (fixes
+##              'False' parameters and the SSL verification being disabled),
+##              rate limits per recipient set with rolling storm summaries,
+##              webhook gateway reusing the message composition for PRTG and
+##              other monitoring systems, poller acknowledging problems in
+##              Checkmk from the IDERI note receipts, payload size budgets
+##              cutting long plugin output, network ranges and recipient check
+##              from a cached directory of the IDERI note server, opt-in
+##              profiling with a merged hot-spot report, escalation of
+##              unacknowledged ALERT messages, delivery lanes per priority in
+##              the forwarder and the gateway, concurrent delivery to
+##              several targets of one rule, compact payload with only the
+##              fields differing from the server defaults
 
+import os
 import sys
+
+# Profiling starts before the imports, so their time is part of the profile
+profiler = None
+if os.environ.get("INOTE_PROFILE", "0") not in ("", "0") or os.environ.get("NOTIFY_PARAMETER_INOTE_PLUGIN_PROFILE") == "True":
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+# In fast startup mode the Checkmk libraries and requests are not imported,
+# all other modules are imported where they are used.
+fast_startup = os.environ.get("INOTE_FAST_STARTUP", "0") not in ("", "0")
+
 try:
-    import json
-    import requests
-    import posixpath
-    from urllib.parse import urljoin
-    from requests.auth import HTTPBasicAuth
-    from cmk.notification_plugins import utils
-    from enum import (
-        IntEnum,
-        IntFlag,
-    )
-    from datetime import (
-        datetime,
-        timedelta,
-    )
+    if fast_startup:
+        from iderinote import notify_utils as utils
+    else:
+        from cmk.notification_plugins import utils
 except Exception as ex:
-    sys.exit("""Error importing python modules. - """ + ex)
+    sys.exit("""Error importing python modules. - """ + str(ex))
 
 
-# Priority enum
-class Priority(IntEnum):
+# Priority values (plain classes, building enum classes costs startup time)
+class Priority:
     INFORMATION = 0
     WARNING = 0x01
     ALERT = 0x02
 
-# AddressingMode enum
-class AddressingMode(IntEnum):
+# AddressingMode values
+class AddressingMode:
     UserOnly = 0
     UserAndComputer = 0x1000
     ComputerOnly = 0x2000
 
 # Output detail mode for the notify.log
-class LogLevel(IntFlag):
+class LogLevel:
     Standard = 0x01
     Verbose = 0x02
     Debug = 0x04
     Trace = 0x08
 
+# Stands in for iderinote.metrics.Metrics while the metrics are disabled, so
+# the metrics module is only imported if a rule enables it
+class NullMetrics:
+    def span(self, name):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def count(self, name, value=1):
+        pass
+
+    def flush(self):
+        pass
+
 context = None
-logLevel = 1
+logLevel = LogLevel.Standard
+# Bitmask of the enabled LogLevel flags, set by setLogLevel()
+logMask = LogLevel.Standard
+# Path of the local forwarder socket, None posts directly to the API
+forwarder_socket = None
+# Status returned by post_inote_message() if the forwarder did not answer in
+# time: the message may still be delivered, so it must not be sent again
+OUTCOME_UNKNOWN = -1
+# Status returned by post_inote_message() if the forwarder did not deliver the
+# message (lane full or deadline passed in the lane): the endpoint did not fail
+FORWARDER_REJECTED = -2
+# Spool mode: None, "always" or "onfailure"
+spool_mode = None
+# HTTP client used to post messages: "requests" or "httpclient"
+http_client = "requests"
+# Connect and read timeout (seconds) of the requests to the IDERI note API
+api_timeout = (5, 30)
+# Circuit breaker settings (failures, cooldown), None if disabled
+circuit_breaker = None
+# Additional IDERI note API URLs used for load distribution and failover
+api_failover_urls = []
+# Selection of the API endpoint: "health" or "roundrobin"
+api_balancing = "health"
+# Per-phase timings and counters (iderinote.metrics.Metrics if enabled)
+metrics = NullMetrics()
+# Compiled recipient routing table (iderinote.routing), None if not used
+routing_table = None
+# Refresh of the cached directory: "fork" (notification script) or "thread"
+# (multi-threaded callers like the gateway, which must not fork)
+directory_refresh = "fork"
+# Escalation steps of unacknowledged ALERT messages (iderinote.escalation)
+escalation_steps = []
+# Delivery targets of the rule (routes like the entries of a routing table), empty if not used
+delivery_targets = []
+# Seconds the deliveries to all targets of a notification may take together
+delivery_deadline = 60.0
+# Maximum number of targets delivered at the same time
+max_concurrent_deliveries = 8
+# Send only the fields differing from the server defaults (iderinote.encoder)
+compact_payload = False
 message = {
     "TEXT": "",
-    "STARTTIMEUTC": datetime.utcnow(),
-    "ENDTIMEUTC": datetime.utcnow(),
+    # datetime objects, None is the time the message is sent
+    "STARTTIMEUTC": None,
+    "ENDTIMEUTC": None,
     "LINKTARGET": "",
     "LINKTEXT": "",
     "NETWORKRANGEIDS": [],
@@ -84,6 +168,10 @@ message = {
     "PUSH": False
 }
 
+# Typed defaults of the message fields set by rule parameters (see parse_inote_message_params)
+message_defaults = dict(message)
+addressing_modes = {name: value for name, value in vars(AddressingMode).items() if not name.startswith("_")}
+
 tmpl_host_text = """[$NOTIFICATIONTYPE$]
 Host $HOSTNAME$ is $HOSTSTATE$.
 
@@ -107,12 +195,21 @@ Event:    $EVENT_TXT$
 Output:   $SERVICEOUTPUT$
 """
 
+tmpl_bulk_header_text = """[BULK] $EVENTCOUNT$ notifications ($HOSTCOUNT$ hosts)$PARTINFO$
+"""
+
+tmpl_bulk_separator_text = "\n----------------------------------------\n"
+
+# Default for the maximum number of events combined into one digest message
+bulk_max_events = 30
+
 
-def get_inote_message_text(context):
+def get_inote_message_text(context, inotemessage=None):
     """Composes the text for the IDERI note message.
 
     Args:
         context (dict): A dict returned by utils.collect_context() from cmk.notification_plugins holding the parameters passed from Checkmk.
+        inotemessage (dict): The IDERI note message the text is for, its link can replace long plugin output.
 
     Returns:
         str: A string representing the text for the IDERI note message.
@@ -140,35 +237,153 @@ def get_inote_message_text(context):
     else:
         txt_info = notification_type  # Should never happen
 
-    context["EVENT_TXT"] = utils.substitute_context(
-        txt_info.replace("@", context["WHAT"]), context
+    from iderinote import templates
+    context["EVENT_TXT"] = templates.render_template(
+        templates.compile_template(txt_info.replace("@", context["WHAT"]), crlf=False), context, crlf=False
     )
 
-    # HOST or SERVICE
-    if context["WHAT"] == "HOST":
-        tmpl_text = tmpl_host_text
-    else:
-        tmpl_text = tmpl_service_text
+    # HOST or SERVICE (templates render CRLF line endings)
+    messageText = templates.render_template(get_inote_message_template(context), apply_inote_output_budget(context, inotemessage))
 
-    messageText = utils.substitute_context(tmpl_text, context)
+    # Note about notifications suppressed by the coalescing
+    if context.get("SUPPRESSED_TXT"):
+        messageText += "\r\n" + context["SUPPRESSED_TXT"] + "\r\n"
 
     writeDebug("Composing message text done.")
-    return messageText.replace("\n","\r\n")
+    return apply_inote_text_budget(context, messageText)
 
-def writeVerbose(string):
-    global logLevel
-    if logLevel % LogLevel.Verbose == 0:
-        print("VERBOSE: " + string)
+def apply_inote_output_budget(context, inotemessage=None):
+    """If payload budgets are set in the rule, cuts the plugin output of the
+    event to the budget per output field, keeping its first and last lines.
+    Returns: context dict (a copy if an output has been cut)"""
 
-def writeDebug(string):
-    global logLevel
-    if logLevel % LogLevel.Debug == 0:
-        print("DEBUG: " + string)
+    if "PARAMETER_INOTE_PAYLOAD_OUTPUT" not in context:
+        return context
+
+    from iderinote.truncate import truncate_text
+    budget = int(context["PARAMETER_INOTE_PAYLOAD_OUTPUT"])
+    # The link to Checkmk shows the whole output
+    linkOnly = (context.get("PARAMETER_INOTE_PAYLOAD_LINKONLY", "False") == "True"
+                and inotemessage is not None and bool(inotemessage.get("LINKTARGET")))
+    cutFields = {}
+    for field in (context["WHAT"] + "OUTPUT", "LONG" + context["WHAT"] + "OUTPUT"):
+        value = context.get(field)
+        if not value:
+            continue
+        size = len(value.encode("utf-8"))
+        if size <= budget:
+            continue
+        if linkOnly:
+            cutFields[field] = "[{} bytes of output, see the link]".format(size)
+        else:
+            cutFields[field] = truncate_text(value, budget)[0]
+        writeDebug('Cut %s to the budget of %d bytes.', field, budget, size=size)
+    if not cutFields:
+        return context
+    metrics.count("truncated", len(cutFields))
+    return dict(context, **cutFields)
+
+def apply_inote_text_budget(context, messageText):
+    """If a total payload budget is set in the rule, cuts the message text to
+    it. Returns: str"""
+
+    if "PARAMETER_INOTE_PAYLOAD_TOTAL" not in context:
+        return messageText
+
+    from iderinote.truncate import truncate_text
+    messageText, cut = truncate_text(messageText, int(context["PARAMETER_INOTE_PAYLOAD_TOTAL"]), "\r\n")
+    if cut:
+        writeDebug('Cut %d bytes of the message text.', cut)
+        metrics.count("truncated")
+    return messageText
+
+def get_inote_message_template(context):
+    """Returns the compiled template for the host or service notification. Uses
+    the named template selected in the rule and falls back to the built-in
+    templates if it is not set, cannot be read or lacks the section."""
+
+    from iderinote import templates
+    section = "Host" if context["WHAT"] == "HOST" else "Service"
+    templateName = context.get("PARAMETER_INOTE_TEMPLATE")
+    if templateName:
+        writeDebug('Loading template "%s"...', templateName)
+        try:
+            sections = templates.load_template(templateName)
+        except Exception as ex:
+            sys.stderr.write("Failed to load template '{}': {}\n".format(templateName, ex))
+        else:
+            if section in sections:
+                return sections[section]
+            writeVerbose('Template "%s" has no section [%s], using the default.', templateName, section)
+
+    return templates.compile_template(tmpl_host_text if section == "Host" else tmpl_service_text)
+
+def get_inote_bulk_message_text(contexts, part=1, parts=1):
+    """Composes the text for an IDERI note digest message of a bulk notification.
+
+    Args:
+        contexts (list): A list of context dicts (one per event) as returned by utils.read_bulk_contexts().
+        part (int): The number of this digest message within the bulk.
+        parts (int): The total number of digest messages sent for the bulk.
+
+    Returns:
+        str: A string representing the text for the IDERI note digest message.
+    """
+
+    writeVerbose("Composing IDERI note digest message text for %d events...", len(contexts))
+
+    hosts = set(c["HOSTNAME"] for c in contexts)
+    header = utils.substitute_context(tmpl_bulk_header_text, {
+        "EVENTCOUNT": str(len(contexts)),
+        "HOSTCOUNT": str(len(hosts)),
+        "PARTINFO": " - part " + str(part) + " of " + str(parts) if parts > 1 else "",
+    })
+
+    # Every event text is already CRLF terminated by get_inote_message_text
+    separator = tmpl_bulk_separator_text.replace("\n", "\r\n")
+    eventTexts = [get_inote_message_text(c) for c in contexts]
+
+    writeDebug("Composing digest message text done.")
+    return apply_inote_text_budget(contexts[0], header.replace("\n", "\r\n") + separator.join(eventTexts))
+
+def setLogLevel(level, traceSample=100):
+    """Sets the log level selected in the rule. The level enables all lower
+    levels, too. With a trace sample rate below 100 (percent) only that share
+    of the invocations writes trace output."""
 
-def writeTrace(string):
     global logLevel
-    if logLevel % LogLevel.Trace == 0:
-        print("TRACE: " + string)
+    global logMask
+    logLevel = level
+    logMask = (level << 1) - 1
+    if logMask & LogLevel.Trace and traceSample < 100:
+        import random
+        if random.uniform(0, 100) >= traceSample:
+            logMask &= ~LogLevel.Trace
+
+def logEnabled(level):
+    return logMask & level != 0
+
+def _writeLog(prefix, string, args, fields):
+    # Only called for enabled levels, so formatting happens on demand only
+    if args:
+        string = string % args
+    if fields:
+        string += " [" + " ".join(
+            key + "=" + (repr(str(val)) if " " in str(val) else str(val)) for key, val in fields.items()
+        ) + "]"
+    print(prefix + string)
+
+def writeVerbose(string, *args, **fields):
+    if logMask & LogLevel.Verbose:
+        _writeLog("VERBOSE: ", string, args, fields)
+
+def writeDebug(string, *args, **fields):
+    if logMask & LogLevel.Debug:
+        _writeLog("DEBUG: ", string, args, fields)
+
+def writeTrace(string, *args, **fields):
+    if logMask & LogLevel.Trace:
+        _writeLog("TRACE: ", string, args, fields)
 
 def remove_leading_character(string, character):
     if (string[0] == character):
@@ -176,50 +391,392 @@ def remove_leading_character(string, character):
     else: 
         return(string)
     
-def send_inote_message(inote_api_url, inote_api_user, inote_api_pass, ignore_cert, inote_message):
+def post_inote_message(url, inote_api_user, inote_api_pass, verifySsl, inote_message, body):
+    """Posts the message to the IDERI note API. Hands it to the local forwarder
+    if one is configured and falls back to a direct request (sending the
+    already serialized body) if the forwarder is not available.
+    Returns: (status_code, response_text) - status_code is OUTCOME_UNKNOWN if
+    the forwarder did not answer in time, FORWARDER_REJECTED if it did not
+    deliver the message"""
+
+    if forwarder_socket:
+        writeDebug('Handing message to forwarder at "%s"...', forwarder_socket)
+        import socket
+        try:
+            from iderinote.forwarder import ForwarderRejected, forward_inote_message
+            if compact_payload:
+                # The forwarder posts the fields it is given
+                import json
+                inote_message = json.loads(body)
+            return forward_inote_message(forwarder_socket, url, inote_api_user, inote_api_pass, verifySsl, inote_message, timeout=sum(api_timeout))
+        except ForwarderRejected as ex:
+            return FORWARDER_REJECTED, str(ex)
+        except socket.timeout as ex:
+            # The forwarder may still deliver the message, do not send it twice
+            return OUTCOME_UNKNOWN, "Forwarder did not answer in time: " + str(ex)
+        except (ImportError, OSError, ValueError) as ex:
+            writeVerbose("Forwarder not available (%s), sending message directly...", ex)
+
+    return call_inote_api("POST", url, inote_api_user, inote_api_pass, verifySsl, body)
+
+def call_inote_api(method, url, inote_api_user, inote_api_pass, verifySsl, body=None):
+    """Sends a request directly to the IDERI note API with the HTTP client
+    selected in the rule. Returns: (status_code, response_text)"""
+
+    if fast_startup or http_client == "httpclient":
+        import http.client
+        from iderinote import httpclient
+        try:
+            return httpclient.request(method, url, inote_api_user, inote_api_pass, verifySsl, body, timeout=api_timeout)
+        except (OSError, http.client.HTTPException) as ex:
+            return None, str(ex)
+
+    import requests
+    from requests.auth import HTTPBasicAuth
+    headers = {'Connection':'close'}
+    if body is not None:
+        headers['Content-Type'] = 'application/json'
+    try:
+        r = requests.request(method, url=url, verify=verifySsl, auth=HTTPBasicAuth(inote_api_user, inote_api_pass), data=body, headers=headers, timeout=api_timeout)
+    except requests.exceptions.RequestException as ex:
+        return None, str(ex)
+    return r.status_code, r.text
+
+def spool_inote_message(url, inote_api_user, inote_api_pass, verifySsl, inote_message, order_key):
+    """Writes the message to the delivery spool of the drain worker.
+    Returns: True if the message has been spooled"""
+
+    writeDebug('Writing message to the spool...')
+    try:
+        from iderinote import spool
+        path = spool.spool_inote_message(spool.get_default_spool_dir(), url, inote_api_user, inote_api_pass, verifySsl, inote_message, order_key)
+    except (ImportError, OSError) as ex:
+        sys.stderr.write("Failed to spool IDERI note message: {}\n".format(ex))
+        return False
+    writeTrace("Spooled message: %s", path)
+    metrics.count("spooled")
+    sys.stdout.write("IDERI note message spooled.")
+    return True
+
+def has_spooled_messages(order_key):
+    """Returns whether messages with the given order key wait in the delivery spool."""
+
+    try:
+        from iderinote import spool
+        return spool.has_pending(spool.get_default_spool_dir(), order_key)
+    except (ImportError, OSError) as ex:
+        writeDebug("Cannot check the spool: %s", ex)
+        return False
+
+def check_circuit_breaker(url):
+    """Returns False if the circuit breaker marks the API as unavailable."""
+
+    if circuit_breaker is None:
+        return True
+    try:
+        from iderinote import breaker
+        return breaker.allow_request(url, circuit_breaker[1])
+    except (ImportError, OSError) as ex:
+        writeVerbose("Circuit breaker not available (%s).", ex)
+        return True
+
+def record_circuit_breaker(url, status_code):
+    """Reports the result of a request to the circuit breaker. Connection
+    errors and server errors count as failures."""
+
+    if circuit_breaker is None:
+        return
+    try:
+        from iderinote import breaker
+        state = breaker.record_result(url, status_code is not None and status_code < 500, circuit_breaker[0])
+    except (ImportError, OSError) as ex:
+        writeVerbose("Circuit breaker not available (%s).", ex)
+        return
+    if state != breaker.CLOSED:
+        writeVerbose("Circuit breaker is %s.", state, url=url)
+
+def get_api_urls(inote_api_url):
+    """Returns the message URLs of the configured API endpoints in the order
+    they should be tried."""
+
+    endpoints = [inote_api_url] + [u for u in api_failover_urls if u != inote_api_url]
+    if len(endpoints) > 1:
+        try:
+            from iderinote.endpoints import order_endpoints
+            endpoints = order_endpoints(endpoints, api_balancing)
+        except (ImportError, OSError) as ex:
+            writeVerbose("Endpoint selection not available (%s).", ex)
+        writeDebug("API endpoint order: %s", ", ".join(endpoints))
+    return [endpoint + "/v1/messages" for endpoint in endpoints]
+
+def record_api_endpoint(url, latency, status_code):
+    """Updates the health of the endpoint of the message URL if more than one
+    endpoint is configured."""
+
+    if not api_failover_urls:
+        return
+    try:
+        from iderinote.endpoints import record_endpoint
+        record_endpoint(url[:-len("/v1/messages")], latency, status_code is not None and status_code < 500)
+    except (ImportError, OSError) as ex:
+        writeVerbose("Endpoint selection not available (%s).", ex)
+
+def get_order_key(context):
+    """Returns the key (host or host/service) the spool keeps the delivery order for."""
+    if context.get("WHAT") == "SERVICE":
+        return context["HOSTNAME"] + "/" + context["SERVICEDESC"]
+    return context.get("HOSTNAME", "")
+
+def send_inote_message(inote_api_url, inote_api_user, inote_api_pass, ignore_cert, inote_message, order_key="", track_key=None):
+    result, url, text, body = deliver_inote_message(inote_api_url, inote_api_user, inote_api_pass, ignore_cert, inote_message, order_key)
+    if url and track_key:
+        track_sent_inote_message(track_key, url, text, body, inote_api_user, inote_api_pass, not ignore_cert, inote_message)
+    return result
+
+def deliver_inote_message(inote_api_url, inote_api_user, inote_api_pass, ignore_cert, inote_message, order_key=""):
+    """Posts the message to the IDERI note API (or spools it). Does not touch
+    the message store, so it can run in any thread.
+    Returns: (exit code, url, response_text, body) - url is None unless the
+    message has been created on the server"""
+
     writeVerbose("Creating new IDERI note message...")
 
     # invert the bool for apiIgnoreSslVerification
     verifySsl = not ignore_cert
 
-    # compose URL
+    # compose URLs
     writeDebug('Composing the API url...')
-    url = inote_api_url + "/v1/messages"
+    urls = get_api_urls(inote_api_url)
     
     # Start and Endtime to required format
     writeDebug('Formatting start and end times...')
-    inote_message['STARTTIMEUTC'] = inote_message['STARTTIMEUTC'].strftime("%Y-%m-%dT%H:%M:%S")
-    inote_message['ENDTIMEUTC'] = inote_message['ENDTIMEUTC'].strftime("%Y-%m-%dT%H:%M:%S")
+    from datetime import datetime
+    from iderinote.encoder import format_timestamp
+    now = datetime.utcnow()
+    inote_message['STARTTIMEUTC'] = format_timestamp(inote_message['STARTTIMEUTC'] or now)
+    inote_message['ENDTIMEUTC'] = format_timestamp(inote_message['ENDTIMEUTC'] or now)
 
     # Write message string to log
-    writeTrace("Message object used:")
-    writeTrace(json.dumps(inote_message, indent = 4))
+    import json
+    if logEnabled(LogLevel.Trace):
+        writeTrace("Message object used:")
+        writeTrace(json.dumps(inote_message, indent = 4))
 
-    writeDebug('Calling API to create new message...')
-    r = requests.post(url=url, verify=verifySsl, auth=HTTPBasicAuth(inote_api_user, inote_api_pass), json=inote_message, headers={'Connection':'close'})
+    if spool_mode == "always" and spool_inote_message(urls[0], inote_api_user, inote_api_pass, verifySsl, inote_message, order_key):
+        return 0, None, None, None
+    if spool_mode == "onfailure" and has_spooled_messages(order_key):
+        # a direct send would overtake the messages waiting in the spool
+        writeVerbose("Older messages for %s wait in the spool, spooling this one, too.", order_key)
+        if spool_inote_message(urls[0], inote_api_user, inote_api_pass, verifySsl, inote_message, order_key):
+            return 0, None, None, None
 
-    if r.status_code != 200:
+    with metrics.span("serialize"):
+        if compact_payload:
+            body = encode_inote_message(inote_message)
+        else:
+            body = json.dumps(inote_message).encode("utf-8")
+    metrics.count("payload_bytes", len(body))
+
+    import time
+    if api_failover_urls and not forwarder_socket:
+        # Warm-up: import the HTTP client before the requests are timed for the
+        # endpoint selection, otherwise the first endpoint pays the import time
+        import importlib
+        importlib.import_module("iderinote.httpclient" if fast_startup or http_client == "httpclient" else "requests")
+    status_code, text = None, "Circuit breaker open, the API is marked as unavailable"
+    for i, url in enumerate(urls):
+        if not check_circuit_breaker(url):
+            metrics.count("breaker_rejected")
+            continue
+        if i > 0:
+            writeVerbose("Failing over to the next API endpoint...", url=url)
+            metrics.count("failover")
+        writeDebug('Calling API to create new message...')
+        start = time.monotonic()
+        with metrics.span("http"):
+            status_code, text = post_inote_message(url, inote_api_user, inote_api_pass, verifySsl, inote_message, body)
+        if status_code == OUTCOME_UNKNOWN:
+            # Neither fail over nor let Checkmk retry, the message could be shown twice.
+            # The endpoint did not fail, the circuit breaker and the health are not updated.
+            metrics.count("outcome_unknown")
+            sys.stderr.write("Outcome of the IDERI note message unknown, not sending it again: {}\n".format(text))
+            return 0, None, None, None
+        if status_code == FORWARDER_REJECTED:
+            # The forwarder is overloaded, not the endpoint: no failover, the
+            # circuit breaker and the health are not updated, Checkmk retries
+            metrics.count("forwarder_rejected")
+            break
+        metrics.count("sent" if status_code == 200 else "failed_" + str(status_code or "error"))
+        record_circuit_breaker(url, status_code)
+        record_api_endpoint(url, time.monotonic() - start, status_code)
+        # Client errors would be the same on every endpoint
+        if status_code is not None and status_code < 500:
+            break
+
+    writeVerbose("API response received.", status=status_code, key=order_key, payload_bytes=len(body))
+
+    if status_code != 200:
         sys.stderr.write(
             "Failed to send IDERI note message. Status: {}, Response: {}\n".format(
-                r.status_code, r.text
+                status_code, text
             )
         )
-        return 1  # Temporary error to make Checkmk retry
+        if spool_mode == "onfailure" and spool_inote_message(urls[0], inote_api_user, inote_api_pass, verifySsl, inote_message, order_key):
+            return 0, None, None, None
+        return 1, None, None, None  # Temporary error to make Checkmk retry
 
     sys.stdout.write(
         "IDERI note message created."
     )
-    return 0
+    return 0, url, text, body
+
+def encode_inote_message(inote_message):
+    """Encodes the message with only the fields differing from the server
+    defaults. At log level Debug the compact body is checked against the full
+    payload and replaced by it if they differ. Returns: bytes"""
+
+    from iderinote import encoder
+    body = encoder.encode_message(inote_message, message_defaults)
+    if logEnabled(LogLevel.Debug) and not encoder.is_equivalent(body, inote_message, message_defaults):
+        import json
+        sys.stderr.write("Compact payload differs from the full payload, sending the full payload.\n")
+        metrics.count("compact_mismatch")
+        body = json.dumps(inote_message).encode("utf-8")
+    return body
+
+def send_inote_messages(deliveries, inote_api_url, inote_api_user, inote_api_pass, ignore_cert):
+    """Sends the messages of several delivery targets concurrently (at most
+    max_concurrent_deliveries at a time). Deliveries not finished within the
+    delivery deadline count as failed. The created messages are tracked
+    afterwards, the message store belongs to the main thread.
+
+    Args:
+        deliveries (list): (message, order key, tracking key or None) tuples.
+
+    Returns:
+        int: The highest exit code of the deliveries.
+    """
+
+    if len(deliveries) == 1:
+        inote_message, order_key, track_key = deliveries[0]
+        return send_inote_message(inote_api_url, inote_api_user, inote_api_pass, ignore_cert, inote_message, order_key, track_key)
+
+    import threading
+    import time
+    writeVerbose("Sending %d messages concurrently...", len(deliveries), deadline=delivery_deadline)
+    results = [None] * len(deliveries)
+    pending = list(range(len(deliveries)))
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                i = pending.pop(0)
+            inote_message, order_key, _ = deliveries[i]
+            results[i] = deliver_inote_message(inote_api_url, inote_api_user, inote_api_pass, ignore_cert, inote_message, order_key)
+
+    # Daemon threads, so a hanging delivery cannot keep the process alive past the deadline
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(min(len(deliveries), max_concurrent_deliveries))]
+    deadline = time.monotonic() + delivery_deadline
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    with lock:
+        # Deliveries not started yet are not started anymore
+        del pending[:]
+
+    result = 0
+    for (inote_message, order_key, track_key), delivery in zip(deliveries, list(results)):
+        if delivery is None:
+            sys.stderr.write("Delivery of the message to {} did not finish within {:g} seconds.\n".format(
+                ",".join(inote_message["RECIPIENT"]), delivery_deadline))
+            metrics.count("deadline_exceeded")
+            result = max(result, 1)
+            continue
+        code, url, text, body = delivery
+        if url and track_key:
+            track_sent_inote_message(track_key, url, text, body, inote_api_user, inote_api_pass, not ignore_cert, inote_message)
+        result = max(result, code)
+    return result
+
+def track_sent_inote_message(key, url, response_text, body, inote_api_user, inote_api_pass, verifySsl, inote_message):
+    """Tracks a created message and schedules its escalation if it is an ALERT."""
+
+    index = track_inote_message(key, url, response_text, body)
+    if index is not None and escalation_steps and inote_message["PRIORITY"] == Priority.ALERT:
+        schedule_inote_escalation(key, index, url, inote_api_user, inote_api_pass, verifySsl)
+
+def track_inote_message(key, url, response_text, body):
+    """Stores the index of a created message, so it can be ended by the
+    RECOVERY or acknowledgement of the host/service. Returns: the index of
+    the message, None if it is not tracked"""
 
-def check_is_int(string, base=None):
     try:
-        ok = int(string, base) if base else int(string)
-        return True
-    except Exception:
+        from iderinote import tracking
+        index = tracking.get_message_index(response_text)
+        if index is None:
+            writeVerbose("API response holds no message index, message is not tracked.")
+            return None
+        tracking.add_message(key, index, url, body.decode("utf-8"))
+    except Exception as ex:
+        sys.stderr.write("Failed to track IDERI note message: {}\n".format(ex))
+        return None
+    writeDebug('Tracking message %s.', index, key=key)
+    return index
+
+def schedule_inote_escalation(key, index, url, inote_api_user, inote_api_pass, verifySsl):
+    """Schedules the escalation steps of the rule for a tracked ALERT message."""
+
+    try:
+        from iderinote import escalation
+        escalation.schedule(key, index, url, inote_api_user, inote_api_pass, verifySsl, escalation_steps)
+    except Exception as ex:
+        sys.stderr.write("Failed to schedule the escalation of IDERI note message {}: {}\n".format(index, ex))
+        return
+    writeDebug('Escalation of message %s scheduled.', index, steps=len(escalation_steps))
+
+def end_tracked_inote_message(key, inote_api_user, inote_api_pass, ignore_cert, action):
+    """Ends the tracked message of the key: "expire" sets its end time to now,
+    "revoke" deletes it on the server. Returns: True if a message has been ended"""
+
+    import json
+    try:
+        from iderinote import tracking
+        entry = tracking.pop_message(key)
+    except Exception as ex:
+        sys.stderr.write("Failed to read the tracked IDERI note messages: {}\n".format(ex))
+        return False
+    if entry is None:
+        writeDebug('No tracked message to end.', key=key)
         return False
 
+    index, url, body = entry
+    writeVerbose('Ending tracked message %s (%s)...', index, action, key=key)
+    if action == "revoke":
+        status_code, text = call_inote_api("DELETE", url + "/" + index, inote_api_user, inote_api_pass, not ignore_cert)
+    else:
+        from datetime import datetime
+        trackedMessage = json.loads(body)
+        trackedMessage["ENDTIMEUTC"] = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")
+        status_code, text = call_inote_api("PUT", url + "/" + index, inote_api_user, inote_api_pass, not ignore_cert,
+                                           json.dumps(trackedMessage).encode("utf-8"))
+    # A message deleted on the server has ended as well
+    if status_code == 404 or (status_code is not None and 200 <= status_code < 300):
+        metrics.count("ended")
+        return True
+    sys.stderr.write("Failed to end IDERI note message {}. Status: {}, Response: {}\n".format(index, status_code, text))
+    return False
+
 def parse_inote_message_params(context, message):
-    """Parses the parameters passed from checkmk and modifies the message dict accoringly. Returns: message dict
+    """Sets the message fields given by the rule parameters passed from checkmk
+    and the start and end time of the message. Returns: message dict
+
+    The parameters are compiled once into a typed payload skeleton (see
+    iderinote.skeleton), every further event with the same rule parameters
+    only copies the fields of the skeleton.
 
     Args:
         context (dict): A dict returned by utils.collect_context() from cmk.notification_plugins holding the parameters passed from Checkmk.
@@ -227,72 +784,149 @@ def parse_inote_message_params(context, message):
 
     Returns:
         dict: A dict representiing the IDERI note message.
+
+    Raises:
+        ValueError: A rule parameter has an invalid value.
     """
-    
+
+    from iderinote import skeleton
     writeVerbose('Parsing parameters to message...')
-    # parse message vars
-    for key, val in context.items():
-        if str(key).startswith("PARAMETER_INOTE_MSG_"):
-            msgParamName = str(key).split("_")[-1]
-            writeDebug('Trying parameter "' + key + '"...')
-            # parse start + end
-            if msgParamName == "DURATION":
-                writeDebug('Calculating and setting start and end of message...')
-                start = datetime.utcnow()
-                end = start + timedelta(minutes=int(val))
-                message['STARTTIMEUTC'] = start
-                message['ENDTIMEUTC'] = end
-            # parse Recipient and Exclude
-            elif msgParamName == "RECIPIENT" or msgParamName == "EXCLUDE":
-                writeDebug('Getting string list from value...')
-                message[msgParamName] = [s.strip() for s in str.split(val,',')]
-            # parse popup and fullscreen
-            elif key == "PARAMETER_INOTE_MSG_POPUP_OR_FS_SELECTION":
-                writeDebug('Setting message to ' + str(val).upper() + '...')
-                message['SHOWPOPUP'] = True # No matter what is specified, SHOWPOPUP must always be set
-                message[str(val).upper()] = True
-            # parse addressing mode
-            elif msgParamName == "ADDRESSINGMODE":
-                writeDebug('Setting ADDRESSINGMODE to ' + str(val) + '...')
-                message[msgParamName] = AddressingMode[str(val)]
-            # parse other params
-            elif str(msgParamName) in message: 
-                if check_is_int(val):
-                    writeDebug('Converting value to int...')
-                    message[msgParamName] = int(val)
-                elif val == 'True' or val == 'False':
-                    writeDebug('Converting value to bool...')
-                    message[msgParamName] = bool(val)
-                else:
-                    writeDebug('Leaving value as string...')
-                    message[msgParamName] = val
+    params = skeleton.get_message_params(context)
+    compiled = skeleton.load_skeleton(params, message_defaults, addressing_modes)
+    writeDebug('Setting %d message field(s) from the rule parameters...', len(compiled["fields"]))
+    for key, val in compiled["fields"].items():
+        message[key] = list(val) if isinstance(val, list) else val
+    from datetime import datetime, timedelta
+    start = datetime.utcnow()
+    message['STARTTIMEUTC'] = start
+    message['ENDTIMEUTC'] = start + timedelta(minutes=compiled["duration"] or 0)
     return message
 
-def add_link_to_inote_message(context, inotemessage):
+def refresh_inote_directory(context, recipients=()):
+    """Starts the background refresh of the cached directory of the IDERI
+    note server, unless another process is refreshing it already."""
+
+    from iderinote import directory
+    api_url = context["PARAMETER_INOTE_API_URL"]
+    if directory.request_refresh(api_url, recipients):
+        writeVerbose("Refreshing the cached directory in the background...", mode=directory_refresh)
+        refresh = directory.refresh_in_thread if directory_refresh == "thread" else directory.refresh_in_background
+        refresh(api_url, context["PARAMETER_INOTE_API_USERNAME"], context["PARAMETER_INOTE_API_USERPASS"],
+                context.get("PARAMETER_INOTE_API_INSECURECONNECTION", "False") != "True", api_timeout)
+
+def resolve_inote_network_ranges(context, inotemessage):
+    """If the rule targets network ranges, sets the ids of the network ranges
+    from the cached directory of the IDERI note server. Returns: exit code (0
+    on success, 1 if the directory is being fetched, 2 for unknown ranges)"""
+
+    from iderinote import skeleton
+    names = skeleton.load_skeleton(skeleton.get_message_params(context), message_defaults, addressing_modes)["networkranges"]
+    if not names:
+        return 0
+
+    writeVerbose('Resolving %d network range(s)...', len(names))
+    try:
+        from iderinote import directory
+        ids, unknown, refresh = directory.resolve_network_ranges(context["PARAMETER_INOTE_API_URL"], names)
+        if refresh:
+            refresh_inote_directory(context)
+    except (ImportError, OSError) as ex:
+        sys.stderr.write("Failed to resolve the network ranges: {}\n".format(ex))
+        return 1
+    if unknown:
+        if refresh:
+            sys.stderr.write("Network range(s) {} not in the cached directory yet, retrying later.\n".format(", ".join(unknown)))
+            return 1
+        sys.stderr.write("Unknown network range(s): {}\n".format(", ".join(unknown)))
+        return 2  # Permanent error, a retry cannot help
+    writeDebug('Network ranges resolved.', ids=",".join(str(i) for i in ids))
+    inotemessage["NETWORKRANGEIDS"] = ids
+    return 0
+
+def check_inote_recipients(context, inotemessage):
+    """If the recipient check is enabled in the rule, removes the recipients
+    and excludes the IDERI note server does not know (according to the cached
+    directory). Returns: True if the message has recipients left"""
+
+    if context.get("PARAMETER_INOTE_API_CHECKRECIPIENTS", "False") != "True":
+        return True
+
+    try:
+        from iderinote import directory
+        invalid, pending = directory.check_recipients(context["PARAMETER_INOTE_API_URL"], inotemessage["RECIPIENT"] + inotemessage["EXCLUDE"])
+        if pending:
+            writeDebug('%d recipient(s) not checked yet.', len(pending))
+            refresh_inote_directory(context, pending)
+    except (ImportError, OSError) as ex:
+        writeVerbose("Recipient check not available (%s), sending the message...", ex)
+        return True
+    if not invalid:
+        return True
+
+    sys.stderr.write("Unknown recipient(s) removed from the message: {}\n".format(", ".join(invalid)))
+    metrics.count("invalid_recipients", len(invalid))
+    inotemessage["RECIPIENT"] = [r for r in inotemessage["RECIPIENT"] if r not in invalid]
+    inotemessage["EXCLUDE"] = [r for r in inotemessage["EXCLUDE"] if r not in invalid]
+    if not inotemessage["RECIPIENT"]:
+        sys.stderr.write("No known recipient left, the message is not sent.\n")
+        return False
+    return True
+
+def get_inote_link(context):
+    """Composes the link to the host or service in Checkmk. Returns: str, ""
+    if the checkmk 'checkmkurl' is not set"""
+
+    if 'PARAMETER_CHECKMKURL' not in context:
+        return ""
+    import posixpath
+    from urllib.parse import urljoin
+    linkTarget = ""
+    if context['WHAT'] == 'HOST':
+        writeDebug('Composing host url...')
+        urlPath = posixpath.join(context['OMD_SITE'], remove_leading_character(context['HOSTURL'],"/"))
+        writeTrace("URL part: %s", urlPath)
+        linkTarget = urljoin(context['PARAMETER_CHECKMKURL'], urlPath)
+    elif context['WHAT'] == 'SERVICE':
+        writeDebug('Composing service url...')
+        urlPath = posixpath.join(context['OMD_SITE'], remove_leading_character(context['SERVICEURL'],"/"))
+        writeTrace("URL part: %s", urlPath)
+        linkTarget = urljoin(context['PARAMETER_CHECKMKURL'], urlPath)
+    return str(linkTarget)
+
+def add_link_to_inote_message(context, inotemessage, linkTarget=None):
     """If the checkmk 'checkmkurl' is set, determine if a link can be added to
-    the IDERI note message and do so if appropriate. Returns: message dict"""
+    the IDERI note message and do so if appropriate. The link composed by
+    get_inote_link() can be passed in, so the messages of several targets
+    share it. Returns: message dict"""
     
     writeVerbose('Checking if a link to check_mk should be added...')
-    if 'PARAMETER_CHECKMKURL' in context:
-        if inotemessage['SHOWFULLSCREEN'] == False and inotemessage['SHOWFULLSCREENANDLOCK'] == False:
-            if context['WHAT'] == 'HOST':
-                writeDebug('Composing host url...')
-                urlPath = posixpath.join(context['OMD_SITE'], remove_leading_character(context['HOSTURL'],"/"))
-                writeTrace("URL part: " + urlPath)
-                linkTarget = urljoin(context['PARAMETER_CHECKMKURL'], urlPath)
-            elif context['WHAT'] == 'SERVICE':
-                writeDebug('Composing service url...')
-                urlPath = posixpath.join(context['OMD_SITE'], remove_leading_character(context['SERVICEURL'],"/"))
-                writeTrace("URL part: " + urlPath)
-                linkTarget = urljoin(context['PARAMETER_CHECKMKURL'], urlPath)
-            if linkTarget != "":
-                writeVerbose("Adding link to IDERI note message...")
-                inotemessage['LINKTARGET'] = str(linkTarget)
-                inotemessage['LINKTEXT'] = "Show in Checkmk"
+    if inotemessage['SHOWFULLSCREEN'] == False and inotemessage['SHOWFULLSCREENANDLOCK'] == False:
+        if linkTarget is None:
+            linkTarget = get_inote_link(context)
+        if linkTarget != "":
+            writeVerbose("Adding link to IDERI note message...")
+            inotemessage['LINKTARGET'] = linkTarget
+            inotemessage['LINKTEXT'] = "Show in Checkmk"
+    return inotemessage
+
+def add_text_to_inote_message(context, inotemessage, texts):
+    """Sets the text of the message. The messages of one event share their
+    text, it only differs by the link (see the payload budget) and by the
+    suppressed notifications of the recipient set. Returns: message dict
+
+    Args:
+        texts (dict): The texts composed for the event so far, filled by this function.
+    """
+
+    linkOnly = context.get("PARAMETER_INOTE_PAYLOAD_LINKONLY", "False") == "True"
+    textKey = (linkOnly and bool(inotemessage.get("LINKTARGET")), context.get("SUPPRESSED_TXT"))
+    if textKey not in texts:
+        texts[textKey] = get_inote_message_text(context, inotemessage)
+    inotemessage["TEXT"] = texts[textKey]
     return inotemessage
 
 def _get_inote_priority_from_hoststate(hoststate):
-    writeDebug("Converting HOSTSTATE '" + hoststate + "' to IDERI note priority...")
+    writeDebug("Converting HOSTSTATE '%s' to IDERI note priority...", hoststate)
     if hoststate == "UP":
         return Priority.INFORMATION
     elif hoststate == "DOWN":
@@ -302,7 +936,7 @@ def _get_inote_priority_from_hoststate(hoststate):
     return Priority.WARNING
 
 def _get_inote_priority_from_servicestate(servicestate):
-    writeDebug("Converting SERVICESTATE '" + servicestate + "' to IDERI note priority...")
+    writeDebug("Converting SERVICESTATE '%s' to IDERI note priority...", servicestate)
     if servicestate == "OK":
         return Priority.INFORMATION
     elif servicestate == "WARNING":
@@ -331,33 +965,518 @@ def get_inote_priority_from_state(context):
 
 
 
+def get_inote_message_key(context, inotemessage):
+    """Returns the key of the messages of a host/service and recipient set."""
+    return get_order_key(context) + "|" + ",".join(inotemessage["RECIPIENT"]) + "|" + ",".join(inotemessage["EXCLUDE"])
+
+def coalesce_inote_event(context, inotemessage):
+    """If coalescing is enabled in the rule, checks if the event is a duplicate,
+    part of a flapping or of a rapid PROBLEM/RECOVERY sequence. Returns: True
+    if the notification should be sent"""
+
+    if "PARAMETER_INOTE_COALESCE_WINDOW" not in context:
+        return True
+
+    writeVerbose('Checking if the event should be coalesced...')
+    key = get_inote_message_key(context, inotemessage)
+    window = int(context["PARAMETER_INOTE_COALESCE_WINDOW"])
+    maxChanges = int(context.get("PARAMETER_INOTE_COALESCE_MAXCHANGES", 3))
+    try:
+        from iderinote.coalesce import check_event
+        send, suppressed, since = check_event(key, context, window, maxChanges)
+    except (ImportError, OSError) as ex:
+        writeVerbose("Coalescing not available (%s), sending notification...", ex)
+        return True
+
+    if not send:
+        writeVerbose('Suppressing notification for "%s".', key, type=context.get("NOTIFICATIONTYPE"))
+        metrics.count("suppressed")
+        return False
+    if suppressed:
+        writeDebug('%d notification(s) have been suppressed before.', suppressed)
+        from datetime import datetime
+        context["SUPPRESSED_TXT"] = "Suppressed: {} similar notification(s) since {} UTC".format(
+            suppressed, datetime.utcfromtimestamp(since).strftime("%Y-%m-%d %H:%M:%S"))
+    return True
+
+def check_inote_rate_limit(context, inotemessage):
+    """If rate limits are set in the rule, takes a token from the bucket of
+    the recipient set and priority of the message. Returns: True if the
+    message may be sent on its own"""
+
+    if "PARAMETER_INOTE_RATELIMIT_RATE" not in context:
+        return True
+
+    rate = float(context["PARAMETER_INOTE_RATELIMIT_RATE"])
+    burst = int(context.get("PARAMETER_INOTE_RATELIMIT_BURST", 10))
+    key = ",".join(inotemessage["RECIPIENT"]) + "|" + ",".join(inotemessage["EXCLUDE"]) + "|" + str(inotemessage["PRIORITY"])
+    try:
+        from iderinote.ratelimit import take_token
+        allowed = take_token(key, rate, burst)
+    except (ImportError, OSError) as ex:
+        writeVerbose("Rate limits not available (%s), sending notification...", ex)
+        return True
+    if not allowed:
+        writeVerbose('Rate limit of "%s" exceeded.', key, type=context.get("NOTIFICATIONTYPE"))
+        metrics.count("ratelimited")
+    return allowed
+
+def send_inote_storm_summary(context, inotemessage, inote_api_url, inote_api_user, inote_api_pass, ignore_cert):
+    """Adds the event to the rolling storm summary of the recipient set and
+    creates or updates the summary message (ticker only). The summary has
+    the highest priority of its events. Returns: True if the summary has
+    been created or updated"""
+
+    import copy
+    import json
+    import time
+    from datetime import datetime, timedelta
+    try:
+        from iderinote import ratelimit, tracking
+    except ImportError as ex:
+        writeVerbose("Storm summary not available (%s).", ex)
+        return False
+
+    what = context.get("WHAT", "HOST")
+    event = "{} {}{} {}".format(
+        context.get("NOTIFICATIONTYPE", ""), context.get("HOSTNAME", ""),
+        "/" + context.get("SERVICEDESC", "") if what == "SERVICE" else "", context.get(what + "STATE", ""))
+    key = ",".join(inotemessage["RECIPIENT"]) + "|" + ",".join(inotemessage["EXCLUDE"])
+    verifySsl = not ignore_cert
+
+    try:
+        with ratelimit.storm_summary(key) as summary:
+            now = datetime.utcnow()
+            summary["count"] += 1
+            summary["alerts"] += inotemessage["PRIORITY"] == Priority.ALERT
+            summary["priority"] = max(summary["priority"], inotemessage["PRIORITY"])
+            summary["events"] = (summary["events"] + [event])[-ratelimit.SUMMARY_EVENTS:]
+            summary["updated"] = time.time()
+
+            stormMessage = copy.deepcopy(inotemessage)
+            for mode in ("SHOWPOPUP", "SHOWFULLSCREEN", "SHOWFULLSCREENANDLOCK"):
+                stormMessage[mode] = False
+            stormMessage["SHOWTICKER"] = True
+            stormMessage["LINKTARGET"] = stormMessage["LINKTEXT"] = ""
+            stormMessage["PRIORITY"] = summary["priority"]
+            stormMessage["TEXT"] = "Notification storm: {} notifications ({} alerts) since {} UTC. Latest: {}".format(
+                summary["count"], summary["alerts"],
+                datetime.utcfromtimestamp(summary["since"]).strftime("%H:%M"), " | ".join(reversed(summary["events"])))
+            stormMessage["STARTTIMEUTC"] = datetime.utcfromtimestamp(summary["since"]).strftime("%Y-%m-%dT%H:%M:%S")
+            stormMessage["ENDTIMEUTC"] = (now + timedelta(seconds=ratelimit.SUMMARY_TTL)).strftime("%Y-%m-%dT%H:%M:%S")
+            body = json.dumps(stormMessage).encode("utf-8")
+
+            status_code, text = None, ""
+            if summary["index"]:
+                writeDebug('Updating storm summary %s...', summary["index"], count=summary["count"])
+                status_code, text = call_inote_api("PUT", summary["url"] + "/" + summary["index"], inote_api_user, inote_api_pass, verifySsl, body)
+                if status_code == 404:
+                    summary["index"] = None
+            if not summary["index"]:
+                writeDebug('Creating storm summary...', count=summary["count"])
+                url = get_api_urls(inote_api_url)[0]
+                status_code, text = post_inote_message(url, inote_api_user, inote_api_pass, verifySsl, stormMessage, body)
+                if status_code == OUTCOME_UNKNOWN:
+                    # The summary may have been created, the next event creates a new one
+                    sys.stderr.write("Outcome of the storm summary unknown: {}\n".format(text))
+                    return True
+                if status_code == 200:
+                    summary["index"] = tracking.get_message_index(text)
+                    summary["url"] = url
+    except OSError as ex:
+        sys.stderr.write("Failed to update the storm summary: {}\n".format(ex))
+        return False
+
+    if status_code is None or not 200 <= status_code < 300:
+        sys.stderr.write("Failed to send the storm summary. Status: {}, Response: {}\n".format(status_code, text))
+        return False
+    metrics.count("summarized")
+    sys.stdout.write("IDERI note storm summary updated.")
+    return True
+
+def dump_inote_context(context):
+    """Appends the context (without the API password) to the capture file used
+    by the replay tool if the rule asks for it."""
+
+    if context.get("PARAMETER_INOTE_PLUGIN_DUMPCONTEXT", "False") != "True":
+        return
+    import json
+    path = os.environ.get("INOTE_DUMP_FILE") or os.path.join(
+        os.environ.get("OMD_ROOT", "/tmp"), "var", "inote", "contexts.jsonl")
+    writeDebug('Dumping context to "%s"...', path)
+    line = json.dumps(dict(context, PARAMETER_INOTE_API_USERPASS="")) + "\n"
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # one write per line with O_APPEND, so concurrent processes do not interleave
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
+    except OSError as ex:
+        sys.stderr.write("Failed to dump context: {}\n".format(ex))
+
+def set_metrics(context):
+    """Enables the metrics if the rule asks for it."""
+
+    global metrics
+    if context.get("PARAMETER_INOTE_PLUGIN_METRICS", "False") == "True":
+        try:
+            from iderinote.metrics import Metrics
+            metrics = Metrics()
+        except ImportError as ex:
+            writeVerbose("Metrics not available (%s).", ex)
+
+def set_delivery_options(context):
+    """Enables the local forwarder, the spool, the HTTP client, the timeouts,
+    the circuit breaker, the additional API endpoints and the compact payload
+    the rule asks for."""
+
+    global forwarder_socket
+    global spool_mode
+    global http_client
+    global api_timeout
+    global circuit_breaker
+    global api_failover_urls
+    global api_balancing
+    global compact_payload
+    spool_mode = context.get("PARAMETER_INOTE_API_SPOOL") or None
+    compact_payload = context.get("PARAMETER_INOTE_API_COMPACTPAYLOAD", "False") == "True"
+    http_client = context.get("PARAMETER_INOTE_API_HTTPCLIENT", "requests")
+    api_timeout = (
+        float(context.get("PARAMETER_INOTE_API_TIMEOUTS_CONNECT", api_timeout[0])),
+        float(context.get("PARAMETER_INOTE_API_TIMEOUTS_READ", api_timeout[1])),
+    )
+    # Checkmk passes list parameters as numbered variables
+    api_failover_urls = []
+    while "PARAMETER_INOTE_API_FAILOVERURLS_%d" % (len(api_failover_urls) + 1) in context:
+        api_failover_urls.append(context["PARAMETER_INOTE_API_FAILOVERURLS_%d" % (len(api_failover_urls) + 1)])
+    api_balancing = context.get("PARAMETER_INOTE_API_BALANCING", "health")
+    circuit_breaker = None
+    if "PARAMETER_INOTE_API_CIRCUITBREAKER_FAILURES" in context:
+        circuit_breaker = (
+            int(context["PARAMETER_INOTE_API_CIRCUITBREAKER_FAILURES"]),
+            int(context.get("PARAMETER_INOTE_API_CIRCUITBREAKER_COOLDOWN", 60)),
+        )
+    forwarder_socket = None
+    if context.get("PARAMETER_INOTE_API_USEFORWARDER", "False") == "True":
+        try:
+            from iderinote.forwarder import get_default_socket_path
+            forwarder_socket = get_default_socket_path()
+        except ImportError as ex:
+            writeVerbose("Forwarder library not installed (%s), sending messages directly...", ex)
+
+def set_escalation_steps(context):
+    """Reads the escalation steps of the rule (PARAMETER_INOTE_ESCALATION_<n>_*),
+    sorted by their delay."""
+
+    global escalation_steps
+    prefix = "PARAMETER_INOTE_ESCALATION_"
+    steps = {}
+    for key, val in context.items():
+        if key.startswith(prefix):
+            number, _, field = key[len(prefix):].partition("_")
+            if number.isdigit() and field:
+                steps.setdefault(int(number), {})[field.lower()] = val
+    escalation_steps = sorted((
+        {
+            "delay": int(step.get("delay", 0)),
+            "display": step.get("display", ""),
+            "recipients": [r.strip() for r in step.get("recipients", "").split(",") if r.strip()],
+        } for step in steps.values()), key=lambda step: step["delay"])
+
+def set_delivery_targets(context):
+    """Reads the delivery targets of the rule (PARAMETER_INOTE_TARGETS_TARGETS_<n>_*)
+    as routes and the deadline of their deliveries."""
+
+    global delivery_targets
+    global delivery_deadline
+    prefix = "PARAMETER_INOTE_TARGETS_TARGETS_"
+    targets = {}
+    for key, val in context.items():
+        if key.startswith(prefix):
+            number, _, field = key[len(prefix):].partition("_")
+            if number.isdigit() and field:
+                targets.setdefault(int(number), {})[field.lower()] = val
+    delivery_targets = []
+    for number, target in sorted(targets.items()):
+        display = [target["display"]] if target.get("display") else []
+        if target.get("showticker") == "True":
+            display.append("showticker")
+        addressingMode = target.get("addressingmode") or None
+        if addressingMode is not None and addressingMode not in addressing_modes:
+            raise ValueError('unknown addressing mode "{}" of target {}'.format(addressingMode, number))
+        delivery_targets.append({
+            "name": "target {}".format(number),
+            "recipients": [r.strip() for r in target.get("recipients", "").split(",") if r.strip()],
+            "exclude": [r.strip() for r in target.get("exclude", "").split(",") if r.strip()],
+            "display": display,
+            "addressingmode": addressingMode,
+            "final": False,
+        })
+    delivery_deadline = float(context.get("PARAMETER_INOTE_TARGETS_DEADLINE", 60))
+
+def set_routing_table(context):
+    """Loads the recipient routing table the rule asks for."""
+
+    global routing_table
+    routing_table = None
+    name = context.get("PARAMETER_INOTE_ROUTING")
+    if not name:
+        return
+    writeVerbose('Loading routing table "%s"...', name)
+    try:
+        from iderinote.routing import load_routing_table
+        routing_table = load_routing_table(name)
+    except Exception as ex:
+        sys.stderr.write("Failed to load routing table \"{}\", using the recipients of the rule: {}\n".format(name, ex))
+
+def get_inote_route_messages(context, inotemessage):
+    """Returns one IDERI note message per routing table entry matching the
+    event. If no routing table is used or no entry matches, one message per
+    delivery target of the rule is returned, without targets the message with
+    the recipients of the rule. Returns: list of message dicts"""
+
+    import copy
+    routes = []
+    if routing_table is not None:
+        from iderinote.routing import get_routes
+        routes = get_routes(routing_table, context)
+        writeDebug('%d routing table entries match.', len(routes), routes=",".join(r["name"] for r in routes))
+    if not routes:
+        routes = delivery_targets
+    if not routes:
+        return [inotemessage]
+
+    routeMessages = []
+    for route in routes:
+        routeMessage = copy.deepcopy(inotemessage)
+        if route["recipients"]:
+            routeMessage["RECIPIENT"] = list(route["recipients"])
+        if route["exclude"]:
+            routeMessage["EXCLUDE"] = list(route["exclude"])
+        if route["display"]:
+            for mode in ("SHOWPOPUP", "SHOWTICKER", "SHOWFULLSCREEN", "SHOWFULLSCREENANDLOCK"):
+                routeMessage[mode] = mode.lower() in route["display"]
+            # SHOWPOPUP must always be set for full screen messages
+            if routeMessage["SHOWFULLSCREEN"] or routeMessage["SHOWFULLSCREENANDLOCK"]:
+                routeMessage["SHOWPOPUP"] = True
+        if route["addressingmode"]:
+            routeMessage["ADDRESSINGMODE"] = getattr(AddressingMode, route["addressingmode"])
+        routeMessages.append(routeMessage)
+    return routeMessages
+
+def get_inote_bulk_groups(contexts, message):
+    """Groups the events of a bulk notification by their recipient set (and
+    display options if a routing table is used).
+
+    Args:
+        contexts (list): A list of context dicts (one per event) as returned by utils.read_bulk_contexts().
+        message (dict): A dict representing the IDERI note message used as template for every group.
+
+    Returns:
+        list: A list of (message, contexts) tuples, one per distinct recipient set.
+    """
+
+    import copy
+    writeVerbose("Grouping bulk events by recipient set...")
+    groups = {}
+    for c in contexts:
+        with metrics.span("parse"):
+            eventMessage = parse_inote_message_params(c, copy.deepcopy(message))
+            routeMessages = get_inote_route_messages(c, eventMessage)
+        for groupMessage in routeMessages:
+            groupKey = (tuple(groupMessage["RECIPIENT"]), tuple(groupMessage["EXCLUDE"]), groupMessage["ADDRESSINGMODE"],
+                        groupMessage["SHOWPOPUP"], groupMessage["SHOWTICKER"], groupMessage["SHOWFULLSCREEN"], groupMessage["SHOWFULLSCREENANDLOCK"])
+            if groupKey not in groups:
+                groups[groupKey] = (groupMessage, [])
+            groups[groupKey][1].append(c)
+    writeDebug("Found %d recipient set(s).", len(groups))
+    return list(groups.values())
+
+def main_bulk():
+    """Sends one digest message per recipient set (and per bulk_max_events
+    events) for a Checkmk bulk notification read from stdin. Returns: exit code"""
+
+    global context
+    global profiler
+    import copy
+    parameters, contexts = utils.read_bulk_contexts()
+    # The rule parameters of a bulk are only known now
+    if profiler is None and parameters.get("PARAMETER_INOTE_PLUGIN_PROFILE") == "True":
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    setLogLevel(int(parameters['PARAMETER_INOTE_PLUGIN_LOGLEVEL']), int(parameters.get('PARAMETER_INOTE_PLUGIN_TRACESAMPLE', 100)))
+
+    writeVerbose("Processing bulk notification...", events=len(contexts))
+    if logEnabled(LogLevel.Trace):
+        writeTrace("Parameters passed to script:")
+        for key, val in parameters.items():
+            writeTrace("%s=%s", key, val)
+        writeTrace('--- END PARAMETERS ---')
+
+    # Every context of a bulk carries the rule parameters
+    for c in contexts:
+        c.update(parameters)
+        dump_inote_context(c)
+    context = parameters
+
+    # Get the IDERI note API information
+    api_url = parameters['PARAMETER_INOTE_API_URL']
+    api_user = parameters['PARAMETER_INOTE_API_USERNAME']
+    api_pass = parameters['PARAMETER_INOTE_API_USERPASS']
+    api_connection_ignore_cert = parameters.get("PARAMETER_INOTE_API_INSECURECONNECTION", "False") == "True"
+    set_delivery_options(parameters)
+    set_metrics(parameters)
+    set_routing_table(parameters)
+    maxEvents = int(parameters.get("PARAMETER_INOTE_BULK_MAXEVENTS", bulk_max_events))
+
+    try:
+        set_delivery_targets(parameters)
+        groups = get_inote_bulk_groups(contexts, message)
+    except ValueError as ex:
+        sys.stderr.write("Invalid rule parameter: {}\n".format(ex))
+        return 2  # Permanent error, a retry cannot help
+
+    result = 0
+    deliveries = []
+    for groupMessage, groupContexts in groups:
+        directoryResult = resolve_inote_network_ranges(parameters, groupMessage)
+        if directoryResult:
+            result = max(result, directoryResult)
+            continue
+        if not check_inote_recipients(parameters, groupMessage):
+            result = max(result, 2)
+            continue
+        groupContexts = [c for c in groupContexts if coalesce_inote_event(c, groupMessage)]
+        chunks = [groupContexts[i:i + maxEvents] for i in range(0, len(groupContexts), maxEvents)]
+        for part, chunk in enumerate(chunks, start=1):
+            digest = copy.deepcopy(groupMessage)
+            hosts = set(c["HOSTNAME"] for c in chunk)
+            # Link to the host if all events of the digest belong to the same one
+            with metrics.span("link"):
+                if len(chunk) == 1:
+                    digest = add_link_to_inote_message(chunk[0], digest)
+                elif len(hosts) == 1:
+                    digest = add_link_to_inote_message(dict(chunk[0], WHAT="HOST"), digest)
+            with metrics.span("text"):
+                digest["TEXT"] = get_inote_bulk_message_text(chunk, part, len(chunks))
+            digest["PRIORITY"] = max(get_inote_priority_from_state(c) for c in chunk)
+            order_key = get_order_key(chunk[0]) if len(chunk) == 1 else (hosts.pop() if len(hosts) == 1 else "")
+            deliveries.append((digest, order_key, None))
+    if deliveries:
+        result = max(result, send_inote_messages(deliveries, api_url, api_user, api_pass, api_connection_ignore_cert))
+    return result
+
 def main():
-    global logLevel
     global context
     global message
+    if len(sys.argv) > 1 and sys.argv[1] == "--bulk":
+        return main_bulk()
+
     context = utils.collect_context()
-    logLevel = LogLevel(int(context['PARAMETER_INOTE_PLUGIN_LOGLEVEL']))
+    setLogLevel(int(context['PARAMETER_INOTE_PLUGIN_LOGLEVEL']), int(context.get('PARAMETER_INOTE_PLUGIN_TRACESAMPLE', 100)))
+    writeVerbose("Processing notification...", host=context.get("HOSTNAME"), service=context.get("SERVICEDESC", ""), type=context.get("NOTIFICATIONTYPE"))
 
-    ## If log level DEBUG write NOTIFY_ env vars to notify.log
-    writeTrace("Values passed to script (NOTIFY_ env variables):")
-    for key, val in context.items():
-        writeTrace(key + '=' + val)
-    writeTrace('--- END NOTIFY_ VARIABLES ---')
+    ## If log level TRACE write NOTIFY_ env vars to notify.log
+    if logEnabled(LogLevel.Trace):
+        writeTrace("Values passed to script (NOTIFY_ env variables):")
+        for key, val in context.items():
+            writeTrace("%s=%s", key, val)
+        writeTrace('--- END NOTIFY_ VARIABLES ---')
+    dump_inote_context(context)
 
     # Get the IDERI note API information
     api_url = context['PARAMETER_INOTE_API_URL']
     api_user = context['PARAMETER_INOTE_API_USERNAME']
     api_pass = context['PARAMETER_INOTE_API_USERPASS']
-    api_connection_ignore_cert = context.get("PARAMETER_INOTE_API_INSECURECONNECTION", "False")
+    api_connection_ignore_cert = context.get("PARAMETER_INOTE_API_INSECURECONNECTION", "False") == "True"
+    set_delivery_options(context)
+    set_metrics(context)
+    set_routing_table(context)
+    set_escalation_steps(context)
 
     # Fill the IDERI note message object with given values
-    message = parse_inote_message_params(context, message)
-    message = add_link_to_inote_message(context, message)
-    message["TEXT"] = get_inote_message_text(context)
-    message["PRIORITY"] = get_inote_priority_from_state(context)
+    with metrics.span("parse"):
+        try:
+            set_delivery_targets(context)
+            message = parse_inote_message_params(context, message)
+        except ValueError as ex:
+            sys.stderr.write("Invalid rule parameter: {}\n".format(ex))
+            return 2  # Permanent error, a retry cannot help
+        directoryResult = resolve_inote_network_ranges(context, message)
+        if directoryResult:
+            return directoryResult
+        routeMessages = get_inote_route_messages(context, message)
+
+    # Tracked messages are ended by the RECOVERY/acknowledgement or replaced by the next PROBLEM
+    trackingAction = context.get("PARAMETER_INOTE_TRACKING_ACTION")
+    notificationType = context.get("NOTIFICATIONTYPE", "")
+    ending = notificationType == "RECOVERY" or notificationType.startswith("ACKNOWLEDGEMENT")
+    skipEndingMessage = context.get("PARAMETER_INOTE_TRACKING_SKIPRECOVERY", "False") == "True"
+
+    # Create one IDERI note message per route, the link and the text are composed once
+    result = 0
+    sent = 0
+    deliveries = []
+    linkTarget = None
+    texts = {}
+    for routeMessage in routeMessages:
+        context.pop("SUPPRESSED_TXT", None)
+        if not coalesce_inote_event(context, routeMessage):
+            continue
+        if not check_inote_recipients(context, routeMessage):
+            result = max(result, 2)
+            sent += 1
+            continue
+        trackKey = None
+        if trackingAction and (ending or notificationType == "PROBLEM"):
+            trackKey = get_inote_message_key(context, routeMessage)
+            ended = end_tracked_inote_message(trackKey, api_user, api_pass, api_connection_ignore_cert, trackingAction)
+            if ended and ending and skipEndingMessage:
+                sys.stdout.write("IDERI note message ended.")
+                sent += 1
+                continue
+        routeMessage["PRIORITY"] = get_inote_priority_from_state(context)
+        if not check_inote_rate_limit(context, routeMessage):
+            if send_inote_storm_summary(context, routeMessage, api_url, api_user, api_pass, api_connection_ignore_cert):
+                sent += 1
+                continue
+            # Alerts are never dropped, all others are retried by Checkmk
+            if routeMessage["PRIORITY"] != Priority.ALERT:
+                result = max(result, 1)
+                sent += 1
+                continue
+            writeVerbose("Sending the alert on its own...")
+        with metrics.span("link"):
+            if linkTarget is None:
+                linkTarget = get_inote_link(context)
+            routeMessage = add_link_to_inote_message(context, routeMessage, linkTarget)
+        with metrics.span("text"):
+            routeMessage = add_text_to_inote_message(context, routeMessage, texts)
+        deliveries.append((routeMessage, get_order_key(context), trackKey if notificationType == "PROBLEM" else None))
+        sent += 1
+    if deliveries:
+        result = max(result, send_inote_messages(deliveries, api_url, api_user, api_pass, api_connection_ignore_cert))
+    if not sent:
+        sys.stdout.write("IDERI note message suppressed.")
+    return result
 
-    # Create the IDERI note message
-    return send_inote_message(api_url, api_user, api_pass, bool(api_connection_ignore_cert), message)
+def save_profile():
+    """Writes the profile of this notification if profiling is enabled."""
+
+    if profiler is None:
+        return
+    try:
+        from iderinote.profiling import save_profile
+        save_profile(profiler)
+    except (ImportError, OSError) as ex:
+        sys.stderr.write("Failed to write the profile: {}\n".format(ex))
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    try:
+        sys.exit(main())
+    finally:
+        metrics.flush()
+        save_profile()
\ No newline at end of file
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (tests)
+## Stand-in for cmk.notification_plugins.utils to run IDERInote.py outside of a
+## Checkmk site. The tests replace collect_context() and read_bulk_contexts().
+
+import re
+
+
+def collect_context():
+    raise NotImplementedError("replaced by the test")
+
+
+def read_bulk_contexts():
+    raise NotImplementedError("replaced by the test")
+
+
+def substitute_context(template, context):
+    for varname, value in context.items():
+        template = template.replace("$" + varname + "$", value)
+    # Like Checkmk, macros without a value are removed
+    return re.sub(r"\$[A-Z_][A-Z_0-9]*\$", "", template)
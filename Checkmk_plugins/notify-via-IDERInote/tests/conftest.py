@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+## notify-via-IDERInote (tests)
+## Unit tests of the notification script and the iderinote library, run
+## outside of a Checkmk site with 'python3 -m pytest tests' from the package
+## folder. cmk.notification_plugins.utils is replaced by the stand-in of this
+## folder. Shared state files and the message store are kept in a temporary
+## directory per test, the time is controlled by the clock fixture.
+##
+## Author: IDERI GmbH
+## Homepage: https://www.ideri.com
+## Repo URL: https://github.com/ideri/IDERInote
+
+import importlib.util
+import os
+import sys
+import time
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(TESTS_DIR)
+sys.path[:0] = [TESTS_DIR, os.path.join(PLUGIN_DIR, "lib", "python3")]
+
+
+class Clock:
+    """Replaces time.time() with a time advanced by the test."""
+
+    def __init__(self, now=1700000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    """Keeps the state files and the message store of a test in its own directory."""
+
+    from iderinote import tracking
+
+    monkeypatch.setenv("INOTE_STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.setenv("INOTE_TRACKING_DB", str(tmp_path / "messages.sqlite"))
+    monkeypatch.setattr(tracking, "_connection", None)
+    yield tmp_path
+    if tracking._connection is not None:
+        tracking._connection.close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def plugin():
+    """Imports a fresh copy of the notification script as module."""
+
+    spec = importlib.util.spec_from_file_location("IDERInote", os.path.join(PLUGIN_DIR, "notifications", "IDERInote.py"))
+    plugin = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(plugin)
+    return plugin
+
+
+def get_context(**fields):
+    """Returns the context of a CRITICAL service notification (as collected by Checkmk)."""
+
+    context = {
+        "PARAMETER_INOTE_API_URL": "https://inote.example.com/IDERInote/api",
+        "PARAMETER_INOTE_API_USERNAME": "u",
+        "PARAMETER_INOTE_API_USERPASS": "p",
+        "PARAMETER_INOTE_PLUGIN_LOGLEVEL": "1",
+        "PARAMETER_INOTE_MSG_RECIPIENT": "note\\a",
+        "PARAMETER_INOTE_MSG_DURATION": "60",
+        "WHAT": "SERVICE",
+        "NOTIFICATIONTYPE": "PROBLEM",
+        "OMD_SITE": "mysite",
+        "HOSTNAME": "h1",
+        "HOSTALIAS": "h1",
+        "HOST_ADDRESS_4": "10.0.0.1",
+        "HOST_ADDRESS_6": "",
+        "HOSTSTATE": "UP",
+        "HOSTOUTPUT": "",
+        "HOSTURL": "/check_mk/index.py?host=h1",
+        "SERVICEDESC": "CPU",
+        "SERVICESTATE": "CRITICAL",
+        "SERVICESHORTSTATE": "CRIT",
+        "PREVIOUSSERVICEHARDSHORTSTATE": "OK",
+        "SERVICEOUTPUT": "CPU load 99%",
+        "SERVICEURL": "/check_mk/index.py?host=h1&service=CPU",
+    }
+    context.update(fields)
+    return context
+
+
+@pytest.fixture
+def make_context():
+    return get_context
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from iderinote import breaker
+
+URL = "https://inote.example.com/IDERInote/api/v1/messages"
+
+
+def test_closed_circuit_allows_requests(clock):
+    assert breaker.allow_request(URL, 60)
+    assert breaker.record_result(URL, True, 3) == breaker.CLOSED
+
+
+def test_consecutive_failures_open_the_circuit(clock):
+    assert breaker.record_result(URL, False, 3) == breaker.CLOSED
+    assert breaker.record_result(URL, False, 3) == breaker.CLOSED
+    assert breaker.record_result(URL, False, 3) == breaker.OPEN
+    assert not breaker.allow_request(URL, 60)
+
+
+def test_success_resets_the_failures(clock):
+    breaker.record_result(URL, False, 3)
+    breaker.record_result(URL, False, 3)
+    assert breaker.record_result(URL, True, 3) == breaker.CLOSED
+    assert breaker.record_result(URL, False, 3) == breaker.CLOSED
+
+
+def test_one_probe_after_cooldown_closes_the_circuit(clock):
+    for _ in range(3):
+        breaker.record_result(URL, False, 3)
+    clock.advance(59)
+    assert not breaker.allow_request(URL, 60)
+    clock.advance(1)
+    assert breaker.allow_request(URL, 60)
+    # Only one process probes
+    assert not breaker.allow_request(URL, 60)
+    assert breaker.record_result(URL, True, 3) == breaker.CLOSED
+    assert breaker.allow_request(URL, 60)
+
+
+def test_failed_probe_reopens_the_circuit(clock):
+    for _ in range(3):
+        breaker.record_result(URL, False, 3)
+    clock.advance(60)
+    assert breaker.allow_request(URL, 60)
+    assert breaker.record_result(URL, False, 3) == breaker.OPEN
+    clock.advance(30)
+    assert not breaker.allow_request(URL, 60)
+
+
+def test_lost_probe_is_replaced_after_cooldown(clock):
+    for _ in range(3):
+        breaker.record_result(URL, False, 3)
+    clock.advance(60)
+    assert breaker.allow_request(URL, 60)
+    clock.advance(60)
+    assert breaker.allow_request(URL, 60)
+
+
+def test_circuits_are_kept_per_url(clock):
+    for _ in range(3):
+        breaker.record_result(URL, False, 3)
+    assert breaker.allow_request(URL.replace("inote.", "inote2."), 60)
+
+
+def send(plugin):
+    message = dict(plugin.message, RECIPIENT=["note\\a"])
+    return plugin.send_inote_message("https://inote.example.com/IDERInote/api", "u", "p", False, message)
+
+
+def test_plugin_stops_posting_while_the_circuit_is_open(plugin, monkeypatch, clock):
+    posts = []
+    monkeypatch.setattr(plugin, "circuit_breaker", (1, 60))
+    monkeypatch.setattr(plugin, "post_inote_message", lambda *args: posts.append(args) or (503, "down"))
+    assert send(plugin) == 1
+    assert send(plugin) == 1
+    assert len(posts) == 1
+
+
+def test_unknown_outcome_does_not_open_the_circuit(plugin, monkeypatch, clock):
+    monkeypatch.setattr(plugin, "circuit_breaker", (1, 60))
+    monkeypatch.setattr(plugin, "post_inote_message", lambda *args: (plugin.OUTCOME_UNKNOWN, "timed out"))
+    assert send(plugin) == 0
+    assert breaker.allow_request(URL, 60)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+
+@pytest.fixture
+def sent(plugin, monkeypatch):
+    """Replaces the delivery, records the messages sent."""
+
+    sent = []
+    monkeypatch.setattr(plugin, "deliver_inote_message", lambda url, user, password, ignore_cert, message, *args: sent.append(message) or (0, None, None, None))
+    return sent
+
+
+def run_bulk(plugin, monkeypatch, contexts, **parameters):
+    parameters = dict({key: value for key, value in contexts[0].items() if key.startswith("PARAMETER_")}, **parameters)
+    for context in contexts:
+        for key in parameters:
+            context.pop(key, None)
+    monkeypatch.setattr(plugin.utils, "read_bulk_contexts", lambda: (parameters, contexts))
+    return plugin.main_bulk()
+
+
+def test_one_digest_per_bulk(plugin, monkeypatch, sent, make_context):
+    contexts = [make_context(SERVICEDESC="CPU"), make_context(SERVICEDESC="Disk", SERVICESTATE="WARNING")]
+    assert run_bulk(plugin, monkeypatch, contexts) == 0
+    assert len(sent) == 1
+    assert sent[0]["TEXT"].startswith("[BULK] 2 notifications (1 hosts)")
+    assert "Service CPU on h1 is CRITICAL." in sent[0]["TEXT"]
+    assert "Service Disk on h1 is WARNING." in sent[0]["TEXT"]
+    assert sent[0]["RECIPIENT"] == ["note\\a"]
+
+
+def test_digest_has_the_highest_priority(plugin, monkeypatch, sent, make_context):
+    contexts = [make_context(SERVICESTATE="OK"), make_context(HOSTNAME="h2", SERVICESTATE="CRITICAL")]
+    run_bulk(plugin, monkeypatch, contexts)
+    assert sent[0]["PRIORITY"] == plugin.Priority.ALERT
+
+
+def test_events_are_grouped_by_recipient_set(plugin, monkeypatch, sent, make_context):
+    contexts = [make_context(), make_context(HOSTNAME="h2"), make_context(HOSTNAME="h3")]
+    contexts[1]["PARAMETER_INOTE_MSG_RECIPIENT"] = "note\\b"
+    parameters = {key: value for key, value in contexts[0].items()
+                  if key.startswith("PARAMETER_") and key != "PARAMETER_INOTE_MSG_RECIPIENT"}
+    for context in contexts:
+        for key in parameters:
+            del context[key]
+    monkeypatch.setattr(plugin.utils, "read_bulk_contexts", lambda: (parameters, contexts))
+    plugin.main_bulk()
+    assert sorted((m["RECIPIENT"], m["TEXT"].split("\r\n")[0]) for m in sent) == [
+        (["note\\a"], "[BULK] 2 notifications (2 hosts)"),
+        (["note\\b"], "[BULK] 1 notifications (1 hosts)"),
+    ]
+
+
+def test_large_bulk_is_split(plugin, monkeypatch, sent, make_context):
+    contexts = [make_context(HOSTNAME="h%d" % i) for i in range(5)]
+    run_bulk(plugin, monkeypatch, contexts, PARAMETER_INOTE_BULK_MAXEVENTS="2")
+    assert [m["TEXT"].split("\r\n")[0] for m in sent] == [
+        "[BULK] 2 notifications (2 hosts) - part 1 of 3",
+        "[BULK] 2 notifications (2 hosts) - part 2 of 3",
+        "[BULK] 1 notifications (1 hosts) - part 3 of 3",
+    ]
+
+
+def test_digest_links_to_the_only_host(plugin, monkeypatch, sent, make_context):
+    contexts = [make_context(SERVICEDESC="CPU"), make_context(SERVICEDESC="Disk")]
+    run_bulk(plugin, monkeypatch, contexts, PARAMETER_CHECKMKURL="https://cmk.example.com/")
+    assert sent[0]["LINKTARGET"] == "https://cmk.example.com/mysite/check_mk/index.py?host=h1"
+
+
+def test_digest_of_several_hosts_has_no_link(plugin, monkeypatch, sent, make_context):
+    contexts = [make_context(), make_context(HOSTNAME="h2")]
+    run_bulk(plugin, monkeypatch, contexts, PARAMETER_CHECKMKURL="https://cmk.example.com/")
+    assert sent[0]["LINKTARGET"] == ""
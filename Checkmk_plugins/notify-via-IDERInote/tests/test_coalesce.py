@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+from iderinote.coalesce import check_event
+
+KEY = "h1/CPU|note\\a"
+
+
+def get_context(notification_type, state=None, output="hot"):
+    if state is None:
+        state = "OK" if notification_type == "RECOVERY" else "CRITICAL"
+    return {"WHAT": "SERVICE", "NOTIFICATIONTYPE": notification_type, "SERVICESTATE": state, "SERVICEOUTPUT": output}
+
+
+def send(notification_type, **kwargs):
+    return check_event(KEY, get_context(notification_type, **kwargs), 300, 3)[0]
+
+
+def test_first_event_is_sent(clock):
+    assert check_event(KEY, get_context("PROBLEM"), 300, 3) == (True, 0, clock.now)
+
+
+def test_duplicate_is_dropped_within_window(clock):
+    assert send("PROBLEM")
+    clock.advance(10)
+    assert not send("PROBLEM")
+    clock.advance(300)
+    assert send("PROBLEM")
+
+
+def test_flap_ending_in_recovery_sends_recovery(clock):
+    sent = []
+    for notification_type in ("PROBLEM", "RECOVERY") * 3:
+        clock.advance(10)
+        if send(notification_type, output=str(clock.now)):
+            sent.append(notification_type)
+    assert sent[:3] == ["PROBLEM", "RECOVERY", "PROBLEM"]
+    assert sent[-1] == "RECOVERY"
+
+
+def test_recovery_after_suppressed_problem_is_dropped(clock):
+    for notification_type in ("PROBLEM", "RECOVERY", "PROBLEM", "RECOVERY"):
+        clock.advance(10)
+        assert send(notification_type, output=str(clock.now))
+    clock.advance(10)
+    assert not send("PROBLEM", output="again")
+    clock.advance(10)
+    # The clients show the RECOVERY sent last already
+    assert not send("RECOVERY", output="again")
+
+
+def test_flapping_suppresses_until_flappingstop(clock):
+    assert send("PROBLEM")
+    clock.advance(10)
+    assert send("FLAPPINGSTART", state="CRITICAL")
+    clock.advance(10)
+    assert not send("FLAPPINGSTART", state="CRITICAL", output="other")
+    clock.advance(10)
+    # Ends the PROBLEM sent before the flapping started
+    assert send("RECOVERY")
+    clock.advance(10)
+    assert not send("PROBLEM", output="flap")
+    clock.advance(10)
+    assert not send("RECOVERY", output="flap")
+    clock.advance(10)
+    assert send("FLAPPINGSTOP", state="OK")
+
+
+def test_suppressed_count_is_reported_with_next_message(clock):
+    assert send("PROBLEM")
+    clock.advance(10)
+    assert not send("PROBLEM")
+    since = clock.now
+    clock.advance(10)
+    assert not send("PROBLEM")
+    clock.advance(10)
+    assert check_event(KEY, get_context("ACKNOWLEDGEMENT", output="ack"), 300, 3) == (True, 2, since)
+
+
+def test_key_expires_with_its_own_window(clock):
+    assert check_event(KEY, get_context("PROBLEM"), 3600, 3)[0]
+    clock.advance(600)
+    # a rule with a shorter window must not evict the key of the longer one
+    assert check_event("h2/CPU|note\\a", get_context("PROBLEM"), 60, 3)[0]
+    clock.advance(10)
+    assert not check_event(KEY, get_context("PROBLEM"), 3600, 3)[0]
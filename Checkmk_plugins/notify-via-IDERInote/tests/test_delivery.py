@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+API_URL = "https://inote1.example.com/IDERInote/api"
+FAILOVER_URL = "https://inote2.example.com/IDERInote/api"
+
+
+class Posts(list):
+    """Records the URLs posted to, answers with the statuses queued by the test."""
+
+    def __init__(self):
+        super().__init__()
+        self.statuses = []
+
+    def __call__(self, url, user, password, verify, message, body):
+        self.append(url)
+        return self.statuses.pop(0), '{"INDEX": 1}'
+
+
+@pytest.fixture
+def posts(plugin, monkeypatch):
+    posts = Posts()
+    monkeypatch.setattr(plugin, "post_inote_message", posts)
+    monkeypatch.setattr(plugin, "api_failover_urls", [FAILOVER_URL])
+    monkeypatch.setattr(plugin, "api_balancing", "roundrobin")
+    monkeypatch.setattr(plugin, "circuit_breaker", (3, 60))
+    return posts
+
+
+def deliver(plugin):
+    message = dict(plugin.message, RECIPIENT=["note\\a"])
+    return plugin.send_inote_message(API_URL, "u", "p", False, message)
+
+
+def test_server_error_fails_over(plugin, posts):
+    posts.statuses = [503, 200]
+    assert deliver(plugin) == 0
+    assert len(posts) == 2 and posts[0] != posts[1]
+
+
+def test_failure_of_every_endpoint_is_retried_by_checkmk(plugin, posts):
+    posts.statuses = [503, 502]
+    assert deliver(plugin) == 1
+    assert len(posts) == 2
+
+
+def test_unknown_outcome_is_not_sent_again(plugin, posts):
+    posts.statuses = [plugin.OUTCOME_UNKNOWN]
+    assert deliver(plugin) == 0
+    assert len(posts) == 1
+
+
+def test_unknown_outcome_does_not_open_the_circuit(plugin, posts):
+    from iderinote import breaker
+
+    for _ in range(3):
+        posts.statuses = [plugin.OUTCOME_UNKNOWN]
+        deliver(plugin)
+    assert all(breaker.allow_request(url, 60) for url in posts)
+
+
+def test_client_error_does_not_fail_over(plugin, posts):
+    posts.statuses = [400]
+    assert deliver(plugin) == 1
+    assert len(posts) == 1
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from iderinote import directory, httpclient
+
+API_URL = "https://inote.example.com/IDERInote/api"
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """Stands in for the IDERI note API, records the requested paths."""
+
+    calls = []
+
+    def request(method, url, user, password, verify, timeout=None, **kwargs):
+        path = url[len(API_URL):]
+        calls.append(path)
+        if path == directory.NETWORKRANGES_PATH:
+            return 200, json.dumps([{"NAME": "Office Berlin", "ID": 3}, {"Name": "VPN", "INDEX": 7}])
+        return (200 if path.endswith("known") else 404), ""
+
+    monkeypatch.setattr(httpclient, "request", request)
+    return calls
+
+
+def test_network_ranges_resolve_after_a_refresh(api):
+    assert directory.resolve_network_ranges(API_URL, ["office berlin", "12"]) == ([12], ["office berlin"], True)
+    directory.refresh(API_URL, "u", "p", True)
+    assert directory.resolve_network_ranges(API_URL, ["office berlin", "VPN"]) == ([3, 7], [], False)
+
+
+def test_unknown_network_range_refreshes_at_most_every_interval(api, clock):
+    directory.refresh(API_URL, "u", "p", True)
+    assert directory.resolve_network_ranges(API_URL, ["Paris"], now=clock()) == ([], ["Paris"], False)
+    assert directory.resolve_network_ranges(API_URL, ["Paris"], now=clock() + directory.MIN_REFRESH_INTERVAL + 1)[2]
+
+
+def test_queued_recipients_are_checked_by_the_refresh(api):
+    assert directory.check_recipients(API_URL, ["note\\known", "note\\gone"]) == ([], ["note\\known", "note\\gone"])
+    assert directory.request_refresh(API_URL, ["note\\known", "note\\gone"])
+    directory.refresh(API_URL, "u", "p", True)
+    assert directory.check_recipients(API_URL, ["note\\known", "note\\gone"]) == (["note\\gone"], [])
+
+
+def test_refresh_is_claimed_once(clock):
+    assert directory.request_refresh(API_URL, now=clock())
+    assert not directory.request_refresh(API_URL, now=clock() + 1)
+    assert directory.request_refresh(API_URL, now=clock() + directory.REFRESH_TIMEOUT + 1)
+
+
+@pytest.mark.parametrize("mode, refresh", [("fork", "refresh_in_background"), ("thread", "refresh_in_thread")])
+def test_plugin_refreshes_the_directory_in_the_configured_mode(plugin, monkeypatch, make_context, mode, refresh):
+    started = []
+    for name in ("refresh_in_background", "refresh_in_thread"):
+        monkeypatch.setattr(directory, name, lambda *args, name=name: started.append(name))
+    plugin.directory_refresh = mode
+    context = make_context(PARAMETER_INOTE_MSG_HOMEOFFICE_OR_NETWORKRANGE_1="networkrange",
+                           PARAMETER_INOTE_MSG_HOMEOFFICE_OR_NETWORKRANGE_2_1="Office Berlin")
+    message = plugin.parse_inote_message_params(context, plugin.message_defaults.copy())
+    # Not in the cached directory yet: retried later
+    assert plugin.resolve_inote_network_ranges(context, message) == 1
+    assert started == [refresh]
+
+
+def test_plugin_removes_unknown_recipients(plugin, api, make_context):
+    context = make_context(PARAMETER_INOTE_API_CHECKRECIPIENTS="True")
+    directory.request_refresh(API_URL, ["note\\known", "note\\gone"])
+    directory.refresh(API_URL, "u", "p", True)
+    message = {"RECIPIENT": ["note\\known", "note\\gone"], "EXCLUDE": []}
+    assert plugin.check_inote_recipients(context, message)
+    assert message["RECIPIENT"] == ["note\\known"]
+    assert not plugin.check_inote_recipients(context, {"RECIPIENT": ["note\\gone"], "EXCLUDE": []})
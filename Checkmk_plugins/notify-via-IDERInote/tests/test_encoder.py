@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import json
+import random
+from datetime import datetime
+
+from iderinote import encoder
+
+
+def get_message(defaults, **fields):
+    message = dict(defaults, STARTTIMEUTC=datetime(2024, 1, 2, 3, 4, 5), ENDTIMEUTC=datetime(2024, 1, 2, 4, 4, 5))
+    message.update(fields)
+    return message
+
+
+def test_format_timestamp():
+    assert encoder.format_timestamp(datetime(2024, 1, 2, 3, 4, 5, 678)) == "2024-01-02T03:04:05"
+    assert encoder.format_timestamp("2024-01-02T03:04:05") == "2024-01-02T03:04:05"
+
+
+def test_default_fields_are_omitted(plugin):
+    message = get_message(plugin.message_defaults, TEXT="CPU is CRIT", RECIPIENT=["note\\a"])
+    body = json.loads(encoder.encode_message(message, plugin.message_defaults))
+    assert body == {
+        "RECIPIENT": ["note\\a"],
+        "TEXT": "CPU is CRIT",
+        "STARTTIMEUTC": "2024-01-02T03:04:05",
+        "ENDTIMEUTC": "2024-01-02T04:04:05",
+    }
+
+
+def test_fields_differing_from_defaults_are_sent(plugin):
+    message = get_message(plugin.message_defaults, TEXT="x", RECIPIENT=["a"], SHOWPOPUP=True,
+                          PRIORITY=plugin.Priority.ALERT, LINKTARGET="https://cmk", LINKTEXT="Open")
+    body = json.loads(encoder.encode_message(message, plugin.message_defaults))
+    assert body["SHOWPOPUP"] is True
+    assert body["PRIORITY"] == plugin.Priority.ALERT
+    assert (body["LINKTARGET"], body["LINKTEXT"]) == ("https://cmk", "Open")
+    assert "SHOWTICKER" not in body
+
+
+def test_compact_equals_full_after_applying_defaults(plugin):
+    defaults = plugin.message_defaults
+    rng = random.Random(4711)
+    for _ in range(500):
+        fields = {}
+        for key, value in defaults.items():
+            if rng.random() < 0.3:
+                if isinstance(value, bool):
+                    fields[key] = not value
+                elif isinstance(value, list):
+                    fields[key] = rng.sample(["note\\a", "note\\b", "ü\"\\", 7], rng.randint(0, 3))
+                elif isinstance(value, int):
+                    fields[key] = rng.choice([0, 1, 2, 0x1000, 0x2000])
+                elif isinstance(value, str):
+                    fields[key] = rng.choice(["", "x", "ä\r\n\t\"\\", "\U0001F525"])
+        message = get_message(defaults, **fields)
+        body = encoder.encode_message(message, defaults)
+        assert encoder.is_equivalent(body, message, defaults)
+        assert encoder.expand_message(body, defaults) == json.loads(json.dumps(message, default=encoder.format_timestamp))
+
+
+def test_cached_prefix_follows_the_constant_fields(plugin):
+    defaults = plugin.message_defaults
+    first = json.loads(encoder.encode_message(get_message(defaults, RECIPIENT=["a"]), defaults))
+    second = json.loads(encoder.encode_message(get_message(defaults, RECIPIENT=["b"], SHOWTICKER=True), defaults))
+    assert first["RECIPIENT"] == ["a"] and "SHOWTICKER" not in first
+    assert second["RECIPIENT"] == ["b"] and second["SHOWTICKER"] is True
+
+
+def test_message_with_other_fields_is_encoded(plugin):
+    defaults = plugin.message_defaults
+    message = get_message(defaults, RECIPIENT=["a"], EXTRA="value")
+    body = encoder.encode_message(message, defaults)
+    assert json.loads(body)["EXTRA"] == "value"
+    assert encoder.is_equivalent(body, message, defaults)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import stat
+
+import pytest
+
+from iderinote import escalation, tracking
+
+URL = "https://inote.example.com/IDERInote/api/v1/messages"
+KEY = "h1/CPU|note\\a"
+STEPS = [
+    {"delay": 5, "display": "", "recipients": ["note\\oncall"]},
+    {"delay": 15, "display": "showfullscreenandlock", "recipients": []},
+]
+
+
+class Api:
+    """Records the updates of the escalator and answers with the given status."""
+
+    def __init__(self, status=200):
+        self.status = status
+        self.calls = []
+
+    def __call__(self, url, user, password, verify, message):
+        self.calls.append((url, user, password, verify, message))
+        return self.status, ""
+
+
+@pytest.fixture
+def alert(clock):
+    tracking.add_message(KEY, "17", URL, json.dumps({"TEXT": "CPU is CRIT", "RECIPIENT": ["note\\a"], "PRIORITY": 2}))
+    escalation.schedule(KEY, "17", URL, "u", "p", True, STEPS)
+
+
+def test_nothing_is_due_before_the_first_step(alert, clock):
+    api = Api()
+    assert escalation.Escalator(api).escalate() == 300
+    assert api.calls == []
+
+
+def test_steps_are_applied_in_order(alert, clock):
+    api = Api()
+    escalator = escalation.Escalator(api)
+    clock.advance(300)
+    assert escalator.escalate() == 600
+    url, user, password, verify, message = api.calls[0]
+    assert (url, user, password, verify) == (URL + "/17", "u", "p", True)
+    assert message["RECIPIENT"] == ["note\\a", "note\\oncall"]
+    assert message["TEXT"] == "[ESCALATED] CPU is CRIT"
+    assert not message.get("SHOWFULLSCREEN")
+
+    clock.advance(600)
+    assert escalator.escalate() is None
+    message = api.calls[1][4]
+    assert message["SHOWPOPUP"] and message["SHOWFULLSCREEN"] and message["SHOWFULLSCREENANDLOCK"]
+    # The escalated message of the first step is the base of the second one
+    assert message["RECIPIENT"] == ["note\\a", "note\\oncall"]
+    assert message["TEXT"] == "[ESCALATED] CPU is CRIT"
+
+
+def test_ended_message_is_not_escalated(alert, clock):
+    tracking.pop_message(KEY)
+    api = Api()
+    clock.advance(300)
+    assert escalation.Escalator(api).escalate() is None
+    assert api.calls == []
+
+
+def test_replaced_message_is_not_escalated(alert, clock):
+    tracking.add_message(KEY, "18", URL, json.dumps({"TEXT": "next problem"}))
+    api = Api()
+    clock.advance(300)
+    assert escalation.Escalator(api).escalate() is None
+    assert api.calls == []
+
+
+def test_temporary_error_is_retried(alert, clock):
+    api = Api(503)
+    clock.advance(300)
+    assert escalation.Escalator(api).escalate() == escalation.RETRY_DELAY
+    api.status = 200
+    clock.advance(escalation.RETRY_DELAY)
+    assert escalation.Escalator(api).escalate() == 600 - escalation.RETRY_DELAY
+    assert len(api.calls) == 2
+
+
+def test_permanent_error_drops_the_escalation(alert, clock):
+    api = Api(404)
+    clock.advance(300)
+    assert escalation.Escalator(api).escalate() is None
+
+
+def test_failing_api_call_is_retried(alert, clock):
+    def put(*args):
+        raise ConnectionError("refused")
+
+    clock.advance(300)
+    assert escalation.Escalator(put).escalate() == escalation.RETRY_DELAY
+
+
+def test_store_is_only_readable_by_the_owner(alert):
+    mode = os.stat(tracking.get_default_db_path()).st_mode
+    assert stat.S_IMODE(mode) == 0o600
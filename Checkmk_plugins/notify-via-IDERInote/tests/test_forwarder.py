@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+from iderinote import forwarder
+from iderinote.lanes import LaneScheduler
+
+URL = "https://inote.example.com/IDERInote/api/v1/messages"
+
+
+class Sessions:
+    """Stands in for the SessionPool, records the posts."""
+
+    timeout = 30.0
+
+    def __init__(self, status=200, error=None, blocked=None):
+        self.status = status
+        self.error = error
+        # The posts wait for this event if set
+        self.blocked = blocked
+        self.posts = []
+
+    def post(self, url, user, password, verify, message, timeout=None):
+        self.posts.append((url, message, timeout))
+        if self.blocked:
+            self.blocked.wait()
+        if self.error:
+            raise self.error
+        return self.status, '{"INDEX": 1}'
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def serve(tmp_path):
+    servers = []
+
+    def serve(sessions, workers=1, queue_size=10):
+        server = forwarder.ForwarderServer(str(tmp_path / "forwarder.sock"), sessions, LaneScheduler(workers, queue_size), workers)
+        server.start()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.server_address
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def forward_in_thread(path, message, timeout=30.0):
+    """Forwards a message in a thread, returns the thread and the list receiving the result."""
+
+    results = []
+
+    def run():
+        try:
+            results.append(forwarder.forward_inote_message(path, URL, "u", "p", True, message, timeout=timeout))
+        except Exception as ex:
+            results.append(ex)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, results
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_message_is_posted_with_the_time_left_of_the_request(serve):
+    sessions = Sessions()
+    path = serve(sessions)
+    assert forwarder.forward_inote_message(path, URL, "u", "p", True, {"TEXT": "x"}, timeout=7.0) == (200, '{"INDEX": 1}')
+    [(url, message, timeout)] = sessions.posts
+    assert (url, message) == (URL, {"TEXT": "x"})
+    assert 6.0 < timeout <= 7.0
+
+
+def test_full_lane_is_rejected(serve):
+    sessions = Sessions(blocked=threading.Event())
+    path = serve(sessions, queue_size=1)
+    sending, _ = forward_in_thread(path, {"PRIORITY": 0})
+    wait_for(lambda: sessions.posts)
+    queued, _ = forward_in_thread(path, {"PRIORITY": 0})
+    wait_for(lambda: forwarder.get_forwarder_status(path)["information"]["queued"] == 1)
+    with pytest.raises(forwarder.ForwarderRejected, match="lane full"):
+        forwarder.forward_inote_message(path, URL, "u", "p", True, {"PRIORITY": 0})
+    sessions.blocked.set()
+    sending.join(5)
+    queued.join(5)
+    assert len(sessions.posts) == 2
+
+
+def test_message_queued_past_its_deadline_is_dropped(serve):
+    sessions = Sessions(blocked=threading.Event())
+    path = serve(sessions)
+    sending, results = forward_in_thread(path, {"PRIORITY": 2})
+    wait_for(lambda: sessions.posts)
+    with pytest.raises(forwarder.ForwarderRejected, match="not delivered in time"):
+        forwarder.forward_inote_message(path, URL, "u", "p", True, {"PRIORITY": 2, "TEXT": "late"}, timeout=0.2)
+    sessions.blocked.set()
+    sending.join(5)
+    assert results == [(200, '{"INDEX": 1}')]
+    # The worker skips the expired message instead of posting it
+    wait_for(lambda: forwarder.get_forwarder_status(path)["alert"]["queued"] == 0)
+    assert [message for _, message, _ in sessions.posts] == [{"PRIORITY": 2}]
+
+
+def test_failed_post_is_answered_with_502(serve):
+    path = serve(Sessions(error=ConnectionError("refused")))
+    status, text = forwarder.forward_inote_message(path, URL, "u", "p", True, {"TEXT": "x"})
+    assert status == 502
+    assert "refused" in text
+
+
+def test_missing_forwarder_raises_oserror(tmp_path):
+    with pytest.raises(OSError):
+        forwarder.forward_inote_message(str(tmp_path / "missing.sock"), URL, "u", "p", True, {"TEXT": "x"})
+
+
+def test_unknown_outcome_is_not_sent_again(plugin, monkeypatch, tmp_path, capsys):
+    def forward(*args, **kwargs):
+        raise socket.timeout("timed out")
+
+    direct = []
+    monkeypatch.setattr(forwarder, "forward_inote_message", forward)
+    monkeypatch.setattr(requests, "post", lambda *args, **kwargs: direct.append(kwargs))
+    monkeypatch.setattr(plugin, "forwarder_socket", str(tmp_path / "forwarder.sock"))
+    message = dict(plugin.message, RECIPIENT=["note\\a"])
+    assert plugin.send_inote_message("https://inote.example.com/IDERInote/api", "u", "p", False, message) == 0
+    assert direct == []
+    assert "Outcome of the IDERI note message unknown" in capsys.readouterr().err
+
+
+def test_rejected_message_is_retried_without_failover(plugin, monkeypatch, tmp_path, capsys):
+    forwarded = []
+
+    def forward(*args, **kwargs):
+        forwarded.append(args[1])
+        raise forwarder.ForwarderRejected("Forwarder error: lane full")
+
+    recorded = []
+    monkeypatch.setattr(forwarder, "forward_inote_message", forward)
+    monkeypatch.setattr(plugin, "forwarder_socket", str(tmp_path / "forwarder.sock"))
+    monkeypatch.setattr(plugin, "api_failover_urls", ["https://inote2.example.com/IDERInote/api"])
+    monkeypatch.setattr(plugin, "record_circuit_breaker", lambda *args: recorded.append(args))
+    monkeypatch.setattr(plugin, "record_api_endpoint", lambda *args: recorded.append(args))
+    message = dict(plugin.message, RECIPIENT=["note\\a"])
+    assert plugin.send_inote_message("https://inote.example.com/IDERInote/api", "u", "p", False, message) == 1
+    assert len(forwarded) == 1 and recorded == []
+    assert "lane full" in capsys.readouterr().err
+
+
+def test_compact_message_without_priority_is_queued_as_information(serve):
+    path = serve(Sessions())
+    forwarder.forward_inote_message(path, URL, "u", "p", True, {"TEXT": "x"})
+    assert forwarder.get_forwarder_status(path)["information"]["processed"] == 1
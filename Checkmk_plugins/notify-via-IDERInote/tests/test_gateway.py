@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import http.client
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import PLUGIN_DIR
+from iderinote import gateway
+
+RULE = {
+    "PARAMETER_INOTE_API_URL": "https://inote.example.com/IDERInote/api",
+    "PARAMETER_INOTE_API_USERNAME": "u",
+    "PARAMETER_INOTE_API_USERPASS": "p",
+    "PARAMETER_INOTE_MSG_RECIPIENT": "note\\a",
+    "PARAMETER_INOTE_MSG_DURATION": "60",
+}
+
+
+class Sessions:
+    """Stands in for the SessionPool, records the posted messages."""
+
+    def __init__(self):
+        self.posts = []
+
+    def post(self, url, user, password, verify, message, timeout=None, body=None):
+        self.posts.append(message)
+        return 200, '{"INDEX": 1}'
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def gw():
+    plugin = gateway.load_plugin(os.path.join(PLUGIN_DIR, "notifications", "IDERInote.py"))
+    return gateway.Gateway(plugin, {source: dict(RULE) for source in gateway.SOURCES}, Sessions(), workers=1, queue_size=2)
+
+
+@pytest.fixture
+def request_gateway(gw):
+    server = gateway.GatewayServer(("127.0.0.1", 0), gw, token="secret")
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def request(method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection(*server.server_address, timeout=5)
+        connection.putrequest(method, path)
+        defaults = {"X-Inote-Token": "secret", "Content-Type": "application/json"}
+        if body is not None:
+            defaults["Content-Length"] = str(len(body))
+        for key, value in dict(defaults, **(headers or {})).items():
+            connection.putheader(key, value)
+        connection.endheaders(body)
+        response = connection.getresponse()
+        result = response.status, json.loads(response.read())
+        connection.close()
+        return result
+
+    yield request
+    server.shutdown()
+    server.server_close()
+
+
+def test_prtg_event_is_normalized():
+    context = gateway.normalize_prtg({"sensorid": "42", "device": "sw1", "name": "Ping", "laststatus": "Down (ESCALATION)",
+                                      "message": "timeout", "home": "https://prtg/"})
+    assert context["SERVICESTATE"] == "CRITICAL" and context["NOTIFICATIONTYPE"] == "PROBLEM"
+    assert context["SERVICEOUTPUT"] == "timeout"
+    assert context["LINKTARGET"] == "https://prtg/sensor.htm?id=42"
+
+
+@pytest.mark.parametrize("event", [{"service": "CPU", "state": "OK"}, {"host": "h1", "state": "OK"}, {"host": "h1", "service": "CPU", "state": "DOWN"}])
+def test_invalid_generic_event_is_rejected(event):
+    with pytest.raises(gateway.EventError):
+        gateway.normalize_generic(event)
+
+
+def test_events_are_queued_all_or_none(gw):
+    assert gw.submit("generic", [{"host": "h1", "state": "DOWN"}, {"host": "h2", "state": "DOWN"}])
+    assert not gw.submit("generic", [{"host": "h3", "state": "DOWN"}])
+    assert gw.get_status()["queued"] == 2 and gw.counters["rejected"] == 1
+
+
+def test_full_recovery_lane_does_not_reject_alerts(gw):
+    assert gw.submit("generic", [{"host": "h1", "state": "UP"}, {"host": "h2", "state": "UP"}])
+    assert not gw.submit("generic", [{"host": "h3", "state": "UP"}])
+    assert gw.submit("generic", [{"host": "h4", "state": "DOWN"}])
+    assert gw.get_status()["lanes"]["alert"]["queued"] == 1
+
+
+def test_event_is_composed_with_the_rule(gw):
+    context = gateway.normalize_generic({"host": "h1", "service": "CPU", "state": "CRITICAL", "output": "hot", "url": "https://mon/h1"})
+    context.update(RULE)
+    [(message, order_key)] = gw.compose("generic", context)
+    assert order_key == "h1/CPU"
+    assert message["RECIPIENT"] == ["note\\a"]
+    assert message["PRIORITY"] == gw.plugin.Priority.ALERT
+    assert message["LINKTARGET"] == "https://mon/h1"
+    assert "Service CPU on h1 is CRITICAL." in message["TEXT"]
+
+
+def test_webhook_is_accepted(request_gateway, gw):
+    assert request_gateway("POST", "/events/generic", b'{"host": "h1", "state": "DOWN"}') == (202, {"accepted": 1})
+    gw.start()
+    deadline = time.monotonic() + 5
+    while not gw.sessions.posts and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(gw.sessions.posts) == 1
+
+
+def test_webhook_needs_the_token(request_gateway):
+    assert request_gateway("POST", "/events/generic", b"{}", {"X-Inote-Token": "wrong"})[0] == 401
+
+
+@pytest.mark.parametrize("length, status", [(None, 400), ("-1", 400), ("abc", 400), (str(gateway.MAX_REQUEST_SIZE + 1), 413)])
+def test_invalid_content_length_is_rejected(request_gateway, length, status):
+    headers = {"Content-Length": length} if length is not None else {}
+    assert request_gateway("POST", "/events/generic", None, headers)[0] == status
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from iderinote.lanes import LaneScheduler, parse_lane_option
+
+ALERT, WARNING, INFORMATION = 2, 1, 0
+
+
+def drain(lanes, count):
+    """Takes count items, finishing each one before the next."""
+
+    items = []
+    for _ in range(count):
+        lane, item = lanes.get()
+        items.append(item)
+        lanes.done(lane)
+    return items
+
+
+def test_queued_alerts_are_delivered_first():
+    lanes = LaneScheduler(4)
+    assert lanes.put([(INFORMATION, "i1"), (WARNING, "w1"), (ALERT, "a1"), (INFORMATION, "i2"), (ALERT, "a2")])
+    assert drain(lanes, 2) == ["a1", "a2"]
+
+
+def test_lower_lanes_share_the_workers_by_weight():
+    lanes = LaneScheduler(4)
+    lanes.put([(WARNING, "w")] * 6 + [(INFORMATION, "i")] * 6)
+    assert drain(lanes, 8) == ["w", "w", "i", "w", "w", "w", "i", "w"]
+
+
+def test_lane_limit_leaves_workers_for_an_alert():
+    lanes = LaneScheduler(4)
+    lanes.put([(INFORMATION, "i")] * 4)
+    taken = [lanes.get() for _ in range(2)]
+    # INFORMATION may only occupy half of the workers
+    assert lanes.get_status()["information"]["active"] == 2
+    lanes.put([(ALERT, "a")])
+    assert lanes.get()[1] == "a"
+    for lane, _ in taken:
+        lanes.done(lane)
+    assert lanes.get()[1] == "i"
+
+
+def test_full_lane_rejects_all_items_and_leaves_other_lanes_open():
+    lanes = LaneScheduler(2, size=2)
+    assert lanes.put([(INFORMATION, "i1"), (INFORMATION, "i2")])
+    assert not lanes.put([(ALERT, "a1"), (INFORMATION, "i3")])
+    assert lanes.qsize() == 2
+    assert lanes.put([(ALERT, "a1")])
+    status = lanes.get_status()
+    assert status["information"]["rejected"] == 1
+    assert status["alert"]["queued"] == 1
+
+
+def test_unknown_priority_is_queued_as_warning():
+    lanes = LaneScheduler(2)
+    lanes.put([(None, "x")])
+    assert lanes.get_status()["warning"]["queued"] == 1
+
+
+def test_lane_option():
+    assert parse_lane_option("warning:3, information:1,") == {"warning": 3, "information": 1}
+    with pytest.raises(ValueError):
+        parse_lane_option("critical:2")
+    with pytest.raises(ValueError):
+        parse_lane_option("warning:-1")
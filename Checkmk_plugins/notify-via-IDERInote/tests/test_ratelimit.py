@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from iderinote import ratelimit
+
+
+def test_burst_is_allowed_then_limited(clock):
+    assert ratelimit.take_token("a|0", 6, 2)
+    assert ratelimit.take_token("a|0", 6, 2)
+    assert not ratelimit.take_token("a|0", 6, 2)
+
+
+def test_tokens_are_refilled_with_the_rate(clock):
+    for _ in range(2):
+        ratelimit.take_token("a|0", 6, 2)
+    clock.advance(9)
+    assert not ratelimit.take_token("a|0", 6, 2)
+    clock.advance(1)
+    assert ratelimit.take_token("a|0", 6, 2)
+    assert not ratelimit.take_token("a|0", 6, 2)
+
+
+def test_refill_is_bounded_by_the_burst(clock):
+    ratelimit.take_token("a|0", 6, 2)
+    clock.advance(3600)
+    assert ratelimit.take_token("a|0", 6, 2)
+    assert ratelimit.take_token("a|0", 6, 2)
+    assert not ratelimit.take_token("a|0", 6, 2)
+
+
+def test_buckets_are_kept_per_key(clock):
+    assert ratelimit.take_token("a|0", 6, 1)
+    assert not ratelimit.take_token("a|0", 6, 1)
+    assert ratelimit.take_token("a|2", 6, 1)
+    assert ratelimit.take_token("b|0", 6, 1)
+
+
+def test_least_recently_used_buckets_are_evicted(clock, monkeypatch):
+    monkeypatch.setattr(ratelimit, "MAX_ENTRIES", 2)
+    for key in ("a", "b", "c"):
+        assert ratelimit.take_token(key, 6, 1)
+        clock.advance(1)
+    # "a" has been evicted and starts with a full bucket again, "c" has not
+    assert ratelimit.take_token("a", 6, 1)
+    assert not ratelimit.take_token("c", 6, 1)
+
+
+def test_storm_summary_is_continued_within_ttl(clock):
+    with ratelimit.storm_summary("a") as summary:
+        summary["count"] += 1
+        summary["updated"] = clock.now
+    clock.advance(ratelimit.SUMMARY_TTL)
+    with ratelimit.storm_summary("a") as summary:
+        assert summary["count"] == 1
+        summary["updated"] = clock.now
+    clock.advance(ratelimit.SUMMARY_TTL + 1)
+    with ratelimit.storm_summary("a") as summary:
+        assert summary["count"] == 0
+        assert summary["since"] == clock.now
+
+
+class Calls(list):
+    """Records the API calls, status is the answer to the next POST."""
+
+    status = 200
+
+
+@pytest.fixture
+def api(plugin, monkeypatch):
+    """Replaces the API, records the messages created and updated."""
+
+    calls = Calls()
+    monkeypatch.setattr(plugin, "post_inote_message", lambda url, user, password, verify, message, body: calls.append(("POST", message)) or (calls.status, '{"INDEX": 9}'))
+    monkeypatch.setattr(plugin, "call_inote_api", lambda method, url, user, password, verify, body=None: calls.append((method, json.loads(body))) or (200, ""))
+    return calls
+
+
+def notify(plugin, monkeypatch, context):
+    monkeypatch.setattr(plugin.utils, "collect_context", lambda: dict(context))
+    monkeypatch.setattr(plugin.sys, "argv", ["IDERInote.py"])
+    return plugin.main()
+
+
+def test_messages_over_the_limit_update_one_storm_summary(plugin, monkeypatch, api, make_context, clock):
+    context = make_context(PARAMETER_INOTE_RATELIMIT_RATE="1", PARAMETER_INOTE_RATELIMIT_BURST="1", SERVICESTATE="WARNING")
+    for service in ("CPU", "Disk", "Memory"):
+        assert notify(plugin, monkeypatch, dict(context, SERVICEDESC=service)) == 0
+    assert [method for method, _ in api] == ["POST", "POST", "PUT"]
+    assert api[1][1]["SHOWTICKER"] and api[1][1]["TEXT"].startswith("Notification storm: 1 notifications")
+    assert api[2][1]["TEXT"].startswith("Notification storm: 2 notifications")
+
+
+def test_unknown_outcome_of_the_storm_summary_is_not_retried(plugin, monkeypatch, api, make_context, clock):
+    context = make_context(PARAMETER_INOTE_RATELIMIT_RATE="1", PARAMETER_INOTE_RATELIMIT_BURST="1", SERVICESTATE="WARNING")
+    notify(plugin, monkeypatch, context)
+    api.status = plugin.OUTCOME_UNKNOWN
+    assert notify(plugin, monkeypatch, dict(context, SERVICEDESC="Disk")) == 0
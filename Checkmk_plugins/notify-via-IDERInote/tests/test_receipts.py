@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+
+import pytest
+
+from iderinote import receipts, tracking
+
+URL = "https://inote.example.com/IDERInote/api/v1/messages/receipts"
+
+
+class Response:
+    def __init__(self, status_code, page=None, etag=None):
+        self.status_code = status_code
+        self.page = page
+        self.text = json.dumps(page)
+        self.headers = {"ETag": etag} if etag else {}
+
+    def json(self):
+        return self.page
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise OSError(self.status_code)
+
+
+class Api:
+    """Stands in for the receipts API: since is inclusive, pages by offset and limit."""
+
+    def __init__(self):
+        self.receipts = []
+        self.requests = []
+
+    def add(self, index, time, receipt_type="ACK", user="alice"):
+        self.receipts.append({"INDEX": index, "TIMEUTC": time, "TYPE": receipt_type, "USER": user, "COMPUTER": "pc1"})
+
+    def get(self, url, params, headers, timeout):
+        self.requests.append((params["since"], params["offset"], headers.get("If-None-Match")))
+        matching = sorted((r for r in self.receipts if r["TIMEUTC"] >= params["since"]), key=lambda r: r["TIMEUTC"])
+        page = matching[params["offset"]:params["offset"] + params["limit"]]
+        etag = hashlib.sha1(json.dumps([params["since"], params["offset"], page]).encode("utf-8")).hexdigest()
+        if headers.get("If-None-Match") == etag:
+            return Response(304)
+        return Response(200, page, etag)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    monkeypatch.setattr(receipts, "PAGE_SIZE", 2)
+    return Api()
+
+
+def fetch(api, cursor="2023-01-01T00:00:00", seen=(), etag=None):
+    return receipts.fetch_receipts(api, URL, cursor, set(seen), etag)
+
+
+def test_receipts_at_the_same_time_are_paged_by_offset(api):
+    for index in range(5):
+        api.add(index, "2023-01-01T10:00:00")
+    new, cursor, seen, etag = fetch(api, "2023-01-01T10:00:00")
+    assert [r["INDEX"] for r in new] == [0, 1, 2, 3, 4]
+    assert [offset for _, offset, _ in api.requests] == [0, 2, 4]
+    assert cursor == "2023-01-01T10:00:00" and len(seen) == 5
+    # The last page was not the first one since the cursor, its ETag does not answer the next poll
+    assert etag is None
+
+
+def test_processed_receipts_are_not_returned_again(api):
+    api.add(1, "2023-01-01T10:00:00")
+    new, cursor, seen, etag = fetch(api)
+    api.add(2, "2023-01-01T10:00:00", user="bob")
+    new, cursor, seen, etag = fetch(api, cursor, seen, etag)
+    assert [r["USER"] for r in new] == ["bob"]
+
+
+def test_unchanged_receipts_cost_a_304(api):
+    api.add(1, "2023-01-01T10:00:00")
+    new, cursor, seen, etag = fetch(api, "2023-01-01T10:00:00")
+    assert etag is not None
+    del api.requests[:]
+    assert fetch(api, cursor, seen, etag) == ([], cursor, seen, etag)
+    assert api.requests == [(cursor, 0, etag)]
+
+
+def test_etag_is_dropped_when_the_cursor_moves(api):
+    api.add(1, "2023-01-01T10:00:00")
+    new, cursor, seen, etag = fetch(api)
+    # The ETag answers the query since the old cursor
+    assert cursor == "2023-01-01T10:00:00"
+    assert etag is None
+    del api.requests[:]
+    new, cursor, seen, etag = fetch(api, cursor, seen, etag)
+    assert new == [] and etag is not None
+    assert api.requests == [(cursor, 0, None)]
+
+
+def test_etag_of_the_first_page_since_the_new_cursor_is_kept(api):
+    api.add(1, "2023-01-01T10:00:00")
+    api.add(2, "2023-01-01T10:00:01")
+    api.add(3, "2023-01-01T10:00:02")
+    new, cursor, seen, etag = fetch(api, "2023-01-01T10:00:00")
+    assert [r["INDEX"] for r in new] == [1, 2, 3]
+    assert cursor == "2023-01-01T10:00:02"
+    assert etag is not None
+    assert fetch(api, cursor, seen, etag)[0] == []
+    assert api.requests[-1] == (cursor, 0, etag)
+
+
+def test_acknowledgement_of_a_tracked_message_acknowledges_the_problem():
+    tracking.add_message("h1/CPU|note\\a|", "7", "https://inote/api/v1/messages", "{}")
+    messages = receipts.get_tracked_messages("https://inote/api/v1/messages", ["7", "8"])
+    assert messages == {"7": "h1/CPU|note\\a|"}
+    receipt = {"INDEX": 7, "TYPE": "ACK", "USER": "alice", "COMPUTER": "pc1"}
+    assert receipts.get_checkmk_commands([receipt, dict(receipt, USER="bob")], messages, "IDERI note", now=1) == [
+        "COMMAND [1] ACKNOWLEDGE_SVC_PROBLEM;h1;CPU;1;1;0;IDERI note;Acknowledged in IDERI note by alice (pc1)",
+    ]
+
+
+def test_receipts_are_commented_if_configured():
+    receipt = {"INDEX": 7, "TYPE": "RECEIVE", "USER": "alice", "COMPUTER": "pc1"}
+    assert receipts.get_checkmk_commands([receipt], {"7": "h1|note\\a|"}, "IDERI note", comment_receipts=True, now=1) == [
+        "COMMAND [1] ADD_HOST_COMMENT;h1;0;IDERI note;IDERI note message received by alice (pc1)",
+    ]
+    assert receipts.get_checkmk_commands([receipt], {"7": "h1|note\\a|"}, "IDERI note") == []
+
+
+def test_cursor_is_stored_per_url():
+    receipts.set_cursor(URL, "2023-01-01T10:00:00", {"a", "b"}, "etag1")
+    assert receipts.get_cursor(URL) == ("2023-01-01T10:00:00", {"a", "b"}, "etag1")
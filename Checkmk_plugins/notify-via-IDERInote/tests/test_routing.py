@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from iderinote import routing
+
+TABLE = r"""
+[Database team]
+HostGroups=db-servers
+ServicePatterns=Oracle.*
+States=CRIT
+Recipients=note\GRP-DBA
+Display=showfullscreen
+
+[Production]
+HostTags=prod
+Recipients=note\GRP-OPS
+AddressingMode=UserAndComputer
+Final=yes
+
+[Never reached]
+Recipients=note\nobody
+"""
+
+
+@pytest.fixture
+def routing_dir(tmp_path, monkeypatch):
+    routing_dir = tmp_path / "routing"
+    routing_dir.mkdir()
+    (routing_dir / "teams.ini").write_text(TABLE)
+    monkeypatch.setenv("INOTE_ROUTING_DIR", str(routing_dir))
+    return routing_dir
+
+
+def get_names(context):
+    return [route["name"] for route in routing.get_routes(routing.load_routing_table("teams"), context)]
+
+
+def test_routing_names_honour_the_routing_dir(routing_dir):
+    assert routing.get_routing_names() == ["teams"]
+
+
+def test_entries_match_up_to_the_first_final_one(routing_dir, make_context):
+    context = make_context(SERVICEDESC="Oracle Sessions", HOSTGROUPNAMES="db-servers", HOSTTAGS="prod")
+    assert get_names(context) == ["Database team", "Production"]
+
+
+def test_every_key_must_match(routing_dir, make_context):
+    assert get_names(make_context(SERVICEDESC="Oracle Sessions", HOSTGROUPNAMES="db-servers", SERVICESTATE="WARNING")) == ["Never reached"]
+    assert get_names(make_context(SERVICEDESC="CPU", HOSTGROUPNAMES="db-servers")) == ["Never reached"]
+
+
+def test_service_entries_never_match_host_events(routing_dir, make_context):
+    context = make_context(WHAT="HOST", HOSTSTATE="CRITICAL", HOSTGROUPNAMES="db-servers")
+    assert get_names(context) == ["Never reached"]
+
+
+def test_invalid_state_is_rejected(routing_dir):
+    (routing_dir / "broken.ini").write_text("[x]\nStates=BROKEN\n")
+    with pytest.raises(routing.RoutingError):
+        routing.load_routing_table("broken")
+
+
+def test_plugin_sends_one_message_per_route(plugin, routing_dir, make_context):
+    context = make_context(SERVICEDESC="Oracle Sessions", HOSTGROUPNAMES="db-servers", HOSTTAGS="prod", PARAMETER_INOTE_ROUTING="teams")
+    plugin.set_routing_table(context)
+    messages = plugin.get_inote_route_messages(context, dict(plugin.message, RECIPIENT=["note\\a"]))
+    assert [m["RECIPIENT"] for m in messages] == [["note\\GRP-DBA"], ["note\\GRP-OPS"]]
+    assert messages[0]["SHOWFULLSCREEN"] and messages[0]["SHOWPOPUP"]
+    assert messages[1]["ADDRESSINGMODE"] == plugin.AddressingMode.UserAndComputer
+
+
+def test_plugin_falls_back_to_the_rule_recipients(plugin, routing_dir, make_context, capsys):
+    context = make_context(PARAMETER_INOTE_ROUTING="missing")
+    plugin.set_routing_table(context)
+    message = dict(plugin.message, RECIPIENT=["note\\a"])
+    assert plugin.get_inote_route_messages(context, message) == [message]
+    assert 'Failed to load routing table "missing"' in capsys.readouterr().err
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from iderinote import skeleton
+
+DEFAULTS = {"SHOWPOPUP": False, "SHOWFULLSCREEN": False, "PRIORITY": 0, "RECIPIENT": [], "LINKTEXT": "", "STARTTIMEUTC": None}
+ADDRESSING_MODES = {"UserOnly": 0, "ComputerOnly": 0x2000}
+
+
+def compile_params(**params):
+    return skeleton.compile_skeleton(tuple(sorted(("PARAMETER_INOTE_MSG_" + k, v) for k, v in params.items())), DEFAULTS, ADDRESSING_MODES)
+
+
+def test_fields_are_typed_by_their_default():
+    compiled = compile_params(SHOWPOPUP="False", PRIORITY="2", RECIPIENT="note\\a, note\\b,", LINKTEXT="Checkmk", DURATION="60")
+    assert compiled == {
+        "fields": {"SHOWPOPUP": False, "PRIORITY": 2, "RECIPIENT": ["note\\a", "note\\b"], "LINKTEXT": "Checkmk"},
+        "duration": 60,
+        "networkranges": [],
+    }
+
+
+def test_full_screen_always_shows_the_popup():
+    assert compile_params(POPUP_OR_FS_SELECTION="showfullscreen")["fields"] == {"SHOWPOPUP": True, "SHOWFULLSCREEN": True}
+
+
+@pytest.mark.parametrize("params", [
+    {"SHOWPOPUP": "yes"},
+    {"PRIORITY": "high"},
+    {"DURATION": "-1"},
+    {"ADDRESSINGMODE": "Everyone"},
+    {"POPUP_OR_FS_SELECTION": "showbanner"},
+    {"STARTTIMEUTC": "now"},
+])
+def test_invalid_parameters_are_rejected(params):
+    with pytest.raises(skeleton.ParameterError):
+        compile_params(**params)
+
+
+def test_skeleton_is_compiled_once_per_rule():
+    params = skeleton.get_message_params({"PARAMETER_INOTE_MSG_DURATION": "5", "HOSTNAME": "h1"})
+    assert params == (("PARAMETER_INOTE_MSG_DURATION", "5"),)
+    assert skeleton.load_skeleton(params, DEFAULTS, ADDRESSING_MODES) is skeleton.load_skeleton(params, DEFAULTS, ADDRESSING_MODES)
+
+
+def test_plugin_sets_false_parameters_to_false(plugin, make_context):
+    message = plugin.parse_inote_message_params(make_context(PARAMETER_INOTE_MSG_SHOWTICKER="False"), dict(plugin.message))
+    assert message["SHOWTICKER"] is False
+    assert message["RECIPIENT"] == ["note\\a"]
+    assert (message["ENDTIMEUTC"] - message["STARTTIMEUTC"]).total_seconds() == 3600
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import pytest
+import requests
+
+from iderinote import spool
+
+URL = "https://inote.example.com/IDERInote/api/v1/messages"
+
+
+@pytest.fixture
+def spool_dir(tmp_path, monkeypatch):
+    spool_dir = str(tmp_path / "spool")
+    monkeypatch.setenv("INOTE_SPOOL_DIR", spool_dir)
+    return spool_dir
+
+
+def enqueue(spool_dir, text, order_key="h1/CPU"):
+    return spool.spool_inote_message(spool_dir, URL, "u", "p", True, {"TEXT": text}, order_key)
+
+
+class Posts(list):
+    """Records the posts of the drainer, answers with the next status of the list."""
+
+    def __init__(self, *statuses):
+        super().__init__()
+        self.statuses = list(statuses)
+
+    def __call__(self, url, user, password, verify, message):
+        self.append(message["TEXT"])
+        return (self.statuses.pop(0) if self.statuses else 200), ""
+
+
+def test_queues_are_known_from_the_file_names(spool_dir, monkeypatch):
+    enqueue(spool_dir, "a1", "a")
+    enqueue(spool_dir, "b1", "b")
+    enqueue(spool_dir, "a2", "a")
+    monkeypatch.setattr(spool, "open", lambda *args: pytest.fail("spool file read"), raising=False)
+    queues = spool.SpoolDrainer(spool_dir, Posts()).get_queues()
+    assert [len(names) for names in queues.values()] == [2, 1]
+    assert queues[spool.get_key_hash("a")][0] < queues[spool.get_key_hash("a")][1]
+
+
+def test_files_of_older_versions_are_queued(spool_dir):
+    path = enqueue(spool_dir, "a1", "a")
+    os.rename(path, os.path.join(spool_dir, "new", "1-2-3.json"))
+    assert spool.SpoolDrainer(spool_dir, Posts()).get_queues() == {spool.get_key_hash("a"): ["1-2-3.json"]}
+
+
+def test_failed_message_delays_only_its_own_key(spool_dir):
+    enqueue(spool_dir, "a1", "a")
+    enqueue(spool_dir, "a2", "a")
+    enqueue(spool_dir, "b1", "b")
+    posts = Posts(500)
+    assert spool.SpoolDrainer(spool_dir, posts).drain() > 0
+    assert posts == ["a1", "b1"]
+    assert spool.has_pending(spool_dir, "a")
+    assert not spool.has_pending(spool_dir, "b")
+
+
+def test_rejected_message_is_moved_to_deadletter(spool_dir):
+    enqueue(spool_dir, "a1")
+    assert spool.SpoolDrainer(spool_dir, Posts(400)).drain() is None
+    assert len(os.listdir(os.path.join(spool_dir, "deadletter"))) == 1
+    assert os.listdir(os.path.join(spool_dir, "new")) == []
+
+
+def test_spool_file_is_private(spool_dir):
+    path = enqueue(spool_dir, "a1")
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    with open(path) as f:
+        assert json.load(f)["order_key"] == "h1/CPU"
+
+
+def test_direct_send_does_not_overtake_spooled_messages(plugin, monkeypatch, spool_dir, capsys):
+    enqueue(spool_dir, "older")
+    direct = []
+    monkeypatch.setattr(requests, "post", lambda *args, **kwargs: direct.append(kwargs))
+    monkeypatch.setattr(plugin, "spool_mode", "onfailure")
+    message = dict(plugin.message, RECIPIENT=["note\\a"])
+    assert plugin.send_inote_message("https://inote.example.com/IDERInote/api", "u", "p", False, message, "h1/CPU") == 0
+    assert direct == []
+    assert len(os.listdir(os.path.join(spool_dir, "new"))) == 2
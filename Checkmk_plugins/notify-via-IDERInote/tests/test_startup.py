@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+
+from conftest import PLUGIN_DIR
+
+IMPORT_PLUGIN = """
+import importlib.util, sys
+spec = importlib.util.spec_from_file_location("IDERInote", sys.argv[1])
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+print(" ".join(sorted(sys.modules)))
+"""
+
+
+def test_fast_startup_imports_only_what_is_needed():
+    env = dict(os.environ, INOTE_FAST_STARTUP="1", PYTHONPATH=os.path.join(PLUGIN_DIR, "lib", "python3"))
+    modules = subprocess.run(
+        [sys.executable, "-S", "-c", IMPORT_PLUGIN, os.path.join(PLUGIN_DIR, "notifications", "IDERInote.py")],
+        env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True,
+    ).stdout.split()
+    for module in ("cmk", "requests", "json", "datetime", "http.client", "iderinote.templates", "iderinote.metrics"):
+        assert module not in modules
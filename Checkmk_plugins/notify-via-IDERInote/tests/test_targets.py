@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+
+from iderinote import tracking
+
+API_URL = "https://inote.example.com/IDERInote/api"
+
+TARGETS = {
+    "PARAMETER_INOTE_TARGETS_TARGETS_1_RECIPIENTS": "note\\ops, note\\oncall",
+    "PARAMETER_INOTE_TARGETS_TARGETS_2_RECIPIENTS": "note\\wall",
+    "PARAMETER_INOTE_TARGETS_TARGETS_2_DISPLAY": "showfullscreen",
+}
+
+
+@pytest.fixture
+def posts(plugin, monkeypatch):
+    """Replaces the API, records the posted messages and the threads posting them."""
+
+    posts = []
+
+    def post(url, user, password, verify, message, body):
+        posts.append((message, threading.current_thread().name))
+        return 200, '{"INDEX": %d}' % len(posts)
+
+    monkeypatch.setattr(plugin, "post_inote_message", post)
+    return posts
+
+
+def notify(plugin, monkeypatch, context):
+    monkeypatch.setattr(plugin.utils, "collect_context", lambda: dict(context))
+    monkeypatch.setattr(plugin.sys, "argv", ["IDERInote.py"])
+    return plugin.main()
+
+
+def test_every_target_gets_its_message(plugin, monkeypatch, posts, make_context):
+    assert notify(plugin, monkeypatch, make_context(**TARGETS)) == 0
+    messages = sorted((message for message, _ in posts), key=lambda message: message["RECIPIENT"])
+    assert [message["RECIPIENT"] for message in messages] == [["note\\ops", "note\\oncall"], ["note\\wall"]]
+    assert messages[1]["SHOWFULLSCREEN"] and not messages[0]["SHOWFULLSCREEN"]
+    # The text is composed once for all targets
+    assert messages[0]["TEXT"] == messages[1]["TEXT"]
+    assert all(thread != threading.main_thread().name for _, thread in posts)
+
+
+def test_created_messages_are_tracked_per_target(plugin, monkeypatch, posts, make_context):
+    notify(plugin, monkeypatch, make_context(PARAMETER_INOTE_TRACKING_ACTION="expire", **TARGETS))
+    indexes = sorted(tracking.pop_message(key)[0] for key in ("h1/CPU|note\\ops,note\\oncall|", "h1/CPU|note\\wall|"))
+    assert indexes == ["1", "2"]
+
+
+def test_delivery_missing_the_deadline_fails(plugin, monkeypatch, make_context, capsys):
+    released = threading.Event()
+
+    def post(url, user, password, verify, message, body):
+        if message["RECIPIENT"] == ["note\\wall"]:
+            released.wait(5)
+        return 200, '{"INDEX": 1}'
+
+    monkeypatch.setattr(plugin, "post_inote_message", post)
+    try:
+        assert notify(plugin, monkeypatch, make_context(PARAMETER_INOTE_TARGETS_DEADLINE="0.2", **TARGETS)) == 1
+    finally:
+        released.set()
+    assert "did not finish within 0.2 seconds" in capsys.readouterr().err
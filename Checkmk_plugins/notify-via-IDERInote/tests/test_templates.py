@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+
+import pytest
+
+from conftest import PLUGIN_DIR
+from iderinote import templates
+
+
+@pytest.fixture
+def template_dir(tmp_path, monkeypatch):
+    template_dir = str(tmp_path / "templates")
+    shutil.copytree(os.path.join(PLUGIN_DIR, "templates"), template_dir)
+    monkeypatch.setenv("INOTE_TEMPLATE_DIR", template_dir)
+    return template_dir
+
+
+def test_render_substitutes_macros_with_crlf():
+    compiled = templates.compile_template("Host $HOSTNAME$\nOutput: $HOSTOUTPUT$\n")
+    assert templates.render_template(compiled, {"HOSTNAME": "h1", "HOSTOUTPUT": "a\nb"}) == "Host h1\r\nOutput: a\r\nb\r\n"
+
+
+def test_unknown_macros_are_removed_unless_they_look_like_money():
+    compiled = templates.compile_template("$UNKNOWN$ costs $5$", crlf=False)
+    assert templates.render_template(compiled, {}, crlf=False) == " costs $5$"
+
+
+def test_compiled_template_is_cached():
+    assert templates.compile_template("$HOSTNAME$") is templates.compile_template("$HOSTNAME$")
+
+
+def test_template_names_honour_the_template_dir(template_dir):
+    assert templates.get_template_names() == ["Default", "Short"]
+
+
+def test_named_template_is_recompiled_when_changed(template_dir):
+    assert templates.render_template(templates.load_template("Short")["Host"], {"HOSTNAME": "h1", "HOSTSTATE": "DOWN"}).startswith("h1 is DOWN")
+    path = os.path.join(template_dir, "Short.ini")
+    with open(path, "w") as f:
+        f.write("[Host]\nLines=1\nLine1=changed $HOSTNAME$\n")
+    os.utime(path, ns=(1, 1))
+    assert templates.render_template(templates.load_template("Short")["Host"], {"HOSTNAME": "h1"}) == "changed h1\r\n"
+
+
+def test_plugin_uses_the_template_of_the_rule(plugin, template_dir, make_context):
+    text = plugin.get_inote_message_text(make_context(PARAMETER_INOTE_TEMPLATE="Short"))
+    assert text.startswith("CPU on h1 is CRITICAL (")
+
+
+def test_plugin_falls_back_to_the_builtin_template(plugin, template_dir, make_context, capsys):
+    text = plugin.get_inote_message_text(make_context(PARAMETER_INOTE_TEMPLATE="Missing"))
+    assert text.startswith("[PROBLEM]\r\nService CPU on h1 is CRITICAL.")
+    assert "Failed to load template 'Missing'" in capsys.readouterr().err
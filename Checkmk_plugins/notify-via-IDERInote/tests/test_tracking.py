@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from iderinote import tracking
+
+API_URL = "https://inote.example.com/IDERInote/api"
+
+
+def test_message_index_from_response():
+    assert tracking.get_message_index('{"INDEX": 42}') == "42"
+    assert tracking.get_message_index('{"ID": "a1"}') == "a1"
+    assert tracking.get_message_index("created") is None
+    assert tracking.get_message_index("[1]") is None
+
+
+def test_newer_message_replaces_older_one():
+    tracking.add_message("h1/CPU|note\\a|", "1", API_URL, "{}")
+    tracking.add_message("h1/CPU|note\\a|", "2", API_URL, "{}")
+    assert tracking.pop_message("h1/CPU|note\\a|") == ("2", API_URL, "{}")
+    assert tracking.pop_message("h1/CPU|note\\a|") is None
+
+
+def test_old_messages_are_dropped(clock):
+    tracking.add_message("a", "1", API_URL, "{}")
+    clock.advance(tracking.MAX_AGE + 1)
+    tracking.add_message("b", "2", API_URL, "{}")
+    assert tracking.pop_message("a") is None
+
+
+@pytest.fixture
+def api(plugin, monkeypatch):
+    """Replaces the API, records the created messages and the other calls."""
+
+    calls = []
+    monkeypatch.setattr(plugin, "post_inote_message", lambda url, user, password, verify, message, body: calls.append(("POST", url, message)) or (200, '{"INDEX": 7}'))
+    monkeypatch.setattr(plugin, "call_inote_api", lambda method, url, user, password, verify, body=None: calls.append((method, url, body)) or (200, ""))
+    return calls
+
+
+def notify(plugin, monkeypatch, context):
+    monkeypatch.setattr(plugin.utils, "collect_context", lambda: dict(context))
+    monkeypatch.setattr(plugin.sys, "argv", ["IDERInote.py"])
+    return plugin.main()
+
+
+def test_recovery_expires_the_message_of_the_problem(plugin, monkeypatch, api, make_context):
+    assert notify(plugin, monkeypatch, make_context(PARAMETER_INOTE_TRACKING_ACTION="expire")) == 0
+    assert notify(plugin, monkeypatch, make_context(PARAMETER_INOTE_TRACKING_ACTION="expire", NOTIFICATIONTYPE="RECOVERY", SERVICESTATE="OK")) == 0
+    assert [(method, url) for method, url, _ in api] == [
+        ("POST", API_URL + "/v1/messages"),
+        ("PUT", API_URL + "/v1/messages/7"),
+        ("POST", API_URL + "/v1/messages"),
+    ]
+    assert json.loads(api[1][2])["ENDTIMEUTC"] != api[0][2]["ENDTIMEUTC"]
+
+
+def test_recovery_can_replace_the_ending_message(plugin, monkeypatch, api, make_context):
+    context = make_context(PARAMETER_INOTE_TRACKING_ACTION="revoke", PARAMETER_INOTE_TRACKING_SKIPRECOVERY="True")
+    notify(plugin, monkeypatch, context)
+    notify(plugin, monkeypatch, dict(context, NOTIFICATIONTYPE="RECOVERY", SERVICESTATE="OK"))
+    assert [method for method, _, _ in api] == ["POST", "DELETE"]
+
+
+def test_recovery_without_tracked_message_is_sent(plugin, monkeypatch, api, make_context):
+    context = make_context(PARAMETER_INOTE_TRACKING_ACTION="revoke", PARAMETER_INOTE_TRACKING_SKIPRECOVERY="True")
+    notify(plugin, monkeypatch, dict(context, NOTIFICATIONTYPE="RECOVERY", SERVICESTATE="OK"))
+    assert [method for method, _, _ in api] == ["POST"]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from iderinote.truncate import truncate_text
+
+
+def get_lines(count, prefix="line"):
+    return "\n".join("{} {:04d} {}".format(prefix, i, "x" * 40) for i in range(count))
+
+
+def test_text_fitting_the_budget_is_unchanged():
+    text = get_lines(3)
+    assert truncate_text(text, len(text)) == (text, 0)
+
+
+@pytest.mark.parametrize("budget", [0, 10, 60, 100, 500, 2000])
+def test_result_fits_the_budget(budget):
+    text = get_lines(200)
+    result, cut = truncate_text(text, budget)
+    assert len(result.encode("utf-8")) <= max(budget, len("[... {} bytes cut ...]".format(len(text))))
+    assert cut > 0
+
+
+def test_first_and_last_lines_are_kept():
+    text = get_lines(200)
+    result, cut = truncate_text(text, 1000)
+    lines = result.split("\n")
+    assert lines[0] == text.split("\n")[0]
+    assert lines[-1] == text.split("\n")[-1]
+    assert "[... {} bytes cut ...]".format(cut) in lines
+    # Cut at line boundaries
+    assert all(line in text.split("\n") for line in lines if not line.startswith("[..."))
+
+
+def test_cut_counts_the_removed_bytes():
+    text = get_lines(200)
+    result, cut = truncate_text(text, 1000)
+    head, marker, tail = result.partition("\n[... {} bytes cut ...]\n".format(cut))
+    assert len(text.encode("utf-8")) == len(head.encode("utf-8")) + cut + len(tail.encode("utf-8"))
+
+
+def test_multibyte_characters_are_not_split():
+    text = "ä€🔥" * 500
+    result, cut = truncate_text(text, 300)
+    assert len(result.encode("utf-8")) <= 300
+    assert result.encode("utf-8").decode("utf-8") == result
+    assert result.startswith("ä€🔥")
+
+
+def test_windows_line_endings():
+    text = get_lines(200).replace("\n", "\r\n")
+    result, cut = truncate_text(text, 1000, "\r\n")
+    assert "\r\n[... {} bytes cut ...]\r\n".format(cut) in result
+
+
+def test_plugin_output_is_cut_to_the_output_budget(plugin, make_context):
+    context = make_context(PARAMETER_INOTE_PAYLOAD_OUTPUT="500", SERVICEOUTPUT=get_lines(200))
+    text = plugin.get_inote_message_text(context)
+    assert "line 0000" in text and "line 0199" in text and "bytes cut ...]" in text
+    assert len(text.encode("utf-8")) < 1500
+
+
+def test_plugin_output_can_be_replaced_by_the_link(plugin, make_context):
+    context = make_context(PARAMETER_INOTE_PAYLOAD_OUTPUT="500", PARAMETER_INOTE_PAYLOAD_LINKONLY="True", SERVICEOUTPUT=get_lines(200))
+    text = plugin.get_inote_message_text(context, {"LINKTARGET": "https://cmk.example.com/"})
+    assert "line 0000" not in text
+    assert "[{} bytes of output, see the link]".format(len(get_lines(200))) in text
+
+
+def test_message_text_is_cut_to_the_total_budget(plugin, make_context):
+    context = make_context(PARAMETER_INOTE_PAYLOAD_TOTAL="400", SERVICEOUTPUT=get_lines(200))
+    text = plugin.get_inote_message_text(context)
+    assert len(text.encode("utf-8")) <= 400
+    assert "bytes cut ...]\r\n" in text
@@ -11,6 +11,15 @@
 ## History:
 ## (2022-10-27) 0.8: initial release
 ##              Tested with checkmk 2.0.0p25 + 2.1.0p14
+## (unreleased) 0.9: bulk notification support, local forwarder, delivery
+##              spool, event coalescing, http.client sender, message
+##              templates, trace sampling, metrics, context dump, routing
+##              tables, API timeouts, circuit breaker, multiple API
+##              endpoints, tracking of the active message, rate limits,
+##              webhook gateway, receipt poller, payload size budgets,
+##              home office and network range targets, recipient check,
+##              profiling, escalation of unacknowledged alerts, delivery
+##              targets, compact payload
 
 from cmk.gui.i18n import _
 
@@ -18,28 +27,63 @@ from cmk.gui.valuespec import (
     Dictionary,
     Integer,
     CascadingDropdown,
+    DropdownChoice,
     Password,
     TextInput,
     FixedValue,
     HTTPUrl,
+    ListOf,
+    ListOfStrings,
 )
 
 
+def _inote_template_choices():
+    from iderinote.templates import get_template_names
+    return [(name, name) for name in get_template_names()]
+
+
+def _inote_routing_choices():
+    from iderinote.routing import get_routing_names
+    return [(name, name) for name in get_routing_names()]
+
+
 register_notification_parameters(
     "IDERInote.py",
     Dictionary(
         title=_("Create notification with the following parameters"),
         optional_keys=[
             "inote_api_insecureconnection", 
+            "inote_api_failoverurls",
+            "inote_api_balancing",
+            "inote_api_useforwarder",
+            "inote_api_spool",
+            "inote_api_httpclient",
+            "inote_api_compactpayload",
+            "inote_api_timeouts",
+            "inote_api_circuitbreaker",
             "inote_msg_popup_or_fs", 
             "inote_msg_showticker", 
             "inote_msg_exclude", 
+            "inote_api_checkrecipients",
             "inote_msg_notifyreceive", 
             "inote_msg_notifyacknowledge", 
             "inote_msg_showonwinlogononly", 
             "inote_msg_showonwinlogon", 
             "inote_msg_homeoffice_or_networkrange",
+            "inote_template",
+            "inote_routing",
+            "inote_targets",
+            "inote_tracking",
+            "inote_escalation",
             "checkmkUrl",
+            "inote_bulk_maxevents",
+            "inote_coalesce",
+            "inote_ratelimit",
+            "inote_payload",
+            "inote_plugin_tracesample",
+            "inote_plugin_profile",
+            "inote_plugin_metrics",
+            "inote_plugin_dumpcontext",
         ],
         elements = 
         [
@@ -53,6 +97,45 @@ register_notification_parameters(
                     allow_empty=False,
                 ),
             ),
+            (
+                "inote_api_failoverurls",
+                ListOfStrings(
+                    title=_("Additional IDERI note API URLs"),
+                    help=_("Further IDERI note servers serving the same "
+                           "messages. The endpoint used for a message is "
+                           "chosen by its measured latency and recent errors. "
+                           "If an endpoint fails, the message is sent to the "
+                           "next one within the same notification."),
+                    valuespec=HTTPUrl(
+                        allow_empty=False,
+                    ),
+                    orientation="vertical",
+                    allow_empty=False,
+                ),
+            ),
+            (
+                "inote_api_balancing",
+                CascadingDropdown(
+                    title=_("Selection of the API endpoint:"),
+                    help=_("Only used with additional IDERI note API URLs. "
+                           "'Fastest healthy endpoint' sends every message to "
+                           "the endpoint with the best latency and error rate, "
+                           "'Round robin' spreads the messages over all "
+                           "healthy endpoints. Endpoints with recent errors "
+                           "are only used if all others fail."),
+                    sorted=False,
+                    choices=[
+                        (
+                            "health",
+                            _("Fastest healthy endpoint (default)"),
+                        ),
+                        (
+                            "roundrobin",
+                            _("Round robin"),
+                        ),
+                    ],
+                ),
+            ),
             (
                 "inote_api_insecureconnection",
                 FixedValue(
@@ -62,6 +145,141 @@ register_notification_parameters(
                     help=_("Ignore unverified HTTPS request warnings. Use with caution."),
                 ),
             ),
+            (
+                "inote_api_useforwarder",
+                FixedValue(
+                    value=True,
+                    title=_("Send messages via the local IDERI note forwarder."),
+                    totext=_("True"),
+                    help=_("Hand the messages to the local forwarder "
+                           "(inote-forwarder) which keeps the connections to "
+                           "the IDERI note API open. If the forwarder is not "
+                           "running the messages are sent directly."),
+                ),
+            ),
+            (
+                "inote_api_spool",
+                CascadingDropdown(
+                    title=_("Use the delivery spool:"),
+                    help=_("Write the messages to the local delivery spool. "
+                           "The spool drain worker (inote-spool-drain) delivers "
+                           "them with exponential backoff and keeps the order "
+                           "per host and service. With 'only if the direct "
+                           "delivery fails' the message is sent directly first "
+                           "and only spooled if that fails, instead of letting "
+                           "Checkmk retry the notification."),
+                    sorted=False,
+                    choices=[
+                        (
+                            "always",
+                            _("Spool every message"),
+                        ),
+                        (
+                            "onfailure",
+                            _("Spool only if the direct delivery fails"),
+                        ),
+                    ],
+                ),
+            ),
+            (
+                "inote_api_httpclient",
+                CascadingDropdown(
+                    title=_("HTTP client:"),
+                    help=_("The library used to send the messages to the IDERI "
+                           "note API. The 'http.client' client of the python "
+                           "standard library starts much faster than 'requests', "
+                           "but uses the CA certificates of the system instead "
+                           "of the ones shipped with requests."),
+                    sorted=False,
+                    choices=[
+                        (
+                            "requests",
+                            _("requests (default)"),
+                        ),
+                        (
+                            "httpclient",
+                            _("http.client"),
+                        ),
+                    ],
+                ),
+            ),
+            (
+                "inote_api_compactpayload",
+                FixedValue(
+                    value=True,
+                    title=_("Send only the message fields differing from the server defaults."),
+                    totext=_("True"),
+                    help=_("Leaves out the fields of the message which have "
+                           "the default value of the IDERI note server (empty "
+                           "link, no network ranges, disabled options), which "
+                           "makes the messages much smaller. With the log "
+                           "level 'Debug' every compact message is checked "
+                           "against the full message, and the full message is "
+                           "sent if they differ."),
+                ),
+            ),
+            (
+                "inote_api_timeouts",
+                Dictionary(
+                    title=_("Timeouts of the IDERI note API requests"),
+                    help=_("Seconds to wait for the connection to the IDERI "
+                           "note API and for its response. If not set, 5 "
+                           "seconds are used to connect and 30 seconds to "
+                           "wait for the response."),
+                    optional_keys=[],
+                    elements=[
+                        (
+                            "connect",
+                            Integer(
+                                title=_("Connect timeout (seconds)"),
+                                default_value=5,
+                                minvalue=1,
+                            ),
+                        ),
+                        (
+                            "read",
+                            Integer(
+                                title=_("Read timeout (seconds)"),
+                                default_value=30,
+                                minvalue=1,
+                            ),
+                        ),
+                    ],
+                ),
+            ),
+            (
+                "inote_api_circuitbreaker",
+                Dictionary(
+                    title=_("Circuit breaker"),
+                    help=_("After a number of consecutive failed requests "
+                           "(connection errors, timeouts and server errors) the "
+                           "IDERI note API is marked as unavailable for all "
+                           "notifications of the site. Until the cooldown has "
+                           "passed, messages fail immediately (or are spooled) "
+                           "instead of waiting for the timeout. Afterwards one "
+                           "notification tries the API again and its result "
+                           "decides whether the API is used again."),
+                    optional_keys=[],
+                    elements=[
+                        (
+                            "failures",
+                            Integer(
+                                title=_("Consecutive failures"),
+                                default_value=3,
+                                minvalue=1,
+                            ),
+                        ),
+                        (
+                            "cooldown",
+                            Integer(
+                                title=_("Cooldown (seconds)"),
+                                default_value=60,
+                                minvalue=1,
+                            ),
+                        ),
+                    ],
+                ),
+            ),
             (
                 "inote_api_username",
                 TextInput(
@@ -138,6 +356,20 @@ register_notification_parameters(
                     allow_empty=False,
                 ),
             ),
+            (
+                "inote_api_checkrecipients",
+                FixedValue(
+                    value=True,
+                    title=_("Check the recipients on the IDERI note server."),
+                    totext=_("True"),
+                    help=_("Recipients and excludes unknown to the IDERI note "
+                           "server are removed from the message (and reported "
+                           "in the notify.log) instead of the server rejecting "
+                           "the whole message. The recipients are checked in "
+                           "the background and cached for a day, so a new "
+                           "recipient is sent unchecked once."),
+                ),
+            ),
             (
                 "inote_msg_popup_or_fs",
                 Dictionary(
@@ -220,6 +452,262 @@ register_notification_parameters(
                            "including computers."),
                 ),
             ),
+            (
+                "inote_msg_homeoffice_or_networkrange",
+                CascadingDropdown(
+                    title=_("Home office users or network ranges:"),
+                    help=_("Restricts the message to users working from home "
+                           "office or to the computers in (or outside of) "
+                           "network ranges of the IDERI note server. Network "
+                           "ranges are given by their name (or id), the ids "
+                           "are looked up in a cached directory of the IDERI "
+                           "note server which is refreshed in the background. "
+                           "Until a new network range is found there, the "
+                           "notification is retried by Checkmk."),
+                    sorted=False,
+                    choices=[
+                        (
+                            "homeofficeonly",
+                            _("Only users working from home office"),
+                        ),
+                        (
+                            "homeofficeexclude",
+                            _("Exclude users working from home office"),
+                        ),
+                        (
+                            "networkrange",
+                            _("Only computers in the network ranges"),
+                            ListOfStrings(
+                                orientation="vertical",
+                                allow_empty=False,
+                            ),
+                        ),
+                        (
+                            "networkrangeexclude",
+                            _("Exclude computers in the network ranges"),
+                            ListOfStrings(
+                                orientation="vertical",
+                                allow_empty=False,
+                            ),
+                        ),
+                    ],
+                ),
+            ),
+            (
+                "inote_template",
+                DropdownChoice(
+                    title=_("Message template"),
+                    help=_("The template used for the text of the IDERI note "
+                           "message. Templates are .ini files in the directory "
+                           "etc/inote/templates of the site. If not set (or the "
+                           "template cannot be read) the built-in template is "
+                           "used."),
+                    choices=_inote_template_choices,
+                    invalid_choice="complain",
+                ),
+            ),
+            (
+                "inote_routing",
+                DropdownChoice(
+                    title=_("Recipient routing table"),
+                    help=_("Routes the message to the recipients of the "
+                           "matching entries of a routing table, so one rule "
+                           "can serve several teams. Routing tables are .ini "
+                           "files in the directory etc/inote/routing of the "
+                           "site, matching host groups, host tags, services "
+                           "and states to recipients, excludes and display "
+                           "modes. One message is created per matching entry. "
+                           "If no entry matches (or the table cannot be read) "
+                           "the recipients of this rule are used."),
+                    choices=_inote_routing_choices,
+                    invalid_choice="complain",
+                ),
+            ),
+            (
+                "inote_targets",
+                Dictionary(
+                    title=_("Delivery targets"),
+                    help=_("Sends the message to several targets at once, each "
+                           "with its own recipients, addressing mode and "
+                           "display, e.g. a popup for the IT staff and a full "
+                           "screen message for the computers of the NOC wall "
+                           "screens. The text of the message is composed once, "
+                           "the messages are sent concurrently. Settings not "
+                           "given for a target are taken from this rule. The "
+                           "targets replace the recipients of this rule, "
+                           "matching entries of a routing table take "
+                           "precedence."),
+                    optional_keys=["deadline"],
+                    elements=[
+                        (
+                            "targets",
+                            ListOf(
+                                Dictionary(
+                                    optional_keys=["exclude", "addressingmode", "display", "showticker"],
+                                    elements=[
+                                        (
+                                            "recipients",
+                                            TextInput(
+                                                title=_("Recipients"),
+                                                placeholder=_("Comma separated list: '<dom>\<user>, <dom>\<group>, <dom>\<computer>$'"),
+                                                size=60,
+                                                allow_empty=False,
+                                            ),
+                                        ),
+                                        (
+                                            "exclude",
+                                            TextInput(
+                                                title=_("Excludes"),
+                                                placeholder=_("Comma separated list: '<dom>\<user>, <dom>\<group>, <dom>\<computer>$'"),
+                                                size=60,
+                                                allow_empty=False,
+                                            ),
+                                        ),
+                                        (
+                                            "addressingmode",
+                                            DropdownChoice(
+                                                title=_("AddressingMode"),
+                                                choices=[
+                                                    ("UserOnly", _("Send message to users only")),
+                                                    ("UserAndComputer", _("Send message to users and computers")),
+                                                    ("ComputerOnly", _("Send message to computers only")),
+                                                ],
+                                            ),
+                                        ),
+                                        (
+                                            "display",
+                                            DropdownChoice(
+                                                title=_("Show the message"),
+                                                choices=[
+                                                    ("showpopup", _("Show in popup")),
+                                                    ("showfullscreen", _("Show in full screen")),
+                                                    ("showfullscreenandlock", _("Show in full screen and lock workstation")),
+                                                ],
+                                            ),
+                                        ),
+                                        (
+                                            "showticker",
+                                            FixedValue(
+                                                value=True,
+                                                title=_("Show message in the ticker"),
+                                                totext=_("True"),
+                                            ),
+                                        ),
+                                    ],
+                                ),
+                                title=_("Targets"),
+                                add_label=_("Add target"),
+                                allow_empty=False,
+                            ),
+                        ),
+                        (
+                            "deadline",
+                            Integer(
+                                title=_("Deadline for all targets"),
+                                help=_("Deliveries not finished within this time "
+                                       "count as failed, Checkmk retries the "
+                                       "notification."),
+                                unit=_("seconds"),
+                                default_value=60,
+                                minvalue=1,
+                            ),
+                        ),
+                    ],
+                ),
+            ),
+            (
+                "inote_tracking",
+                Dictionary(
+                    title=_("End the message of a problem on recovery"),
+                    help=_("Remembers the IDERI note message created for a "
+                           "PROBLEM of a host or service. The RECOVERY or "
+                           "acknowledgement of the problem (and the next "
+                           "PROBLEM) then ends this message instead of leaving "
+                           "it active until its end time. The messages are "
+                           "stored in var/inote/messages.sqlite of the site. "
+                           "Not used for bulk notifications."),
+                    optional_keys=["skiprecovery"],
+                    elements=[
+                        (
+                            "action",
+                            CascadingDropdown(
+                                title=_("How to end the message:"),
+                                sorted=False,
+                                choices=[
+                                    (
+                                        "expire",
+                                        _("Set the end time of the message to now"),
+                                    ),
+                                    (
+                                        "revoke",
+                                        _("Delete the message on the IDERI note server"),
+                                    ),
+                                ],
+                            ),
+                        ),
+                        (
+                            "skiprecovery",
+                            FixedValue(
+                                value=True,
+                                title=_("Do not create a message for the recovery"),
+                                totext=_("Only end the message of the problem."),
+                                help=_("If the message of the problem has been "
+                                       "ended, no new message is created for "
+                                       "the RECOVERY or acknowledgement."),
+                            ),
+                        ),
+                    ],
+                ),
+            ),
+            (
+                "inote_escalation",
+                ListOf(
+                    Dictionary(
+                        optional_keys=["display", "recipients"],
+                        elements=[
+                            (
+                                "delay",
+                                Integer(
+                                    title=_("Escalate after"),
+                                    unit=_("minutes"),
+                                    default_value=15,
+                                    minvalue=1,
+                                ),
+                            ),
+                            (
+                                "display",
+                                DropdownChoice(
+                                    title=_("Show the message"),
+                                    choices=[
+                                        ("showfullscreen", _("Full screen")),
+                                        ("showfullscreenandlock", _("Full screen and lock")),
+                                    ],
+                                ),
+                            ),
+                            (
+                                "recipients",
+                                TextInput(
+                                    title=_("Add recipients"),
+                                    placeholder=_("Comma separated list: '<dom>\<user>, <dom>\<group>, <dom>\<computer>$'"),
+                                    size=60,
+                                    allow_empty=False,
+                                ),
+                            ),
+                        ],
+                    ),
+                    title=_("Escalate unacknowledged alerts"),
+                    help=_("Escalates ALERT messages (CRITICAL and DOWN) "
+                           "which have not been acknowledged after the given "
+                           "time: the message is updated on the IDERI note "
+                           "server to be shown in full screen and/or sent to "
+                           "more recipients. Escalation stops as soon as the "
+                           "problem is acknowledged (also in IDERI note, see "
+                           "'inote-receipt-poller') or recovers. Requires "
+                           "'End the message of a problem on recovery' and the "
+                           "escalator 'inote-escalator' running in the site."),
+                    add_label=_("Add escalation step"),
+                ),
+            ),
             (
                 "checkmkUrl",
                 HTTPUrl(
@@ -233,6 +721,132 @@ register_notification_parameters(
                     allow_empty=False,
                 ),
             ),
+            (
+                "inote_bulk_maxevents",
+                Integer(
+                    title = _("Maximum events per bulk message"),
+                    help = _("Only used if notification bulking is enabled for "
+                             "this rule. All events of a bulk are combined into "
+                             "one IDERI note digest message per recipient set. "
+                             "If a bulk holds more events, additional digest "
+                             "messages are created."),
+                    size = 20,
+                    default_value=30,
+                    minvalue=1,
+                ),
+            ),
+            (
+                "inote_coalesce",
+                Dictionary(
+                    title=_("Coalesce event storms and flapping"),
+                    help=_("Suppresses notifications for a host or service "
+                           "(per recipient set) within a time window: exact "
+                           "duplicates, PROBLEM and RECOVERY notifications "
+                           "while the host or service is flapping and rapid "
+                           "PROBLEM/RECOVERY sequences exceeding the maximum "
+                           "number of state changes. The next message sent "
+                           "for the host or service shows the number of "
+                           "suppressed notifications."),
+                    optional_keys=[],
+                    elements=[
+                        (
+                            "window",
+                            Integer(
+                                title=_("Time window (seconds)"),
+                                default_value=300,
+                                minvalue=1,
+                            ),
+                        ),
+                        (
+                            "maxchanges",
+                            Integer(
+                                title=_("Maximum PROBLEM/RECOVERY notifications within the time window"),
+                                default_value=3,
+                                minvalue=1,
+                            ),
+                        ),
+                    ],
+                ),
+            ),
+            (
+                "inote_ratelimit",
+                Dictionary(
+                    title=_("Rate limit per recipient set"),
+                    help=_("Limits the messages per minute for a recipient set, "
+                           "separately for every priority (token bucket shared "
+                           "by all notifications of the site). Notifications "
+                           "exceeding the limit are combined into one ticker "
+                           "message per recipient set, which is updated with "
+                           "the number of notifications and the latest events "
+                           "and has the highest priority of its events. If the "
+                           "summary cannot be sent, alerts are sent on their "
+                           "own and all other notifications are retried by "
+                           "Checkmk."),
+                    optional_keys=[],
+                    elements=[
+                        (
+                            "rate",
+                            Integer(
+                                title=_("Messages per minute"),
+                                default_value=6,
+                                minvalue=1,
+                            ),
+                        ),
+                        (
+                            "burst",
+                            Integer(
+                                title=_("Burst (messages allowed at once)"),
+                                default_value=10,
+                                minvalue=1,
+                            ),
+                        ),
+                    ],
+                ),
+            ),
+            (
+                "inote_payload",
+                Dictionary(
+                    title=_("Payload size budget"),
+                    help=_("Limits the size of the message text. Plugin output "
+                           "exceeding the budget per output field is cut, "
+                           "keeping its first and last lines, the cut is "
+                           "marked with the number of bytes removed. The whole "
+                           "message text (for bulk notifications the digest) "
+                           "is cut to the total budget."),
+                    optional_keys=["linkonly"],
+                    elements=[
+                        (
+                            "output",
+                            Integer(
+                                title=_("Budget per output field"),
+                                unit=_("bytes"),
+                                default_value=2048,
+                                minvalue=256,
+                            ),
+                        ),
+                        (
+                            "total",
+                            Integer(
+                                title=_("Budget for the whole message text"),
+                                unit=_("bytes"),
+                                default_value=8192,
+                                minvalue=512,
+                            ),
+                        ),
+                        (
+                            "linkonly",
+                            FixedValue(
+                                value=True,
+                                title=_("Replace long output by the link to Checkmk"),
+                                totext=_("Output exceeding the budget is replaced by a note, the link shows it"),
+                                help=_("Only used if the message has a link to "
+                                       "Checkmk (see 'The URL to check_mk web "
+                                       "interface'), otherwise the output is cut."),
+                            ),
+                        ),
+                    ],
+                ),
+            ),
             (
                 "inote_plugin_loglevel",
                 CascadingDropdown(
@@ -262,6 +876,59 @@ register_notification_parameters(
                     ],
                 ),
             ),
+            (
+                "inote_plugin_tracesample",
+                Integer(
+                    title=_("Trace sample rate (percent)"),
+                    help=_("Only used with log level 'Trace'. Writes the "
+                           "trace output for this share of the notifications "
+                           "only, all others are logged with level 'Debug'."),
+                    size=20,
+                    default_value=100,
+                    minvalue=1,
+                    maxvalue=100,
+                ),
+            ),
+            (
+                "inote_plugin_metrics",
+                FixedValue(
+                    value=True,
+                    title=_("Record metrics"),
+                    totext=_("True"),
+                    help=_("Record the duration of every phase of the "
+                           "notification (including the round trip to the IDERI "
+                           "note API) and count sent, failed, spooled and "
+                           "suppressed messages. Use 'inote-metrics' to export "
+                           "them as Checkmk local check or Prometheus textfile."),
+                ),
+            ),
+            (
+                "inote_plugin_profile",
+                FixedValue(
+                    value=True,
+                    title=_("Profile the notification script"),
+                    totext=_("True"),
+                    help=_("Write a profile of every notification to "
+                           "var/inote/profiles of the site (the newest 200 are "
+                           "kept). Use 'inote-profile-report' to merge them "
+                           "into a report of the hot spots. Profiling slows "
+                           "down the notifications, only enable it to find "
+                           "out why notifications are slow."),
+                ),
+            ),
+            (
+                "inote_plugin_dumpcontext",
+                FixedValue(
+                    value=True,
+                    title=_("Dump notification contexts"),
+                    totext=_("True"),
+                    help=_("Append every notification context (without the "
+                           "API password) to var/inote/contexts.jsonl of the "
+                           "site. The file can be replayed with the replay tool "
+                           "of the repository for load tests. Note: the file "
+                           "grows with every notification."),
+                ),
+            ),
         ],
     )
 )
\ No newline at end of file